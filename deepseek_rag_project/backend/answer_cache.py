@@ -0,0 +1,89 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+from config import Config
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+class AnswerCache:
+    """语义答案缓存：检索到的切片集合完全一致且问题向量足够相似时，直接复用之前的回答。"""
+
+    def __init__(self, maxsize=Config.ANSWER_CACHE_SIZE, threshold=Config.ANSWER_CACHE_THRESHOLD, ttl=Config.ANSWER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl
+        # {切片 ID 元组: [entry, ...]}，先按切片集合精确匹配，再在少量候选中比较向量
+        self.buckets = {}
+        self.order = OrderedDict()  # entry_id -> chunk_key，用于 LRU 淘汰
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, embedding, chunk_ids):
+        chunk_key = tuple(chunk_ids)
+        now = time.monotonic()
+        with self.lock:
+            best, best_score = None, self.threshold
+            for entry in self.buckets.get(chunk_key, []):
+                if entry["expires_at"] <= now:
+                    continue
+                score = _cosine(embedding, entry["embedding"])
+                if score >= best_score:
+                    best, best_score = entry, score
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.order.move_to_end(best["id"])
+            return best["answer"]
+
+    def store(self, embedding, chunk_ids, file_names, answer):
+        chunk_key = tuple(chunk_ids)
+        with self.lock:
+            entry = {
+                "id": self.next_id,
+                "embedding": list(embedding),
+                "files": set(file_names),
+                "answer": answer,
+                "expires_at": time.monotonic() + self.ttl,
+            }
+            self.next_id += 1
+            self.buckets.setdefault(chunk_key, []).append(entry)
+            self.order[entry["id"]] = chunk_key
+            while len(self.order) > self.maxsize:
+                entry_id, key = self.order.popitem(last=False)
+                self._remove(key, lambda e: e["id"] == entry_id)
+
+    def _remove(self, chunk_key, predicate):
+        remaining = [e for e in self.buckets.get(chunk_key, []) if not predicate(e)]
+        if remaining:
+            self.buckets[chunk_key] = remaining
+        else:
+            self.buckets.pop(chunk_key, None)
+
+    def invalidate_file(self, file_name):
+        """文件重新入库或删除时，清掉引用了该文件切片的答案"""
+        with self.lock:
+            for chunk_key in list(self.buckets):
+                for entry in self.buckets[chunk_key]:
+                    if file_name in entry["files"]:
+                        self.order.pop(entry["id"], None)
+                self._remove(chunk_key, lambda e: file_name in e["files"])
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": Config.ANSWER_CACHE,
+                "size": len(self.order),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+answer_cache = AnswerCache()
@@ -0,0 +1,121 @@
+"""
+切片策略对比：python -m benchmarks.bench_chunking [--strategies sentence,regulation] [--top-k 2] [--no-embed]
+
+对 data/files 用同样的解析结果分别按各策略切片，对比：
+  - 切片数、平均 / 合计 token (embedding 输入，含元数据)：决定索引大小与入库耗时
+  - 条款截断数：完整条文不在任何单个切片中的条款 (跨切片被切开)
+  - 出处命中率：问策测试问题清单上精确 (暴力内积) Top-K 中至少一个切片来自标准出处法规的问题占比
+  - Top-K 上下文 token：命中切片送入 prompt 的平均长度
+编码走 embedding 磁盘缓存，重复运行只编码新切片；--no-embed 只统计切片。
+"""
+import re
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from config import Config
+from benchmarks.question_set import load_questions, is_hit
+
+def _compact(text):
+    return re.sub(r"\s+", "", text)
+
+def count_cut_articles(documents, nodes):
+    """按法规结构解析出的条款中，完整条文不在任何单个切片里的条数"""
+    from regulation_splitter import parse_articles
+    chunks = [_compact(n.get_content()) for n in nodes]
+    _, articles = parse_articles("\n".join(d.get_content() for d in documents))
+    total = cut = 0
+    for _, _, number, text, _ in articles:
+        if not number:
+            continue
+        total += 1
+        body = _compact(text)
+        cut += not any(body in chunk for chunk in chunks)
+    return total, cut
+
+def chunk_corpus(parsed, strategy):
+    from llama_index.core.schema import MetadataMode
+    from llama_index.core.utils import get_tokenizer
+    from vector_store import build_text_splitter
+
+    splitter = build_text_splitter(strategy)
+    tokenizer = get_tokenizer()
+    texts, llm_tokens, file_names = [], [], []
+    articles = cut = 0
+    for documents in parsed:
+        nodes = splitter.get_nodes_from_documents(documents)
+        total, n_cut = count_cut_articles(documents, nodes)
+        articles += total
+        cut += n_cut
+        for node in nodes:
+            texts.append(node.get_content(metadata_mode=MetadataMode.EMBED))
+            llm_tokens.append(len(tokenizer(node.get_content(metadata_mode=MetadataMode.LLM))))
+            file_names.append(node.metadata.get("file_name", ""))
+    embed_tokens = [len(tokenizer(t)) for t in texts]
+    return {
+        "strategy": strategy,
+        "texts": texts,
+        "file_names": file_names,
+        "llm_tokens": llm_tokens,
+        "chunks": len(texts),
+        "avg_tokens": float(np.mean(embed_tokens)) if texts else 0.0,
+        "total_tokens": int(sum(embed_tokens)),
+        "articles": articles,
+        "cut_articles": cut,
+    }
+
+def evaluate(result, questions, query_vectors, top_k):
+    from embedding_provider import get_embedding_provider
+    corpus = np.asarray(get_embedding_provider().embed_documents(result["texts"]), dtype=np.float32)
+    scores = query_vectors @ corpus.T
+    hits, context = 0, 0
+    for (_, sources), row in zip(questions, scores):
+        top = np.argsort(-row)[:top_k]
+        hits += any(is_hit(result["file_names"][i], sources) for i in top)
+        context += sum(result["llm_tokens"][i] for i in top)
+    result["hit_rate"] = hits / len(questions)
+    result["context_tokens"] = context / len(questions)
+
+def main():
+    parser = argparse.ArgumentParser(description="切片策略的切片数与检索命中对比")
+    parser.add_argument("--dir", default=Config.FILES_DIR)
+    parser.add_argument("--strategies", default="sentence,regulation")
+    parser.add_argument("--top-k", type=int, default=Config.SIMILARITY_TOP_K)
+    parser.add_argument("--workers", type=int, default=Config.INGEST_WORKERS)
+    parser.add_argument("--no-embed", action="store_true", help="只统计切片，不编码、不测命中")
+    parser.add_argument("--json", default=None, help="结果另存为 JSON")
+    args = parser.parse_args()
+
+    from bulk_ingest import collect_files, load_documents
+    files = collect_files(args.dir)
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        parsed = [docs for docs in pool.map(load_documents, files) if docs]
+    print(f"📚 {len(parsed)} 个文件, {sum(len(d) for d in parsed)} 页 (CHUNK_SIZE={Config.CHUNK_SIZE}, "
+          f"CHUNK_OVERLAP={Config.CHUNK_OVERLAP})")
+
+    results = [chunk_corpus(parsed, s.strip()) for s in args.strategies.split(",") if s.strip()]
+
+    if not args.no_embed:
+        from embedding_provider import get_embedding_provider
+        questions = load_questions()
+        query_vectors = np.asarray(get_embedding_provider().embed_queries([q for q, _ in questions]), dtype=np.float32)
+        for result in results:
+            evaluate(result, questions, query_vectors, args.top_k)
+        print(f"❓ {len(questions)} 个问题, Top-{args.top_k}")
+
+    print(f"\n   {'策略':<12}{'切片数':>8}{'平均token':>10}{'合计token':>11}{'条款截断':>12}{'出处命中率':>10}{'上下文token':>12}")
+    for r in results:
+        cut = f"{r['cut_articles']}/{r['articles']}"
+        hit = f"{r['hit_rate']:.1%}" if "hit_rate" in r else "-"
+        context = f"{r['context_tokens']:.0f}" if "context_tokens" in r else "-"
+        print(f"   {r['strategy']:<12}{r['chunks']:>8}{r['avg_tokens']:>10.0f}{r['total_tokens']:>11}{cut:>12}{hit:>10}{context:>12}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump([{k: v for k, v in r.items() if k not in ("texts", "file_names", "llm_tokens")} for r in results],
+                      f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
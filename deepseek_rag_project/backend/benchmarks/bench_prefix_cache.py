@@ -0,0 +1,95 @@
+"""
+Prompt 前缀复用基准：python -m benchmarks.bench_prefix_cache [--turns 5] [--video]
+
+在同一个多轮会话中逐轮发送问题，对比两种 prompt 布局的首 token 延迟 (TTFT)：
+  - 旧布局：视频报告与本轮检索资料拼进系统提示词，每轮资料变化导致整段前缀失效
+  - 新布局：静态系统提示词 → 视频报告 → 历史 → 本轮资料 + 问题 (prompts.build_chat_messages)
+同时打印 Ollama 返回的 prompt_eval_count (本轮实际重新计算的 prompt token 数)。
+需要运行中的 Ollama (Config.LLM_API_BASE)；检索资料取自问策测试问题清单对应的法规片段替身，不依赖 Milvus。
+"""
+import json
+import time
+import argparse
+
+import httpx
+
+from config import Config
+from prompts import SYSTEM_PROMPT, NO_RAG_NOTICE, build_chat_messages, format_rag_chunks
+from benchmarks.bench_query_batching import QUESTIONS, percentile
+
+VIDEO_REPORT = "\n".join(
+    f"[{t}s] 画面中施工人员在工地现场作业，塔吊正在吊装钢筋，右侧有安全警示标志。" for t in range(0, 120, 5)
+)
+
+def fake_chunks(turn):
+    # 每轮检索到的资料不同，模拟真实会话
+    return [f"第{turn * 3 + i + 1}条 有关部门应当依法履行监督管理职责，" * 12 for i in range(2)]
+
+def legacy_messages(query, history, video, chunks):
+    system = SYSTEM_PROMPT
+    if video:
+        system += f"\n\n=== 🎥 视频/图片分析报告 (高优先级) ===\n{video}\n"
+    system += f"\n\n=== 📚 知识库参考资料 ===\n{format_rag_chunks(chunks)}\n" if chunks else f"\n{NO_RAG_NOTICE}"
+    return [{"role": "system", "content": system}, *history, {"role": "user", "content": query}]
+
+def prefix_stable_messages(query, history, video, chunks):
+    messages, _ = build_chat_messages(query, history=history, video_context=video, rag_chunks=chunks)
+    return [{"role": m.role.value, "content": m.content} for m in messages]
+
+def chat(client, messages, max_tokens):
+    """流式调用 /api/chat，返回 (TTFT 秒, 回答, prompt_eval_count)"""
+    payload = {
+        "model": Config.LLM_MODEL,
+        "messages": messages,
+        "stream": True,
+        "keep_alive": Config.LLM_KEEP_ALIVE,
+        "options": {"num_ctx": Config.CONTEXT_WINDOW, "num_predict": max_tokens, "temperature": 0},
+    }
+    start = time.perf_counter()
+    ttft, parts, prompt_eval = None, [], None
+    with client.stream("POST", f"{Config.LLM_API_BASE}/api/chat", json=payload) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            content = chunk.get("message", {}).get("content", "")
+            if content and ttft is None:
+                ttft = time.perf_counter() - start
+            parts.append(content)
+            if chunk.get("done"):
+                prompt_eval = chunk.get("prompt_eval_count")
+    return ttft or (time.perf_counter() - start), "".join(parts), prompt_eval
+
+def run_session(client, build, turns, video, max_tokens):
+    history, results = [], []
+    for turn in range(turns):
+        query = QUESTIONS[turn % len(QUESTIONS)]
+        ttft, answer, prompt_eval = chat(client, build(query, history, video, fake_chunks(turn)), max_tokens)
+        results.append((ttft, prompt_eval))
+        history += [{"role": "user", "content": query}, {"role": "assistant", "content": answer}]
+        history = history[-Config.HISTORY_MESSAGES:]
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt 前缀复用 TTFT 基准")
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--video", action="store_true", help="会话中带视频分析报告")
+    parser.add_argument("--max-tokens", type=int, default=64, help="每轮生成的 token 上限")
+    args = parser.parse_args()
+
+    video = VIDEO_REPORT if args.video else ""
+    with httpx.Client(timeout=600) as client:
+        # 预热：加载模型，避免首轮把冷启动算进某一种布局
+        chat(client, [{"role": "user", "content": "你好"}], 1)
+        for name, build in (("旧布局", legacy_messages), ("前缀稳定", prefix_stable_messages)):
+            results = run_session(client, build, args.turns, video, args.max_tokens)
+            ttfts = [r[0] for r in results]
+            print(f"\n📊 {name} ({args.turns} 轮, 视频={'是' if video else '否'})")
+            for i, (ttft, prompt_eval) in enumerate(results):
+                print(f"   第 {i + 1} 轮: TTFT {ttft * 1000:.0f} ms, 重新计算 prompt {prompt_eval} tokens")
+            later = ttfts[1:] or ttfts
+            print(f"   第 2 轮起 TTFT p50 {percentile(later, 50) * 1000:.0f} ms / max {max(later) * 1000:.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Query embedding 微批处理基准：python -m benchmarks.bench_query_batching [--concurrency 16] [--requests 400] [--fake]
+
+对比两种路径的 p50/p99 延迟和 QPS：
+  - 逐请求：每个查询在检索线程池中单独编码 (batch=1，旧路径)
+  - 微批：  查询交给 QueryEmbeddingBatcher 合并编码
+默认加载真实的 Embedding 模型；--fake 使用 "固定开销 + 每条开销" 的 sleep 模型，便于在无模型环境下运行。
+"""
+import time
+import asyncio
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from embedding_batcher import QueryEmbeddingBatcher
+
+QUESTIONS = [
+    "武汉市城市绿化条例对绿地率有什么要求？",
+    "耕地占用税的纳税人是谁？",
+    "历史文化名城保护规划由谁审批？",
+    "基本农田保护区如何划定？",
+    "建设项目使用林地需要哪些审批材料？",
+    "城市紫线管理办法适用于哪些范围？",
+]
+
+class FakeEmbedModel:
+    """一次前向的耗时 = base + per_item × batch"""
+
+    def __init__(self, base_ms, per_item_ms):
+        self.base = base_ms / 1000
+        self.per_item = per_item_ms / 1000
+
+    def embed_queries(self, texts):
+        time.sleep(self.base + self.per_item * len(texts))
+        return [[0.0] * Config.EMBEDDING_DIM for _ in texts]
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+async def drive(embed_one, concurrency, total):
+    latencies = []
+    counter = iter(range(total))
+
+    async def client():
+        for i in counter:
+            t0 = time.perf_counter()
+            await embed_one(QUESTIONS[i % len(QUESTIONS)] + f" #{i}")
+            latencies.append(time.perf_counter() - t0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+def report(name, latencies, elapsed):
+    print(
+        f"   {name:<8} p50 {percentile(latencies, 50) * 1000:7.1f} ms   "
+        f"p99 {percentile(latencies, 99) * 1000:7.1f} ms   "
+        f"mean {statistics.mean(latencies) * 1000:7.1f} ms   "
+        f"QPS {len(latencies) / elapsed:7.1f}"
+    )
+
+async def main_async(args):
+    if args.fake:
+        embed_fn = FakeEmbedModel(args.fake_base_ms, args.fake_item_ms).embed_queries
+    else:
+        from embedding_provider import get_embedding_provider
+        embed_fn = get_embedding_provider().embed_queries
+        embed_fn(["warmup"])
+
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=Config.RETRIEVAL_WORKERS)
+
+    async def per_request(text):
+        return (await loop.run_in_executor(pool, embed_fn, [text]))[0]
+
+    batcher = QueryEmbeddingBatcher(embed_fn, max_batch_size=args.max_batch, max_wait_ms=args.max_wait_ms)
+
+    print(f"\n📊 并发 {args.concurrency}, 请求 {args.requests}, 微批 max_batch={args.max_batch} max_wait={args.max_wait_ms}ms")
+    report("逐请求", *await drive(per_request, args.concurrency, args.requests))
+    report("微批", *await drive(batcher.aembed, args.concurrency, args.requests))
+    print(f"   平均批大小 {batcher.stats['queries'] / max(batcher.stats['batches'], 1):.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Query embedding 微批处理延迟/吞吐基准")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--max-batch", type=int, default=Config.QUERY_BATCH_MAX_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=Config.QUERY_BATCH_MAX_WAIT_MS)
+    parser.add_argument("--fake", action="store_true", help="使用 sleep 成本模型代替真实模型")
+    parser.add_argument("--fake-base-ms", type=float, default=15)
+    parser.add_argument("--fake-item-ms", type=float, default=2)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+if __name__ == "__main__":
+    main()
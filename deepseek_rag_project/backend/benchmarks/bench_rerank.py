@@ -0,0 +1,67 @@
+"""
+Rerank 基准：python -m benchmarks.bench_rerank [--candidates 20] [--top-k 2]
+
+在问策测试问题清单上对比 "稠密/融合 Top-K" 与 "宽候选 + cross-encoder 重排 Top-K"：
+  - 出处命中率：Top-K 中至少一个切片来自标准出处法规的问题占比
+  - 出处精度：  Top-K 切片中来自标准出处法规的比例 (回答可依据的资料占比)
+  - 重排延迟 p50/p99，以及超出 RERANK_BUDGET_MS 的次数 (线上会回退稠密排序)
+需要 Milvus 与已入库的 data/files。
+"""
+import time
+import argparse
+
+from config import Config
+from benchmarks.question_set import load_questions, is_hit
+from benchmarks.bench_query_batching import percentile
+
+def grounding(nodes, sources):
+    hits = [is_hit(n.node.metadata.get("file_name", ""), sources) for n in nodes]
+    return any(hits), (sum(hits) / len(hits) if hits else 0.0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Rerank 延迟与出处命中基准")
+    parser.add_argument("--candidates", type=int, default=Config.RERANK_CANDIDATES)
+    parser.add_argument("--top-k", type=int, default=Config.SIMILARITY_TOP_K)
+    args = parser.parse_args()
+
+    from rag_service import get_rag_service
+    from reranker import get_reranker
+    from embedding_provider import get_embedding_provider
+    svc = get_rag_service()
+    reranker = get_reranker()
+    embed_fn = get_embedding_provider().embed_queries
+
+    questions = load_questions()
+    base = {"hit": 0, "precision": 0.0}
+    rr = {"hit": 0, "precision": 0.0}
+    latencies, over_budget = [], 0
+
+    for question, sources in questions:
+        embedding = embed_fn([question])[0]
+        candidates = svc._retrieve_sync(question, embedding, args.candidates)
+
+        hit, precision = grounding(candidates[:args.top_k], sources)
+        base["hit"] += hit
+        base["precision"] += precision
+
+        t0 = time.perf_counter()
+        scores = reranker.score(question, [n.node.get_content() for n in candidates])
+        elapsed = time.perf_counter() - t0
+        latencies.append(elapsed)
+        over_budget += elapsed * 1000 > Config.RERANK_BUDGET_MS
+        reranked = [n for n, _ in sorted(zip(candidates, scores), key=lambda x: x[1], reverse=True)][:args.top_k]
+
+        hit, precision = grounding(reranked, sources)
+        rr["hit"] += hit
+        rr["precision"] += precision
+
+    n = len(questions)
+    print(f"\n📊 {n} 个问题, 候选 {args.candidates} -> Top {args.top_k}, Backend={Config.RERANK_BACKEND}")
+    print(f"   {'':<10}{'出处命中率':>10}{'出处精度':>10}")
+    print(f"   {'稠密/融合':<10}{base['hit'] / n:>10.2%}{base['precision'] / n:>10.2%}")
+    print(f"   {'重排':<10}{rr['hit'] / n:>10.2%}{rr['precision'] / n:>10.2%}")
+    print(f"   重排延迟 p50 {percentile(latencies, 50) * 1000:.0f} ms / p99 {percentile(latencies, 99) * 1000:.0f} ms, "
+          f"超出预算 {over_budget}/{n} 次 (预算 {Config.RERANK_BUDGET_MS}ms)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+并发检索阻塞测试：python -m benchmarks.bench_retrieval_concurrency [--chats 8] [--retrieve-ms 300] [--blocking]
+
+用假检索 (同步 sleep 模拟 CPU embedding + Milvus 往返) 和假 LLM (固定间隔吐 token) 并发驱动
+RAGService.chat_stream，统计事件循环最大卡顿和每路 token 流的最大间隔。
+若检索阻塞事件循环，卡顿会接近 检索耗时 × 并发数；--blocking 复现旧的同步检索作为对照。
+卡顿超过检索耗时一半时以非零状态码退出。
+"""
+import sys
+import time
+import uuid
+import asyncio
+import argparse
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from rag_service import RAGService
+from generation_scheduler import GenerationScheduler
+
+class FakeNode:
+    """同时充当 NodeWithScore 与其 node (sources 事件读取 n.node.metadata / n.score)"""
+
+    def __init__(self, text):
+        self.text = text
+        self.node = self
+        self.node_id = text
+        self.metadata = {"file_name": "bench.txt"}
+        self.score = 1.0
+
+    def get_content(self):
+        return self.text
+
+class FakeLLM:
+    def __init__(self, tokens, token_ms):
+        self.tokens = tokens
+        self.token_ms = token_ms
+
+    async def astream_chat(self, messages):
+        async def gen():
+            for i in range(self.tokens):
+                await asyncio.sleep(self.token_ms / 1000)
+                yield SimpleNamespace(delta=f"t{i} ")
+        return gen()
+
+class BenchRAGService(RAGService):
+    def __init__(self, retrieve_ms, tokens, token_ms, blocking):
+        self.index = object()
+        self.llm = FakeLLM(tokens, token_ms)
+        self.reranker = None
+        self.summarizer = None
+        # 只测检索对事件循环的影响，生成不限并发
+        self.scheduler = GenerationScheduler(max_concurrency=1024)
+        self.retrieval_executor = ThreadPoolExecutor(max_workers=Config.RETRIEVAL_WORKERS)
+        self.query_batcher = None
+        self.sparse_index = None
+        self.retrieve_ms = retrieve_ms
+        self.blocking = blocking
+
+    async def embed_query(self, query):
+        return None
+
+    def _retrieve_sync(self, query, embedding=None, top_k=Config.SIMILARITY_TOP_K):
+        time.sleep(self.retrieve_ms / 1000)
+        return [FakeNode(f"关于「{query}」的参考资料")]
+
+    async def retrieve(self, query):
+        if self.blocking:
+            return self._retrieve_sync(query)
+        return await super().retrieve(query)
+
+async def run_chat(svc, idx):
+    start = time.perf_counter()
+    last = None
+    ttft = None
+    max_gap = 0.0
+    async for _ in svc.chat_stream(f"问题 {idx}", str(uuid.uuid4())):
+        now = time.perf_counter()
+        if ttft is None:
+            ttft = now - start
+        else:
+            max_gap = max(max_gap, now - last)
+        last = now
+    return ttft, max_gap
+
+async def heartbeat(stop, interval=0.01):
+    max_lag = 0.0
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(interval)
+        max_lag = max(max_lag, time.perf_counter() - t0 - interval)
+    return max_lag
+
+async def main_async(args):
+    svc = BenchRAGService(args.retrieve_ms, args.tokens, args.token_ms, args.blocking)
+    stop = asyncio.Event()
+    hb = asyncio.create_task(heartbeat(stop))
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_chat(svc, i) for i in range(args.chats)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    max_lag = await hb
+
+    ttfts = sorted(r[0] for r in results)
+    gaps = [r[1] for r in results]
+    mode = "同步检索 (旧)" if args.blocking else "线程池检索"
+    print(f"\n📊 {mode}: {args.chats} 路并发, 检索 {args.retrieve_ms}ms, {args.tokens} tokens × {args.token_ms}ms")
+    print(f"   总耗时            {elapsed * 1000:.0f} ms")
+    print(f"   事件循环最大卡顿  {max_lag * 1000:.1f} ms")
+    print(f"   TTFT min/max      {ttfts[0] * 1000:.0f} / {ttfts[-1] * 1000:.0f} ms")
+    print(f"   最大 token 间隔   {max(gaps) * 1000:.1f} ms")
+    return max_lag
+
+def main():
+    parser = argparse.ArgumentParser(description="验证检索不会阻塞其他会话的 token 流")
+    parser.add_argument("--chats", type=int, default=8)
+    parser.add_argument("--retrieve-ms", type=float, default=300)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-ms", type=float, default=20)
+    parser.add_argument("--blocking", action="store_true", help="复现旧的同步检索作为对照")
+    args = parser.parse_args()
+
+    max_lag = asyncio.run(main_async(args))
+    if not args.blocking and max_lag * 1000 > args.retrieve_ms / 2:
+        print("❌ 检索阻塞了事件循环")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+会话存储负载基准：python -m benchmarks.bench_session_store [--threads 32] [--sessions 200] [--messages 200] [--turns 20]
+
+在临时数据库上模拟并发对话，每轮 = 写入问题 → 读会话上下文 → 读最近历史 → 写入回答，外加侧边栏翻页读取会话列表。
+对比两种实现的吞吐与各操作 p50/p99 延迟：
+  - 旧实现：单连接 + 全局锁、messages 无索引、读取全部消息后在 Python 中截取最近几条、会话列表不分页
+  - 新实现：session_manager.SessionManager (WAL、每线程连接、索引、游标分页、write-behind 合并提交)
+不依赖模型与 Milvus。
+"""
+import os
+import time
+import uuid
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from session_manager import SessionManager
+from benchmarks.bench_query_batching import percentile
+
+class LegacySessionStore:
+    """改造前的实现：一个连接、一把锁、每条消息一次提交"""
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, title TEXT, created_at TIMESTAMP, context TEXT)')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, '
+                'role TEXT, content TEXT, created_at TIMESTAMP)'
+            )
+            self.conn.commit()
+
+    def create_session(self, title="新会话"):
+        session_id = str(uuid.uuid4())
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO sessions (id, title, created_at, context) VALUES (?, ?, ?, ?)',
+                (session_id, title, datetime.now(), "")
+            )
+            self.conn.commit()
+        return session_id
+
+    def get_session_context(self, session_id):
+        with self.lock:
+            row = self.conn.execute('SELECT context FROM sessions WHERE id = ?', (session_id,)).fetchone()
+        return row[0] if row else ""
+
+    def add_message(self, session_id, role, content):
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)',
+                (session_id, role, content, datetime.now())
+            )
+            self.conn.commit()
+
+    def get_recent_messages(self, session_id, limit):
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT role, content FROM messages WHERE session_id = ? ORDER BY id ASC', (session_id,)
+            ).fetchall()
+        return [{"role": r[0], "content": r[1]} for r in rows][-limit:]
+
+    def get_sessions(self, limit=None, cursor=None):
+        with self.lock:
+            rows = self.conn.execute('SELECT id, title, created_at FROM sessions ORDER BY created_at DESC').fetchall()
+        return [{"id": r[0], "title": r[1], "created_at": r[2]} for r in rows], None
+
+def populate(store, sessions, messages):
+    ids = []
+    for i in range(sessions):
+        session_id = store.create_session(title=f"会话 {i}")
+        for j in range(messages // 2):
+            store.add_message(session_id, "user", f"问题 {j} " * 10)
+            store.add_message(session_id, "assistant", f"回答 {j} " * 80)
+        ids.append(session_id)
+    return ids
+
+def run(store, session_ids, threads, turns):
+    latencies = defaultdict(list)
+
+    def timed(op, fn, *args):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        latencies[op].append(time.perf_counter() - t0)
+        return result
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(turns):
+            session_id = rng.choice(session_ids)
+            timed("写消息", store.add_message, session_id, "user", "新的问题" * 10)
+            timed("读上下文", store.get_session_context, session_id)
+            timed("读最近历史", store.get_recent_messages, session_id, Config.HISTORY_MESSAGES)
+            timed("写消息", store.add_message, session_id, "assistant", "新的回答" * 80)
+            if rng.random() < 0.2:
+                timed("会话列表", store.get_sessions, Config.SESSIONS_PAGE_SIZE)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, range(threads)))
+    # write-behind 的写入计入总耗时
+    if hasattr(store, "flush"):
+        store.flush()
+    elapsed = time.perf_counter() - start
+    return elapsed, latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="会话存储并发负载基准")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=200, help="每个会话预置的消息数")
+    parser.add_argument("--turns", type=int, default=20, help="每个线程的对话轮数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, factory in (("旧实现", LegacySessionStore), ("新实现", SessionManager)):
+            store = factory(os.path.join(tmp, f"{factory.__name__}.db"))
+            session_ids = populate(store, args.sessions, args.messages)
+            if hasattr(store, "flush"):
+                store.flush()
+            elapsed, latencies = run(store, session_ids, args.threads, args.turns)
+            total_ops = sum(len(v) for v in latencies.values())
+            print(f"\n📊 {name}: {args.threads} 线程 × {args.turns} 轮, 总耗时 {elapsed:.2f}s, {total_ops / elapsed:.0f} ops/s")
+            for op, values in latencies.items():
+                print(f"   {op:<8} p50 {percentile(values, 50) * 1000:7.2f} ms   p99 {percentile(values, 99) * 1000:7.2f} ms")
+            if hasattr(store, "close"):
+                store.close()
+
+if __name__ == "__main__":
+    main()
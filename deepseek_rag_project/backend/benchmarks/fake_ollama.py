@@ -0,0 +1,187 @@
+"""
+流式 Ollama 替身：python -m benchmarks.fake_ollama [--port 11435] [--ttft-ms 250] [--tokens-per-sec 20] [--tokens 64] [--parallel 2]
+
+实现 /api/chat (流式 NDJSON 与非流式) 和 /api/tags，返回格式与 Ollama 一致，llama-index 的 Ollama 客户端可直接连接：
+  - 首 token 延迟 = ttft_ms + prompt 长度 × prefill_ms_per_kchar / 1000
+  - 之后按 tokens_per_sec 逐个输出，回答长度取 tokens 与请求 options.num_predict 中较小者
+  - parallel 模拟 OLLAMA_NUM_PARALLEL：超出的请求在替身内部排队 (计入 TTFT)
+  - --contention 模拟 CPU 后端的总吞吐恒定：同时生成 N 路时每路速度降为 1/N
+只用标准库，供 benchmarks.loadtest 在无 GPU、无网络的机器上压测整条链路。
+"""
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import Config
+
+ANSWER_TEXT = (
+    "根据知识库中的相关法规，该事项应当由县级以上人民政府有关主管部门依法审批，"
+    "申请人需提交项目批准文件、用地范围图和补偿安置方案等材料，具体要求以最新条例为准。"
+)
+
+class FakeOllama:
+    def __init__(self, ttft_ms=250, tokens_per_sec=20.0, tokens=64, parallel=2, prefill_ms_per_kchar=0.0, contention=False):
+        self.ttft = ttft_ms / 1000
+        self.token_interval = 1 / tokens_per_sec if tokens_per_sec > 0 else 0.0
+        self.tokens = tokens
+        self.prefill_per_char = prefill_ms_per_kchar / 1000 / 1000
+        self.contention = contention
+        self.slots = threading.Semaphore(parallel) if parallel > 0 else None
+        self.lock = threading.Lock()
+        self.active = 0
+        self.stats = {"requests": 0, "streamed": 0, "disconnects": 0, "max_active": 0}
+
+    def _chunk(self, content, done=False, **extra):
+        return {
+            "model": Config.LLM_MODEL,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": done,
+            **extra,
+        }
+
+    def generate(self, body):
+        """按请求参数产生 (事件, 距上一事件的等待秒数)；第一个事件之前的等待即 TTFT"""
+        messages = body.get("messages") or []
+        prompt_chars = sum(len(m.get("content") or "") for m in messages)
+        num_predict = (body.get("options") or {}).get("num_predict", -1)
+        count = self.tokens if not num_predict or num_predict < 0 else min(self.tokens, num_predict)
+
+        start = time.perf_counter()
+        delay = self.ttft + prompt_chars * self.prefill_per_char
+        for i in range(count):
+            piece = ANSWER_TEXT[(i * 2) % len(ANSWER_TEXT):(i * 2) % len(ANSWER_TEXT) + 2]
+            yield self._chunk(piece), delay
+            with self.lock:
+                active = self.active
+            delay = self.token_interval * (active if self.contention else 1)
+        elapsed_ns = int((time.perf_counter() - start) * 1e9)
+        yield self._chunk(
+            "", done=True, done_reason="stop",
+            total_duration=elapsed_ns, load_duration=0,
+            prompt_eval_count=prompt_chars * 2 // 3, prompt_eval_duration=int(self.ttft * 1e9),
+            eval_count=count, eval_duration=max(0, elapsed_ns - int(self.ttft * 1e9)),
+        ), 0.0
+
+    def acquire(self):
+        if self.slots:
+            self.slots.acquire()
+        with self.lock:
+            self.active += 1
+            self.stats["requests"] += 1
+            self.stats["max_active"] = max(self.stats["max_active"], self.active)
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+        if self.slots:
+            self.slots.release()
+
+def make_handler(backend):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, payload, status=200):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json({"models": [{"name": Config.LLM_MODEL, "model": Config.LLM_MODEL}]})
+            elif self.path == "/api/stats":
+                with backend.lock:
+                    self._send_json({**backend.stats, "active": backend.active})
+            else:
+                self._send_json({"status": "Ollama is running"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send_json({"error": "invalid json"}, status=400)
+                return
+            if self.path != "/api/chat":
+                self._send_json({"error": f"unsupported endpoint {self.path}"}, status=404)
+                return
+
+            backend.acquire()
+            try:
+                if body.get("stream", True):
+                    self._stream(body)
+                else:
+                    parts, final = [], None
+                    for event, delay in backend.generate(body):
+                        time.sleep(delay)
+                        parts.append(event["message"]["content"])
+                        final = event
+                    final["message"]["content"] = "".join(parts)
+                    self._send_json(final)
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端中途断开 (如用户取消)，与真实 Ollama 一样停止生成
+                with backend.lock:
+                    backend.stats["disconnects"] += 1
+                self.close_connection = True
+            finally:
+                backend.release()
+
+        def _stream(self, body):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for event, delay in backend.generate(body):
+                time.sleep(delay)
+                self._write_chunk(json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+            with backend.lock:
+                backend.stats["streamed"] += 1
+
+    return Handler
+
+def serve(port, backend, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), make_handler(backend))
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="流式 Ollama 替身 (可配置首 token 延迟与生成速度)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--ttft-ms", type=float, default=250)
+    parser.add_argument("--tokens-per-sec", type=float, default=20)
+    parser.add_argument("--tokens", type=int, default=64, help="每次回答的 token 数")
+    parser.add_argument("--parallel", type=int, default=2, help="同时生成的请求数 (OLLAMA_NUM_PARALLEL)，0 为不限")
+    parser.add_argument("--prefill-ms-per-kchar", type=float, default=0.0, help="prompt 每千字符增加的首 token 延迟")
+    parser.add_argument("--contention", action="store_true", help="多路同时生成时平分生成速度")
+    args = parser.parse_args()
+
+    backend = FakeOllama(
+        args.ttft_ms, args.tokens_per_sec, args.tokens, args.parallel, args.prefill_ms_per_kchar, args.contention
+    )
+    server = serve(args.port, backend, args.host)
+    print(f"🦙 Ollama 替身已启动: http://{args.host}:{args.port} (TTFT {args.ttft_ms:.0f} ms, {args.tokens_per_sec:g} tokens/s)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+端到端压测：python -m benchmarks.loadtest [--users 16] [--turns 3] [--uploads 8] [--readers 4] [--json out.json] [--baseline base.json]
+
+默认在本机启动两个子进程：benchmarks.fake_ollama (可配置 TTFT / 生成速度) 与 benchmarks.local_stack
+(完整 server.py + 嵌入式向量库 + 哈希 Embedding 替身)，随后对 HTTP 接口施加混合负载：
+  - 对话：--users 个虚拟用户各进行 --turns 轮多轮对话 (POST /api/chat, ndjson)，统计 TTFT、完整回答耗时、429 次数
+  - 上传：--uploads 个文档经 --upload-workers 路并发上传 (POST /api/upload)，并轮询任务直到入库完成
+  - 会话：--readers 路并发翻页读取会话列表与消息 (GET /api/sessions, /api/sessions/{id}/messages)
+输出各操作的吞吐与 p50/p95/p99，以及服务端 /api/generation/stats 与 /metrics 中各阶段的平均耗时。
+--json 保存结果；--baseline 与之前保存的结果对比，任一操作 p95 劣化超过 --tolerance 时以非零状态退出，可接入 CI。
+--url 改为压测已在运行的服务 (此时替身参数不生效)。
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict, Counter
+
+import httpx
+
+from benchmarks.bench_query_batching import QUESTIONS, percentile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOPICS = ["城市绿化", "耕地占用税", "历史文化名城保护", "基本农田保护", "建设项目使用林地", "城市紫线管理"]
+
+def make_document(i, articles=40):
+    """生成一份法规体例的测试文档 (章 / 条)，内容与 QUESTIONS 的主题相关，保证检索有结果"""
+    topic = TOPICS[i % len(TOPICS)]
+    lines = [f"{topic}管理条例 (压测样本 {i})", ""]
+    for n in range(1, articles + 1):
+        if n % 10 == 1:
+            lines.append(f"第{n // 10 + 1}章 {topic}的一般规定")
+        lines.append(
+            f"第{n}条 {topic}相关工作由县级以上人民政府有关主管部门负责监督管理，"
+            f"申请人应当提交批准文件、范围图和实施方案，主管部门应当在二十个工作日内作出决定。"
+        )
+    return "\n".join(lines)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.extra = Counter()
+
+    def add(self, op, seconds):
+        self.latencies[op].append(seconds)
+
+    def summary(self, elapsed):
+        ops = {}
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            values = self.latencies.get(op, [])
+            ops[op] = {
+                "count": len(values),
+                "errors": self.errors.get(op, 0),
+                "throughput": round(len(values) / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": round(percentile(values, 50) * 1000, 1) if values else None,
+                "p95_ms": round(percentile(values, 95) * 1000, 1) if values else None,
+                "p99_ms": round(percentile(values, 99) * 1000, 1) if values else None,
+            }
+        return ops
+
+class LocalStack:
+    """启动 Ollama 替身与本地替身服务，退出时清理子进程"""
+
+    def __init__(self, args):
+        self.args = args
+        self.procs = []
+        self.tmp = tempfile.TemporaryDirectory(prefix="rag-loadtest-")
+        self.ollama_url = f"http://127.0.0.1:{free_port()}"
+        self.url = f"http://127.0.0.1:{free_port()}"
+
+    def _spawn(self, name, argv):
+        log = open(os.path.join(self.tmp.name, f"{name}.log"), "w")
+        proc = subprocess.Popen(
+            [sys.executable, "-m", *argv], cwd=BACKEND_DIR, stdout=log, stderr=subprocess.STDOUT,
+        )
+        self.procs.append((proc, log))
+        return proc
+
+    def __enter__(self):
+        a = self.args
+        self._spawn("ollama", [
+            "benchmarks.fake_ollama", "--port", self.ollama_url.rsplit(":", 1)[1],
+            "--ttft-ms", str(a.ttft_ms), "--tokens-per-sec", str(a.tokens_per_sec),
+            "--tokens", str(a.tokens), "--parallel", str(a.ollama_parallel),
+            *(["--contention"] if a.contention else []),
+        ])
+        self._spawn("server", [
+            "benchmarks.local_stack", "--port", self.url.rsplit(":", 1)[1],
+            "--llm-api-base", self.ollama_url, "--data-dir", os.path.join(self.tmp.name, "data"),
+            "--embed-cost-ms", str(a.embed_cost_ms), "--generation-concurrency", str(a.generation_concurrency),
+        ])
+        return self
+
+    def check(self):
+        for proc, _ in self.procs:
+            if proc.poll() is not None:
+                raise RuntimeError(f"替身子进程已退出 (code={proc.returncode})，日志见 {self.tmp.name}")
+
+    def __exit__(self, *exc):
+        for proc, log in self.procs:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            log.close()
+        if exc[0] is not None:
+            print(f"   子进程日志: {self.tmp.name}")
+        else:
+            self.tmp.cleanup()
+
+async def wait_ready(client, url, check=None, timeout=180):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check:
+            check()
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"等待服务就绪超时: {url}")
+
+async def chat_turn(client, base, rec, query, session_id):
+    """一轮对话，返回会话 ID (首轮由服务端创建)"""
+    start = time.perf_counter()
+    payload = {"input": query, "session_id": session_id, "stream_format": "ndjson"}
+    ttft, chars = None, 0
+    try:
+        async with client.stream("POST", f"{base}/api/chat", json=payload) as resp:
+            if resp.status_code == 429:
+                await resp.aread()
+                rec.extra["chat_rejected"] += 1
+                return session_id, float(resp.headers.get("retry-after", 1))
+            resp.raise_for_status()
+            session_id = resp.headers.get("x-session-id", session_id)
+            async for line in resp.aiter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event["type"] == "token":
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    chars += len(event["text"])
+                elif event["type"] == "error":
+                    rec.errors["chat"] += 1
+    except httpx.HTTPError:
+        rec.errors["chat"] += 1
+        return session_id, 0.0
+    total = time.perf_counter() - start
+    if ttft is not None:
+        rec.add("chat_ttft", ttft)
+    rec.add("chat", total)
+    rec.extra["answer_chars"] += chars
+    return session_id, 0.0
+
+async def chat_user(client, base, rec, user, turns, think_ms):
+    session_id = None
+    for turn in range(turns):
+        query = QUESTIONS[(user + turn) % len(QUESTIONS)]
+        session_id, retry_after = await chat_turn(client, base, rec, query, session_id)
+        if retry_after:
+            # 被拒绝的一轮按 Retry-After 退避后不再重试，计入 chat_rejected
+            await asyncio.sleep(min(retry_after, 5.0))
+        elif think_ms:
+            await asyncio.sleep(think_ms / 1000)
+
+async def upload_and_wait(client, base, rec, index, record=True):
+    name = f"loadtest_{index:04d}.txt"
+    start = time.perf_counter()
+    try:
+        resp = await client.post(
+            f"{base}/api/upload", files={"file": (name, make_document(index).encode("utf-8"), "text/plain")}
+        )
+        resp.raise_for_status()
+        job_id = resp.json()["job_id"]
+        if record:
+            rec.add("upload", time.perf_counter() - start)
+        while True:
+            job = (await client.get(f"{base}/api/jobs/{job_id}")).json()
+            if job["status"] in ("done", "failed"):
+                break
+            await asyncio.sleep(0.1)
+    except (httpx.HTTPError, KeyError, ValueError):
+        rec.errors["upload"] += 1
+        return
+    if job["status"] == "failed":
+        rec.errors["ingest"] += 1
+    elif record:
+        rec.add("ingest", time.perf_counter() - start)
+
+async def uploader(client, base, rec, indices):
+    for index in indices:
+        await upload_and_wait(client, base, rec, index)
+
+async def session_reader(client, base, rec, stop, interval_ms, seed):
+    rng = random.Random(seed)
+    while not stop.is_set():
+        try:
+            start = time.perf_counter()
+            resp = await client.get(f"{base}/api/sessions", params={"limit": 20})
+            resp.raise_for_status()
+            rec.add("sessions", time.perf_counter() - start)
+            sessions = resp.json()
+            if sessions:
+                session_id = rng.choice(sessions)["id"]
+                start = time.perf_counter()
+                resp = await client.get(f"{base}/api/sessions/{session_id}/messages", params={"limit": 50})
+                resp.raise_for_status()
+                rec.add("messages", time.perf_counter() - start)
+        except httpx.HTTPError:
+            rec.errors["sessions"] += 1
+        await asyncio.sleep(interval_ms / 1000)
+
+def parse_stage_means(text):
+    """从 /metrics 中取出各阶段耗时直方图的平均值 (毫秒)"""
+    sums, counts = {}, {}
+    pattern = re.compile(r'^(rag_\w+_stage_seconds)_(sum|count)\{stage="(\w+)"\} ([0-9.eE+-]+)$')
+    for line in text.splitlines():
+        match = pattern.match(line)
+        if match:
+            name, kind, stage, value = match.groups()
+            (sums if kind == "sum" else counts)[(name, stage)] = float(value)
+    return {key: sums[key] / counts[key] * 1000 for key in sums if counts.get(key)}
+
+async def run(args, base, check=None):
+    limits = httpx.Limits(max_connections=args.users + args.readers + args.upload_workers + 8)
+    async with httpx.AsyncClient(timeout=600, limits=limits) as client:
+        await wait_ready(client, f"{base}/api/generation/stats", check)
+
+        # 预置文档 (不计入结果)，让检索在压测开始时就有数据
+        seed_rec = Recorder()
+        await asyncio.gather(*(upload_and_wait(client, base, seed_rec, 9000 + i, record=False) for i in range(args.seed_docs)))
+
+        rec = Recorder()
+        stop = asyncio.Event()
+        start = time.perf_counter()
+        readers = [
+            asyncio.create_task(session_reader(client, base, rec, stop, args.reader_interval_ms, i))
+            for i in range(args.readers)
+        ]
+        upload_groups = [list(range(i, args.uploads, args.upload_workers)) for i in range(args.upload_workers)]
+        await asyncio.gather(
+            *(chat_user(client, base, rec, u, args.turns, args.think_ms) for u in range(args.users)),
+            *(uploader(client, base, rec, group) for group in upload_groups if group),
+        )
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await asyncio.gather(*readers)
+
+        server = {
+            "generation": (await client.get(f"{base}/api/generation/stats")).json(),
+            "stages_ms": {
+                f"{name.replace('rag_', '').replace('_stage_seconds', '')}.{stage}": round(ms, 1)
+                for (name, stage), ms in parse_stage_means((await client.get(f"{base}/metrics")).text).items()
+            },
+        }
+    return rec, elapsed, server
+
+def report(args, rec, elapsed, server):
+    ops = rec.summary(elapsed)
+    print(f"\n📊 端到端压测: {args.users} 用户 × {args.turns} 轮, {args.uploads} 个上传, {args.readers} 路会话读取, 总耗时 {elapsed:.2f}s")
+    print(f"   {'操作':<12}{'次数':>6}{'错误':>6}{'ops/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for op, s in ops.items():
+        fmt = lambda v: f"{v:>10.1f}" if v is not None else f"{'-':>10}"
+        print(f"   {op:<12}{s['count']:>6}{s['errors']:>6}{s['throughput']:>9.2f}{fmt(s['p50_ms'])}{fmt(s['p95_ms'])}{fmt(s['p99_ms'])}")
+    print(f"   429 拒绝 {rec.extra['chat_rejected']} 次, 回答输出 {rec.extra['answer_chars'] / elapsed:.0f} 字/s")
+    gen = server["generation"]
+    print(f"   调度器: 排队等待 p50 {gen.get('wait_ms_p50')} ms / p95 {gen.get('wait_ms_p95')} ms, 超时 {gen.get('timeouts')}")
+    if server["stages_ms"]:
+        print("   服务端各阶段平均耗时 (ms): " + ", ".join(f"{k} {v}" for k, v in sorted(server["stages_ms"].items())))
+    return {
+        "params": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+        "elapsed_s": round(elapsed, 2),
+        "ops": ops,
+        "chat_rejected": rec.extra["chat_rejected"],
+        "server": server,
+    }
+
+def compare(result, baseline_path, tolerance):
+    """与基线对比各操作 p95，返回劣化列表"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = []
+    for op, base in baseline.get("ops", {}).items():
+        current = result["ops"].get(op)
+        if not current or not base.get("p95_ms") or current.get("p95_ms") is None:
+            continue
+        ratio = current["p95_ms"] / base["p95_ms"]
+        marker = "❌" if ratio > 1 + tolerance else "✅"
+        print(f"   {marker} {op:<10} p95 {base['p95_ms']:.1f} → {current['p95_ms']:.1f} ms ({ratio - 1:+.0%})")
+        if ratio > 1 + tolerance:
+            regressions.append(op)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端压测 (对话 / 上传 / 会话 混合负载)")
+    parser.add_argument("--url", help="压测已运行的服务；不指定则本地启动替身栈")
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--think-ms", type=float, default=0, help="同一用户两轮之间的间隔")
+    parser.add_argument("--uploads", type=int, default=8)
+    parser.add_argument("--upload-workers", type=int, default=2)
+    parser.add_argument("--seed-docs", type=int, default=4, help="压测前预置的文档数")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--reader-interval-ms", type=float, default=50)
+    # 替身参数
+    parser.add_argument("--ttft-ms", type=float, default=250)
+    parser.add_argument("--tokens-per-sec", type=float, default=20)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--ollama-parallel", type=int, default=2)
+    parser.add_argument("--contention", action="store_true", help="Ollama 替身多路生成时平分速度")
+    parser.add_argument("--generation-concurrency", type=int, default=2)
+    parser.add_argument("--embed-cost-ms", type=float, default=2.0)
+    # 结果
+    parser.add_argument("--json", help="保存结果到 JSON 文件")
+    parser.add_argument("--baseline", help="与之前保存的 JSON 结果对比")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="p95 允许的劣化比例")
+    args = parser.parse_args()
+
+    if args.url:
+        rec, elapsed, server = asyncio.run(run(args, args.url.rstrip("/")))
+    else:
+        with LocalStack(args) as stack:
+            rec, elapsed, server = asyncio.run(run(args, stack.url, stack.check))
+
+    result = report(args, rec, elapsed, server)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        print(f"\n📐 对比基线 {args.baseline} (容忍 {args.tolerance:.0%}):")
+        if compare(result, args.baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+本地替身栈：python -m benchmarks.local_stack --port 8100 --llm-api-base http://127.0.0.1:11435 --data-dir /tmp/rag-bench
+
+在不依赖 Milvus 与 Embedding 模型的情况下启动完整的 server.py：
+  - 向量库使用嵌入式后端 (VECTOR_BACKEND=local，见 local_vector_store.py)，入库、删除、检索走的仍是原来的代码路径
+  - HashEmbedding：字 bigram 哈希到 EMBEDDING_DIM 维，可选每条文本固定耗时模拟 CPU 编码开销
+  - 数据目录 (文件、SQLite、稀疏索引、向量库、Embedding 缓存) 全部放到 --data-dir，不污染正式数据；LLM 指向 benchmarks.fake_ollama
+必须在导入 server / vector_store / rag_service 之前调用 install()。冒烟测试见 benchmarks.smoke_local_stack。
+"""
+import os
+import sys
+import time
+import zlib
+import math
+import argparse
+
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.embeddings import BaseEmbedding
+
+from config import Config
+from sparse_index import tokenize
+from embedding_provider import EmbeddingProvider
+
+class HashEmbedding(BaseEmbedding):
+    """确定性的哈希向量：字面重合越多余弦越高，足以让检索、融合、缓存走通真实路径"""
+
+    dim: int = Field(default=Config.EMBEDDING_DIM)
+    cost_ms: float = Field(default=0.0, description="每条文本的模拟编码耗时")
+
+    @classmethod
+    def class_name(cls):
+        return "HashEmbedding"
+
+    def _vector(self, text):
+        vec = [0.0] * self.dim
+        for token in tokenize(text) or [text]:
+            h = zlib.crc32(token.encode("utf-8"))
+            vec[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+    def _embed_batch(self, texts):
+        if self.cost_ms:
+            time.sleep(self.cost_ms * len(texts) / 1000)
+        return [self._vector(t) for t in texts]
+
+    def _get_query_embedding(self, query):
+        return self._embed_batch([query])[0]
+
+    async def _aget_query_embedding(self, query):
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text):
+        return self._embed_batch([text])[0]
+
+    def _get_text_embeddings(self, texts):
+        return self._embed_batch(texts)
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """只替换模型：embed_documents (批量编码 + 磁盘缓存)、stats 继承 EmbeddingProvider，接口不会与真实提供者脱节"""
+
+    def __init__(self, cost_ms=0.0):
+        self.model_name = "hash-bigram"
+        self.precision = "fp32"
+        self.memory_bytes = 0
+        self.embed_model = HashEmbedding(cost_ms=cost_ms, embed_batch_size=Config.EMBEDDING_BATCH_SIZE)
+        self._init_cache()
+
+    def embed_queries(self, texts):
+        return self.embed_model._embed_batch(list(texts))
+
+def install(data_dir, llm_api_base, embed_cost_ms=0.0, generation_concurrency=None):
+    """把数据目录、LLM 地址切换到压测环境，向量库用嵌入式后端，Embedding 用哈希替身"""
+    loaded = [m for m in ("server", "vector_store", "rag_service", "session_manager", "local_vector_store") if m in sys.modules]
+    if loaded:
+        raise RuntimeError(f"install() 必须在导入 {loaded} 之前调用")
+
+    Config.FILES_DIR = os.path.join(data_dir, "files")
+    Config.DB_PATH = os.path.join(data_dir, "sessions.db")
+    Config.SPARSE_INDEX_DIR = os.path.join(data_dir, "sparse_index")
+    Config.LOCAL_VECTOR_DIR = os.path.join(data_dir, "vector_index")
+    Config.EMBEDDING_CACHE_DIR = os.path.join(data_dir, "embedding_cache")
+    Config.REPORTS_DIR = os.path.join(data_dir, "reports")
+    os.makedirs(Config.FILES_DIR, exist_ok=True)
+    Config.LLM_API_BASE = llm_api_base
+    Config.VECTOR_BACKEND = "local"
+    Config.PRELOAD_VIDEO_MODELS = False
+    # 模拟语义缓存会让重复的压测问题直接命中，关闭以测量完整链路
+    Config.ANSWER_CACHE = False
+    if generation_concurrency:
+        Config.GENERATION_CONCURRENCY = generation_concurrency
+
+    import embedding_provider
+    embedding_provider._provider = LocalEmbeddingProvider(embed_cost_ms)
+
+def main():
+    parser = argparse.ArgumentParser(description="用本地替身启动 server.py (无需 Milvus / Embedding 模型)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--llm-api-base", default="http://127.0.0.1:11435")
+    parser.add_argument("--data-dir", required=True)
+    parser.add_argument("--embed-cost-ms", type=float, default=0.0, help="每条文本的模拟编码耗时")
+    parser.add_argument("--generation-concurrency", type=int, default=None, help="覆盖 Config.GENERATION_CONCURRENCY")
+    args = parser.parse_args()
+
+    install(args.data_dir, args.llm_api_base, args.embed_cost_ms, args.generation_concurrency)
+
+    import uvicorn
+    from server import app
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
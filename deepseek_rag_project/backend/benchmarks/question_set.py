@@ -0,0 +1,43 @@
+"""
+问策测试问题清单 (data/files/问策测试问题清单20250326.docx) 的读取与命中判定。
+
+清单正文为 "问题段落 + 若干《法规名》段落"，法规名即该问题的标准出处，用作检索命中的金标准。
+"""
+import os
+import re
+import zipfile
+from config import Config
+
+QUESTION_FILE = "问策测试问题清单20250326.docx"
+
+def _paragraphs(docx_path):
+    xml = zipfile.ZipFile(docx_path).read("word/document.xml").decode("utf-8")
+    for para in re.findall(r"<w:p[ >].*?</w:p>", xml, flags=re.S):
+        text = re.sub(r"<[^>]+>", "", para).strip()
+        if text:
+            yield text
+
+def core_title(name):
+    """去掉编号前缀、书名号、年份/修订说明和扩展名，只保留法规名主体"""
+    name = os.path.splitext(name)[0] if name.lower().endswith((".pdf", ".docx", ".doc", ".txt")) else name
+    name = name.strip("《》 ")
+    name = re.sub(r"^(n-)?F-\d+-\d+-\d+", "", name)
+    return re.split(r"[（(]|\d{4}", name)[0].strip()
+
+def load_questions(path=None):
+    """返回 [(问题, [标准出处法规名])]"""
+    path = path or os.path.join(Config.FILES_DIR, QUESTION_FILE)
+    questions = []
+    for text in _paragraphs(path):
+        if "PAGEREF" in text or text == "问策问题清单":
+            continue  # 目录
+        if text.startswith("《"):
+            if questions:
+                questions[-1][1].append(core_title(text))
+        else:
+            questions.append((text, []))
+    return [(q, sources) for q, sources in questions if sources]
+
+def is_hit(file_name, sources):
+    core = core_title(file_name or "")
+    return bool(core) and any(s and (s in core or core in s) for s in sources)
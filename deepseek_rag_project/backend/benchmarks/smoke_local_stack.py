@@ -0,0 +1,73 @@
+"""
+本地替身栈冒烟测试：python -m benchmarks.smoke_local_stack [--data-dir /tmp/rag-smoke]
+
+不启动 HTTP 服务，直接走入库与检索的代码路径：
+  - insert_text 与 process_file 各入库一份法规体例文档 (切片 → embed_documents → 向量库 / 稀疏索引 / 清单)
+  - 同一内容再次入库应命中清单跳过，改动后重新入库应命中 Embedding 缓存
+  - 检索 (含混合检索与缓存) 应返回刚入库的文件
+任一步失败以非零状态退出；替身接口与真实 EmbeddingProvider 脱节时在这里先暴露，可接入 CI。
+"""
+import os
+import sys
+import asyncio
+import argparse
+import tempfile
+
+from benchmarks.local_stack import install
+from benchmarks.loadtest import make_document
+
+def check(ok, message):
+    if not ok:
+        print(f"❌ {message}")
+        sys.exit(1)
+    print(f"✅ {message}")
+
+def run(data_dir):
+    install(data_dir, "http://127.0.0.1:9")
+
+    from config import Config
+    from vector_store import get_vector_service
+    from embedding_provider import get_embedding_provider
+    from ingest_manifest import ingest_manifest
+    from rag_service import get_rag_service
+
+    svc = get_vector_service()
+    provider = get_embedding_provider()
+
+    check(svc.insert_text(make_document(0, articles=12), "smoke_report.txt"), "insert_text 入库")
+    path = os.path.join(Config.FILES_DIR, "smoke_doc.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(make_document(1, articles=12))
+    check(svc.process_file(path), "process_file 入库")
+    check(bool(ingest_manifest.get_chunks("smoke_doc.txt")), "清单记录了切片")
+    check(svc.process_file(path), "未变化的文件跳过入库")
+
+    # 追加一条：已有切片命中清单或 Embedding 缓存，只编码新切片
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n第13条 本条例自发布之日起施行。")
+    check(svc.process_file(path), "改动后增量入库")
+    stats = provider.stats()
+    if provider.cache is not None:
+        check(stats["cache"]["entries"] > 0, f"Embedding 缓存已写入 ({stats['cache']['entries']} 条)")
+
+    nodes = asyncio.run(get_rag_service().retrieve("耕地占用税的申请人应当提交哪些材料"))
+    names = {n.node.metadata.get("file_name") for n in nodes}
+    check(bool(nodes), f"检索返回 {len(nodes)} 个切片: {sorted(names)}")
+    check(all(0.0 <= float(n.score or 0.0) <= 1.0 for n in nodes), "相关度分数在 [0, 1] 内")
+
+    check(svc.delete_file_index("smoke_doc.txt"), "删除文件索引")
+    check(not ingest_manifest.get_chunks("smoke_doc.txt"), "删除后清单已清空")
+    print("🎉 冒烟测试通过")
+
+def main():
+    parser = argparse.ArgumentParser(description="本地替身栈冒烟测试 (入库 + 检索)")
+    parser.add_argument("--data-dir", default=None, help="默认使用临时目录")
+    args = parser.parse_args()
+    if args.data_dir:
+        run(args.data_dir)
+    else:
+        with tempfile.TemporaryDirectory() as data_dir:
+            run(data_dir)
+
+if __name__ == "__main__":
+    main()
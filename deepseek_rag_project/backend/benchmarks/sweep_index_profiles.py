@@ -0,0 +1,296 @@
+"""
+索引 profile 扫描：python -m benchmarks.sweep_index_profiles [--source files|local|milvus] [--cache corpus.npz] [--json out.json]
+
+在自己的语料上对比各索引 profile 的召回、延迟与内存，按数据选 profile 和 M / ef / nprobe / rescore：
+  - 语料：data/files 按线上同样的解析、切片、编码得到的向量 (files)，或现有嵌入式向量库 / Milvus 集合中的向量；
+    --cache 把语料向量存成 npz，之后重复扫描不必重新编码
+  - 查询：问策测试问题清单中的问题，不足 --queries 条时用随机切片向量补足
+  - 召回：recall@K = 与精确 (暴力内积) Top-K 的重合比例；问题清单的问题另算出处命中率
+  - 延迟：单线程逐条检索的 p50 / p99 (含量化 profile 取原始向量重排的往返)
+  - 内存：Milvus 取查询节点上报的段内存 (取不到时用 index_profiles 估算)；
+    嵌入式为稳定延迟所需的常驻大小 (fp16 扫描整个向量文件；binary 只需常驻 1-bit 编码，重排按需读 fp16)
+Milvus profile 在临时集合 <COLLECTION_NAME>_sweep 上逐个建索引测量，结束后删除；嵌入式后端在临时目录内测量。
+"""
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from config import Config
+from index_profiles import get_index_profile, with_overrides, search_params, estimate_memory_bytes, ensure_milvus_index
+from benchmarks.question_set import load_questions, is_hit
+from benchmarks.bench_query_batching import percentile
+
+MILVUS_TARGETS = ("hnsw", "ivf_flat", "ivf_sq8", "ivf_pq")
+LOCAL_TARGETS = ("local_fp16", "local_binary")
+
+def _ints(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+# --- 语料 ---
+
+def corpus_from_files(directory, workers):
+    from concurrent.futures import ProcessPoolExecutor
+    from llama_index.core.schema import MetadataMode
+    from bulk_ingest import collect_files, parse_file
+    from embedding_provider import get_embed_model
+
+    texts, file_names = [], []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for filename, _, _, nodes in pool.map(parse_file, collect_files(directory)):
+            texts.extend(n.get_content(metadata_mode=MetadataMode.EMBED) for n in nodes)
+            file_names.extend([filename] * len(nodes))
+    print(f"📚 {len(set(file_names))} 个文件, {len(texts)} 个切片，编码中...")
+    embeddings = get_embed_model().get_text_embedding_batch(texts, show_progress=True)
+    return np.asarray(embeddings, dtype=np.float32), file_names
+
+def corpus_from_local():
+    from local_vector_store import get_local_vector_index
+    index = get_local_vector_index()
+    rows = np.flatnonzero(index.alive[:index.count])
+    return np.asarray(index.vectors[rows], dtype=np.float32), [index.row_keys[r][1] for r in rows]
+
+def corpus_from_milvus():
+    from pymilvus import MilvusClient, Collection
+    from milvus_store import EMBEDDING_FIELD, resolve_collection
+    client = MilvusClient(uri=Config.MILVUS_URI)
+    iterator = Collection(resolve_collection(client), using=client._using).query_iterator(
+        batch_size=1000, output_fields=["file_name", EMBEDDING_FIELD]
+    )
+    vectors, file_names = [], []
+    while True:
+        rows = iterator.next()
+        if not rows:
+            break
+        vectors.extend(r[EMBEDDING_FIELD] for r in rows)
+        file_names.extend(r.get("file_name", "") for r in rows)
+    iterator.close()
+    return np.asarray(vectors, dtype=np.float32), file_names
+
+def load_corpus(args):
+    if args.cache and os.path.exists(args.cache):
+        data = np.load(args.cache, allow_pickle=False)
+        return data["vectors"], list(data["file_names"])
+    if args.source == "local":
+        vectors, file_names = corpus_from_local()
+    elif args.source == "milvus":
+        vectors, file_names = corpus_from_milvus()
+    else:
+        vectors, file_names = corpus_from_files(args.dir, args.workers)
+    if args.cache:
+        np.savez(args.cache, vectors=vectors, file_names=np.asarray(file_names))
+    return vectors, file_names
+
+def load_queries(corpus, count, seed=0):
+    """返回 (查询向量矩阵, 每条查询的标准出处 或 None)"""
+    vectors, sources = [], []
+    try:
+        from embedding_provider import get_embedding_provider
+        questions = load_questions()
+        vectors = list(get_embedding_provider().embed_queries([q for q, _ in questions]))
+        sources = [s for _, s in questions]
+    except (OSError, KeyError, ImportError) as e:
+        print(f"⚠️ 未读取到问题清单或 Embedding 模型 ({e})，只用切片向量作为查询")
+    rng = np.random.default_rng(seed)
+    extra = max(0, count - len(vectors))
+    for row in rng.choice(len(corpus), min(extra, len(corpus)), replace=False):
+        vectors.append(corpus[row])
+        sources.append(None)
+    return np.asarray(vectors, dtype=np.float32), sources
+
+# --- 测量 ---
+
+def normalize(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def exact_top_k(corpus, queries, k):
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row) for row in top]
+
+def measure(name, search, queries, truth, sources, file_names, k, memory_bytes, build_seconds=None):
+    """search(query_vector) -> 行号列表"""
+    latencies, recall, hits, asked = [], 0.0, 0, 0
+    for query, expected, source in zip(queries, truth, sources):
+        start = time.perf_counter()
+        rows = search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recall += len(expected & set(rows[:k])) / k
+        if source is not None:
+            asked += 1
+            hits += any(is_hit(file_names[r], source) for r in rows[:Config.SIMILARITY_TOP_K])
+    result = {
+        "profile": name,
+        "recall": recall / len(queries),
+        "hit_rate": hits / asked if asked else None,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "memory_mb": memory_bytes / (1024 * 1024),
+        "build_s": build_seconds,
+    }
+    hit = f"{result['hit_rate']:.1%}" if result["hit_rate"] is not None else "-"
+    build = f"{build_seconds:.1f}s" if build_seconds is not None else "-"
+    print(f"   {name:<44} recall@{k} {result['recall']:.3f}  命中 {hit:>6}  "
+          f"p50 {result['p50_ms']:6.2f} ms  p99 {result['p99_ms']:6.2f} ms  内存 {result['memory_mb']:8.1f} MB  构建 {build}")
+    return result
+
+def milvus_configs(target, args):
+    """返回 [(构建参数, [(检索参数, rescore)])]，同一构建参数只建一次索引"""
+    if target == "hnsw":
+        return [({"M": m}, [({"ef": ef}, 1) for ef in _ints(args.ef)]) for m in _ints(args.hnsw_m)]
+    rescores = _ints(args.rescore) if target in ("ivf_sq8", "ivf_pq") else [1]
+    searches = [({"nprobe": n}, r) for n in _ints(args.nprobe) for r in rescores]
+    return [({}, searches)]
+
+def sweep_milvus(targets, corpus, queries, truth, sources, file_names, args):
+    from pymilvus import MilvusClient, Collection, CollectionSchema, FieldSchema, DataType, utility
+
+    client = MilvusClient(uri=Config.MILVUS_URI)
+    name = f"{Config.COLLECTION_NAME}_sweep"
+    if client.has_collection(name):
+        client.drop_collection(name)
+    schema = CollectionSchema([
+        FieldSchema("id", DataType.INT64, is_primary=True),
+        FieldSchema("embedding", DataType.FLOAT_VECTOR, dim=corpus.shape[1]),
+    ])
+    collection = Collection(name, schema, using=client._using)
+    results = []
+    try:
+        for start in range(0, len(corpus), Config.MILVUS_INSERT_BATCH):
+            batch = corpus[start:start + Config.MILVUS_INSERT_BATCH]
+            collection.insert([list(range(start, start + len(batch))), batch.tolist()])
+        collection.flush()
+
+        for target in targets:
+            for build, searches in milvus_configs(target, args):
+                built = with_overrides(get_index_profile(target), params=build)
+                start = time.perf_counter()
+                ensure_milvus_index(collection, "embedding", built, rebuild=True)
+                build_seconds = time.perf_counter() - start
+                segments = utility.get_query_segment_info(name, using=client._using)
+                memory = sum(s.mem_size for s in segments) or estimate_memory_bytes(built, len(corpus))
+
+                for search, rescore in searches:
+                    profile = with_overrides(built, search=search, rescore=rescore)
+                    limit = args.top_k * rescore
+                    param = search_params(profile, limit)
+
+                    def search_fn(query, limit=limit, param=param, rescore=rescore):
+                        hits = collection.search([query.tolist()], "embedding", param, limit=limit)[0]
+                        ids = [hit.id for hit in hits]
+                        if rescore > 1 and ids:
+                            # 与 milvus_store 一致：按 id 取回原始向量精确重排
+                            rows = collection.query(f"id in {ids}", output_fields=["id", "embedding"])
+                            exact = {r["id"]: float(np.dot(r["embedding"], query)) for r in rows}
+                            ids = sorted(ids, key=lambda i: -exact.get(i, -1.0))
+                        return ids
+
+                    results.append(measure(profile["name"], search_fn, queries, truth, sources, file_names,
+                                           args.top_k, memory, build_seconds))
+    finally:
+        collection.release()
+        client.drop_collection(name)
+    return results
+
+def sweep_local(targets, corpus, queries, truth, sources, file_names, args):
+    import local_vector_store
+
+    results = []
+    saved = (Config.LOCAL_VECTOR_QUANTIZATION, Config.LOCAL_IVF_NPROBE, Config.LOCAL_BINARY_RESCORE, Config.LOCAL_IVF_MIN_ROWS)
+    workdir = tempfile.mkdtemp(prefix="sweep-local-")
+    try:
+        for target in targets:
+            quantization = target.split("_", 1)[1]
+            Config.LOCAL_VECTOR_QUANTIZATION = quantization
+            Config.LOCAL_IVF_MIN_ROWS = len(corpus) + 1  # 由扫描显式建 IVF
+            index = local_vector_store.LocalVectorIndex(os.path.join(workdir, quantization), dim=corpus.shape[1])
+            ids = [str(i) for i in range(len(corpus))]
+            for start in range(0, len(corpus), Config.MILVUS_INSERT_BATCH):
+                end = start + Config.MILVUS_INSERT_BATCH
+                index.add(ids[start:end], file_names[start:end], [None] * len(ids[start:end]),
+                          ["{}"] * len(ids[start:end]), corpus[start:end])
+            fp16_bytes = index.count * index.row_bytes
+
+            def search_fn(query):
+                return [int(node_id) for node_id, _ in index.search(query, args.top_k)]
+
+            if quantization == "binary":
+                for rescore in _ints(args.rescore):
+                    Config.LOCAL_BINARY_RESCORE = rescore
+                    results.append(measure(f"local_binary(rescore={rescore})", search_fn, queries, truth, sources,
+                                           file_names, args.top_k, index.codes[:index.count].nbytes))
+                continue
+
+            results.append(measure("local_fp16(exact)", search_fn, queries, truth, sources, file_names,
+                                   args.top_k, fp16_bytes))
+            start = time.perf_counter()
+            index.rebuild_index()
+            build_seconds = time.perf_counter() - start
+            ivf_bytes = index.ivf.centroids.nbytes + index.ivf.rows.nbytes
+            for nprobe in _ints(args.nprobe):
+                Config.LOCAL_IVF_NPROBE = nprobe
+                results.append(measure(f"local_fp16(ivf,nprobe={nprobe})", search_fn, queries, truth, sources,
+                                       file_names, args.top_k, fp16_bytes + ivf_bytes, build_seconds))
+    finally:
+        (Config.LOCAL_VECTOR_QUANTIZATION, Config.LOCAL_IVF_NPROBE,
+         Config.LOCAL_BINARY_RESCORE, Config.LOCAL_IVF_MIN_ROWS) = saved
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="在自有语料上扫描索引 profile 的召回 / 延迟 / 内存")
+    parser.add_argument("--source", choices=["files", "local", "milvus"], default="files")
+    parser.add_argument("--dir", default=Config.FILES_DIR)
+    parser.add_argument("--workers", type=int, default=Config.INGEST_WORKERS)
+    parser.add_argument("--cache", help="语料向量缓存 (.npz)，存在时直接读取")
+    parser.add_argument("--max-rows", type=int, default=0, help="随机抽样语料行数，0 为全部")
+    parser.add_argument("--targets", default=",".join(MILVUS_TARGETS + LOCAL_TARGETS))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=Config.HYBRID_CANDIDATES)
+    parser.add_argument("--hnsw-m", default="8,16,32")
+    parser.add_argument("--ef", default="32,64,128")
+    parser.add_argument("--nprobe", default="8,16,32")
+    parser.add_argument("--rescore", default="1,4,8")
+    parser.add_argument("--json", help="保存结果")
+    args = parser.parse_args()
+
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    unknown = [t for t in targets if t not in MILVUS_TARGETS + LOCAL_TARGETS]
+    if unknown:
+        parser.error(f"未知的 target: {unknown}")
+
+    corpus, file_names = load_corpus(args)
+    if args.max_rows and len(corpus) > args.max_rows:
+        rows = sorted(random.Random(0).sample(range(len(corpus)), args.max_rows))
+        corpus, file_names = corpus[rows], [file_names[r] for r in rows]
+    corpus = normalize(corpus)
+    queries, sources = load_queries(corpus, args.queries)
+    queries = normalize(queries)
+    truth = exact_top_k(corpus, queries, args.top_k)
+    print(f"\n📊 语料 {len(corpus)} 条 × {corpus.shape[1]} 维, 查询 {len(queries)} 条 "
+          f"(问题清单 {sum(s is not None for s in sources)} 条), Top-{args.top_k}")
+
+    results = []
+    milvus = [t for t in targets if t in MILVUS_TARGETS]
+    if milvus:
+        try:
+            results += sweep_milvus(milvus, corpus, queries, truth, sources, file_names, args)
+        except Exception as e:
+            print(f"⚠️ Milvus profile 扫描跳过: {e}")
+    local = [t for t in targets if t in LOCAL_TARGETS]
+    if local:
+        results += sweep_local(local, corpus, queries, truth, sources, file_names, args)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"rows": len(corpus), "queries": len(queries), "top_k": args.top_k, "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {args.json}")
+
+if __name__ == "__main__":
+    main()
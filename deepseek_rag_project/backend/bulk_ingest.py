@@ -0,0 +1,179 @@
+"""
+批量入库：python bulk_ingest.py [--dir data/files] [--workers N]
+
+多进程并行解析/切片，跨文件攒大批量做 Embedding，再大批量写入 Milvus。
+"""
+import os
+import time
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_worker_ocr = None
+
+def _ocr_image(filepath):
+    global _worker_ocr
+    if _worker_ocr is None:
+        from rapidocr_onnxruntime import RapidOCR
+        _worker_ocr = RapidOCR(num_threads=1)
+    result, _ = _worker_ocr(filepath)
+    return "\n".join(line[1] for line in (result or []) if line and len(line) >= 2)
+
+def load_documents(filepath):
+    """解析文件为 Document 列表 (PDF 每页一个)，metadata 带 file_name"""
+    from llama_index.core import SimpleDirectoryReader, Document
+    from vector_store import build_file_extractor
+
+    filename = os.path.basename(filepath)
+    file_ext = os.path.splitext(filename)[1].lower()
+
+    if file_ext in Config.IMAGE_EXTS:
+        text = _ocr_image(filepath)
+        documents = [Document(text=text)] if text.strip() else []
+    elif file_ext == ".pdf":
+        # 已按文件多进程并行，页内不再开进程池；扫描页同样栅格化 OCR
+        from pdf_pipeline import iter_pdf_pages
+        documents = list(iter_pdf_pages(filepath, parallel=False))
+    else:
+        documents = SimpleDirectoryReader(
+            input_files=[filepath],
+            file_extractor=build_file_extractor()
+        ).load_data()
+    for doc in documents:
+        doc.metadata["file_name"] = filename
+    return documents
+
+def parse_file(filepath, file_hash=None):
+    """子进程：解析 + 切片，返回 (文件名, 文件哈希, 页数, 切片列表)；父进程已算过哈希时直接传入"""
+    from vector_store import build_text_splitter
+    from ingest_manifest import hash_file
+
+    documents = load_documents(filepath)
+    nodes = build_text_splitter().get_nodes_from_documents(documents) if documents else []
+    return os.path.basename(filepath), file_hash or hash_file(filepath), len(documents), nodes
+
+class BulkIngestor:
+    def __init__(self, embed_batch=Config.INGEST_EMBED_BATCH, insert_batch=Config.MILVUS_INSERT_BATCH):
+        from vector_store import get_vector_service
+        from embedding_provider import get_embedding_provider
+        self.service = get_vector_service()
+        self.embedder = get_embedding_provider()
+        self.embed_batch = embed_batch
+        self.insert_batch = insert_batch
+
+        self.buffer = []
+        self.pending = []  # 已全部放入 buffer、等待写清单的文件
+        self.stats = {"files": 0, "skipped": 0, "failed": 0, "pages": 0, "chunks": 0, "vectors": 0}
+
+    def add(self, filename, file_hash, pages, nodes):
+        from ingest_manifest import ingest_manifest
+
+        if ingest_manifest.get_file_hash(filename) == file_hash:
+            self.stats["skipped"] += 1
+            return
+
+        # 只统计实际入库的文件，跳过的文件不计入 pages/s、chunks/s
+        self.stats["pages"] += pages
+        self.stats["chunks"] += len(nodes)
+        new_nodes, chunks, stale_ids, untracked = self.service.plan_sync(filename, nodes)
+        if untracked:
+            self.service.delete_file_index(filename)
+        self.buffer.extend(new_nodes)
+        self.pending.append((filename, file_hash, chunks, stale_ids))
+        self.stats["files"] += 1
+
+        if len(self.buffer) >= self.embed_batch:
+            self.flush()
+
+    def flush(self):
+        from llama_index.core.schema import MetadataMode
+        from ingest_manifest import ingest_manifest
+
+        if self.buffer:
+            texts = [n.get_content(metadata_mode=MetadataMode.EMBED) for n in self.buffer]
+            embeddings = self.embedder.embed_documents(texts)
+            for node, embedding in zip(self.buffer, embeddings):
+                node.embedding = embedding
+            for i in range(0, len(self.buffer), self.insert_batch):
+                self.service.vector_store.add(self.buffer[i:i + self.insert_batch])
+            self.service.sparse_index.add_nodes(self.buffer)
+            self.stats["vectors"] += len(self.buffer)
+            self.buffer = []
+
+        # 新向量写入后再删除过期向量并落清单
+        for filename, file_hash, chunks, stale_ids in self.pending:
+            self.service.delete_node_ids(stale_ids)
+            ingest_manifest.save_file(filename, file_hash, chunks)
+        self.pending = []
+
+def collect_files(directory):
+    files = []
+    for f in sorted(os.listdir(directory)):
+        path = os.path.join(directory, f)
+        if os.path.isfile(path) and os.path.splitext(f)[1].lower() in Config.DOC_EXTS + Config.IMAGE_EXTS:
+            files.append(path)
+    return files
+
+def main():
+    parser = argparse.ArgumentParser(description="批量解析并入库知识库文件")
+    parser.add_argument("--dir", default=Config.FILES_DIR)
+    parser.add_argument("--workers", type=int, default=Config.INGEST_WORKERS)
+    parser.add_argument("--embed-batch", type=int, default=Config.INGEST_EMBED_BATCH)
+    parser.add_argument("--insert-batch", type=int, default=Config.MILVUS_INSERT_BATCH)
+    args = parser.parse_args()
+
+    from ingest_manifest import ingest_manifest, hash_file
+
+    files = collect_files(args.dir)
+    logger.info(f"📚 待处理文件 {len(files)} 个, 解析进程 {args.workers} 个")
+
+    ingestor = BulkIngestor(embed_batch=args.embed_batch, insert_batch=args.insert_batch)
+    start = time.perf_counter()
+
+    # 在父进程比对清单哈希，未变化的文件不提交给解析进程 (哈希只读文件，远比解析便宜)
+    known = ingest_manifest.list_files()
+    changed = []
+    for path in files:
+        try:
+            file_hash = hash_file(path)
+        except OSError as e:
+            ingestor.stats["failed"] += 1
+            logger.error(f"❌ 读取失败 {os.path.basename(path)}: {e}")
+            continue
+        if known.get(os.path.basename(path)) == file_hash:
+            ingestor.stats["skipped"] += 1
+        else:
+            changed.append((path, file_hash))
+    if ingestor.stats["skipped"]:
+        logger.info(f"   ⏭️ {ingestor.stats['skipped']} 个文件未变化，跳过解析")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(parse_file, path, file_hash): path for path, file_hash in changed}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                filename, file_hash, pages, nodes = future.result()
+                logger.info(f"   📄 {filename}: {pages} 页, {len(nodes)} 个切片")
+                ingestor.add(filename, file_hash, pages, nodes)
+            except Exception as e:
+                ingestor.stats["failed"] += 1
+                logger.error(f"❌ 处理失败 {os.path.basename(path)}: {e}")
+    ingestor.flush()
+    ingestor.service.sparse_index.commit()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    s = ingestor.stats
+    print(
+        f"\n✅ 批量入库完成: 入库 {s['files']} / 跳过 {s['skipped']} / 失败 {s['failed']} 个文件, 耗时 {elapsed:.1f}s\n"
+        f"   页数 {s['pages']} ({s['pages'] / elapsed:.2f} pages/s)\n"
+        f"   切片 {s['chunks']} ({s['chunks'] / elapsed:.2f} chunks/s)\n"
+        f"   向量 {s['vectors']} ({s['vectors'] / elapsed:.2f} vectors/s)"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,9 @@ json.dumps = _force_utf8_dumps
 BACKEND_DIR = Path(__file__).parent.absolute()
 DATA_DIR = BACKEND_DIR.parent / "data" / "files"
 DB_PATH = BACKEND_DIR.parent / "data" / "sessions.db"
+SPARSE_INDEX_DIR = BACKEND_DIR.parent / "data" / "sparse_index"
+LOCAL_VECTOR_DIR = BACKEND_DIR.parent / "data" / "vector_index"
+REPORTS_DIR = BACKEND_DIR.parent / "data" / "reports"
 MODEL_CACHE_DIR = BACKEND_DIR.parent / "model_cache"  
 
 env_path = BACKEND_DIR / '.env'
@@ -36,18 +39,66 @@ class Config:
     API_PORT = int(os.getenv("API_PORT", 8000))
     FILES_DIR = str(DATA_DIR)
     DB_PATH = str(DB_PATH)
+    SPARSE_INDEX_DIR = str(SPARSE_INDEX_DIR)
+    LOCAL_VECTOR_DIR = str(LOCAL_VECTOR_DIR)
+    REPORTS_DIR = str(REPORTS_DIR)   # 视频分析报告原文，重建集合时重新切片
     MODEL_CACHE_DIR = str(MODEL_CACHE_DIR)
     
     # --- LLM ---
     LLM_API_BASE = os.getenv("LLM_API_BASE", "http://127.0.0.1:11434")
     LLM_MODEL = "qwen2.5:7b"
     CONTEXT_WINDOW = 4096  
+    # 模型与 KV cache 在 Ollama 中的驻留时间，避免空闲后被卸载导致下一轮重新加载、重算整段前缀
+    LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")
+    # 与 LLM_MODEL 对应的 tokenizer (仅读取本地缓存)，用于 prompt 的 token 预算
+    TOKENIZER_MODEL = "Qwen/Qwen2.5-7B-Instruct"
+    RESERVED_OUTPUT_TOKENS = 1024
+    # 剩余上下文在各部分之间的分配权重
+    PROMPT_BUDGET_WEIGHTS = {"video": 5, "rag": 3, "history": 2}
+    HISTORY_MESSAGES = 4
+
+    # --- 会话存储 (session_manager.py) ---
+    SESSION_DB_TIMEOUT = 30       # 秒，等待其他进程写锁的时间
+    SESSIONS_PAGE_SIZE = 50       # /api/sessions 默认每页条数
+    MESSAGES_PAGE_SIZE = 100      # /api/sessions/{id}/messages 默认每页条数
+    MAX_PAGE_SIZE = 500
+    # write-behind：消息与上下文写入先进内存队列，攒够一批或等待超时后合并为一个事务提交
+    WRITE_BEHIND_BATCH = 256
+    WRITE_BEHIND_MAX_WAIT_MS = 5
+    WRITE_BEHIND_MAX_RETRIES = 5  # 数据库被锁等暂时失败的语句重试次数，超过后记录完整语句并丢弃
+
+    # --- 生成调度 (generation_scheduler.py) ---
+    # Ollama 为单个 CPU 后端：同时生成数上限，超出的请求排队 (按会话轮转)，队列满时返回 429
+    GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", 2))
+    GENERATION_QUEUE_SIZE = int(os.getenv("GENERATION_QUEUE_SIZE", 16))
+    GENERATION_QUEUE_TIMEOUT = 120      # 秒，排队超过该时间放弃 (低于 LLM request_timeout)
+    GENERATION_INITIAL_ESTIMATE = 20.0  # 秒，单次生成耗时的初始估计，用于 Retry-After
+
+    # --- 流式输出 (streaming.py) ---
+    # 相邻 token 合并到 STREAM_FLUSH_CHARS 个字符或等待 STREAM_FLUSH_MS 后再写出
+    STREAM_FLUSH_CHARS = 24
+    STREAM_FLUSH_MS = 40
+
+    # 滚动对话摘要 (conversation_summary.py)：滑出 HISTORY_MESSAGES 窗口的消息在后台合并进会话摘要
+    CONVERSATION_SUMMARY = os.getenv("CONVERSATION_SUMMARY", "1") == "1"
+    SUMMARY_MAX_TOKENS = 300         # 摘要长度上限
+    SUMMARY_BATCH_MESSAGES = 20      # 单次合并的消息条数 (旧的长会话分批补齐)
+    SUMMARY_MESSAGE_MAX_TOKENS = 400 # 每条消息送入摘要前的截断长度
+
+    # --- 指标与追踪 (metrics.py) ---
+    # 各阶段耗时在 GET /metrics 以 Prometheus 文本格式暴露；每个请求分配 trace_id (响应头 X-Trace-Id)
+    TRACE_IDS = os.getenv("TRACE_IDS", "1") == "1"
     
     # --- Milvus & Embedding (Base 版配置) ---
+    # 向量库后端: milvus / local (嵌入式，见 local_vector_store.py，单机部署无需 Milvus 容器)
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "milvus").lower()
     MILVUS_URI = os.getenv("MILVUS_URI", "http://milvus-standalone:19530")
     
     #1. 改名：使用 Base 专用集合名，避免与旧数据冲突
     COLLECTION_NAME = "rag_bge_base_v1" 
+    # 服务读写的 Milvus 别名，首次启动时指向 COLLECTION_NAME；
+    # 换模型或切片参数后用 reindex.py 在后台建新集合，校验通过后原子切换别名
+    COLLECTION_ALIAS = os.getenv("COLLECTION_ALIAS", "rag_active")
     
     #2. 换模型：使用 BGE-Base (性能与速度的黄金平衡点)
     # 如果本地没有，系统会自动从 HF 镜像下载
@@ -58,14 +109,121 @@ class Config:
     #CPU 建议设为 32
     EMBEDDING_BATCH_SIZE = 32
 
+    # 精度: int8 (动态量化, CPU 推荐) / fp32
+    EMBEDDING_PRECISION = os.getenv("EMBEDDING_PRECISION", "int8").lower()
+
+    # 入库切片的 embedding 磁盘缓存 (embedding_cache.py)，按模型 + 精度 + 切片文本哈希寻址
+    EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "1") == "1"
+    EMBEDDING_CACHE_DIR = os.path.join(MODEL_CACHE_DIR, "embedding_cache")
+    EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", 2048))
+    EMBEDDING_CACHE_SEGMENT_ROWS = 16384   # 每段向量数 (768 维约 48 MB)，淘汰以段为单位
+
+    # Milvus 索引 profile (index_profiles.py)：索引类型与构建/检索参数，切换后需重建索引
+    #   hnsw: 精度最高、内存最大 (原始向量 + 图)；ivf_flat: 原始向量 + 倒排
+    #   ivf_sq8: 8bit 标量量化 (约 1/4 内存)；ivf_pq: 乘积量化 (约 1/30 内存)
+    #   rescore > 1 时多取 rescore 倍候选，再用原始向量精确重排，弥补量化损失
+    VECTOR_INDEX_PROFILE = os.getenv("VECTOR_INDEX_PROFILE", "hnsw").lower()
+    VECTOR_INDEX_PROFILES = {
+        "hnsw":     {"index_type": "HNSW", "params": {"M": 16, "efConstruction": 64}, "search": {"ef": 64}},
+        "ivf_flat": {"index_type": "IVF_FLAT", "params": {"nlist": 1024}, "search": {"nprobe": 16}},
+        "ivf_sq8":  {"index_type": "IVF_SQ8", "params": {"nlist": 1024}, "search": {"nprobe": 16}, "rescore": 4},
+        "ivf_pq":   {"index_type": "IVF_PQ", "params": {"nlist": 1024, "m": 48, "nbits": 8}, "search": {"nprobe": 32}, "rescore": 8},
+    }
+
+    # --- 检索 ---
+    # 检索 (query embedding + Milvus) 在独立线程池执行，避免阻塞事件循环
+    RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", 4))
+    SIMILARITY_TOP_K = 2
+
+    # 并发 query 的 embedding 微批处理 (embedding_batcher.py)
+    QUERY_BATCHING = os.getenv("QUERY_BATCHING", "1") == "1"
+    QUERY_BATCH_MAX_SIZE = 16
+    QUERY_BATCH_MAX_WAIT_MS = 5
+
+    # Query 向量 / 检索结果缓存 (query_cache.py)
+    QUERY_CACHE_SIZE = 1024
+    QUERY_CACHE_TTL = 600      # 秒
+
+    # 语义答案缓存 (answer_cache.py)，有视频上下文时不使用
+    ANSWER_CACHE = os.getenv("ANSWER_CACHE", "0") == "1"
+    ANSWER_CACHE_THRESHOLD = 0.95
+    ANSWER_CACHE_SIZE = 512
+    ANSWER_CACHE_TTL = 24 * 3600
+
+    # BM25 + 稠密混合检索 (sparse_index.py)，两路各取候选后用 RRF 融合，最终仍取 SIMILARITY_TOP_K
+    HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+    HYBRID_CANDIDATES = 10
+    RRF_K = 60
+    # 稀疏索引每次 commit 只写改动切片的增量段；段数或墓碑 (删除/替换的旧切片) 占比超过阈值时后台合并为一个基础段
+    SPARSE_MAX_SEGMENTS = int(os.getenv("SPARSE_MAX_SEGMENTS", 8))
+    SPARSE_MERGE_RATIO = float(os.getenv("SPARSE_MERGE_RATIO", 0.2))
+
+    # 嵌入式向量库 (VECTOR_BACKEND=local)：float16 向量 mmap + IVF 倒排索引
+    LOCAL_IVF_MIN_ROWS = 5000       # 向量数少于该值时直接全量扫描，不建 IVF (fp16 转 fp32 是全量扫描的主要开销)
+    LOCAL_IVF_NLIST = 0             # 聚类中心数，0 为自动 (约 4·sqrt(N))
+    LOCAL_IVF_NPROBE = int(os.getenv("LOCAL_IVF_NPROBE", 16))  # 检索时扫描的簇数，越大召回越高
+    LOCAL_IVF_REBUILD_RATIO = 0.2   # 未入簇的新增向量超过已索引向量的该比例时重建 IVF
+    LOCAL_COMPACT_RATIO = 0.3       # 已删除向量占比超过该值时压缩向量文件
+    # 存储精度: fp16 / binary (另在内存中保留 1-bit 符号编码，汉明距离粗排后取 LOCAL_BINARY_RESCORE 倍候选用 fp16 重打分)
+    LOCAL_VECTOR_QUANTIZATION = os.getenv("LOCAL_VECTOR_QUANTIZATION", "fp16").lower()
+    LOCAL_BINARY_RESCORE = 8
+
     # --- Rerank ---
     RERANK_MODEL = "BAAI/bge-reranker-v2-m3"
+    # 默认关闭；开启后从 RERANK_CANDIDATES 个候选中重排出 SIMILARITY_TOP_K 个，超出预算回退稠密排序
+    RERANK = os.getenv("RERANK", "0") == "1"
+    RERANK_BACKEND = os.getenv("RERANK_BACKEND", "torch-int8")  # torch-int8 / onnx
+    RERANK_ONNX_PATH = os.getenv("RERANK_ONNX_PATH", os.path.join(MODEL_CACHE_DIR, "bge-reranker-onnx"))
+    RERANK_CANDIDATES = 20
+    RERANK_BUDGET_MS = int(os.getenv("RERANK_BUDGET_MS", 800))
+    RERANK_WORKERS = 1
+    RERANK_CHUNK = 4    # 每次前向的 (query, 切片) 对数，块间检查预算，超时的任务尽快让出线程
+    RERANK_THREADS = 4
+    RERANK_MAX_LENGTH = 512
     
     # --- RAG 切片 ---
     CHUNK_SIZE = 512 
     CHUNK_OVERLAP = 50
+    # 切片策略: regulation (按 章/节/条 切分并合并短条款，见 regulation_splitter.py；无条款结构的文档回退 sentence) / sentence
+    # 切换后已入库文件的切片不会自动更新，用 reindex.py 重建集合
+    CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "regulation").lower()
+
+    # --- PDF 解析 (pdf_pipeline.py) ---
+    # 服务端入库时按页段并行抽取文本层，无文本层 (扫描件) 的页栅格化后 OCR；进程池在服务内共享
+    PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", max(1, (os.cpu_count() or 2) // 4)))
+    PDF_OCR_WORKERS = int(os.getenv("PDF_OCR_WORKERS", 2))  # 每个 OCR 进程 OCR_THREADS // PDF_OCR_WORKERS 个线程
+    PDF_PAGE_BATCH = 8        # 每个解析任务的页数
+    PDF_STREAM_PAGES = 16     # 每攒够多少页切片并向量化一次
+    PDF_OCR_MIN_CHARS = 20    # 文本层有效字符少于此值的页视为扫描页
+    PDF_OCR_DPI = 200
+
+    # --- 批量入库 (bulk_ingest.py) ---
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+    INGEST_EMBED_BATCH = 512    # 跨文件共享的 embedding 批大小 (切片数)
+    MILVUS_INSERT_BATCH = 2000  # 单次写入 Milvus 的向量数
+
+    # --- 集合重建 (reindex.py) ---
+    # 在线服务同机运行时限速：小批量 embedding，按占空比休眠，降低进程优先级与 torch 线程数
+    REINDEX_BATCH = 64
+    REINDEX_DUTY_CYCLE = float(os.getenv("REINDEX_DUTY_CYCLE", 0.5))  # 工作时间占比，其余时间让出 CPU
+    REINDEX_THREADS = int(os.getenv("REINDEX_THREADS", 2))
+    REINDEX_NICE = 10
+
+    # --- 入库任务队列 (job_queue.py) ---
+    DOC_INGEST_WORKERS = int(os.getenv("DOC_INGEST_WORKERS", 2))
+    VIDEO_INGEST_WORKERS = int(os.getenv("VIDEO_INGEST_WORKERS", 1))
+    JOB_MAX_ATTEMPTS = 3
+    JOB_RETRY_BACKOFF = 10.0   # 秒，按 2^n 递增
+    JOB_POLL_INTERVAL = 2.0
+
+    # --- 文件类型 (上传接口、bulk_ingest.py、reindex.py 共用) ---
+    IMAGE_EXTS = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']
+    DOC_EXTS = ['.txt', '.md', '.pdf', '.docx', '.doc']
+    VIDEO_EXTS = ['.mp4', '.avi', '.mov', '.mkv', '.flv']
 
     # --- 多模态 ---
+    # 服务启动时在后台预加载视觉/听觉模型；纯文档部署或压测时可关闭
+    PRELOAD_VIDEO_MODELS = os.getenv("PRELOAD_VIDEO_MODELS", "1") == "1"
     VISION_MODEL_ID ="/home/liaozhenhao/liao-warehouse/deepseek_rag_project/model_cache/models--Qwen--Qwen2-VL-7B-Instruct"
     AUDIO_MODEL_SIZE = "large-v3"  
     VIDEO_FRAME_INTERVAL = 2
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from config import Config
+from session_manager import session_manager
+from prompts import build_summary_messages
+from token_budget import get_token_counter
+from generation_scheduler import generation_scheduler
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class ConversationSummarizer:
+    """
+    会话滚动摘要：每轮回答落库后在后台把滑出历史窗口 (最近 HISTORY_MESSAGES 条) 的消息合并进摘要。
+    构建 prompt 时只读 "摘要 + 最近 N 条"，会话再长，读库量和 prompt 长度都保持不变。
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.counter = get_token_counter()
+        self.tasks = {}       # session_id -> 正在运行的摘要任务
+        self.dirty = set()    # 任务运行期间又有新消息的会话，结束后再跑一轮
+        self.stats = {"updates": 0, "errors": 0}
+
+    def schedule(self, session_id):
+        """在事件循环中调度摘要更新；同一会话同时只运行一个任务"""
+        if session_id in self.tasks:
+            self.dirty.add(session_id)
+            return
+        task = asyncio.get_running_loop().create_task(self._run(session_id))
+        self.tasks[session_id] = task
+
+    async def _run(self, session_id):
+        try:
+            while True:
+                self.dirty.discard(session_id)
+                await self.update(session_id)
+                if session_id not in self.dirty:
+                    break
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"❌ 会话摘要更新失败 ({session_id}): {e}")
+        finally:
+            self.tasks.pop(session_id, None)
+
+    async def update(self, session_id):
+        while True:
+            # 读己之写会等待写线程提交，在线程中读取，不阻塞事件循环
+            recent = await asyncio.to_thread(session_manager.get_recent_messages, session_id, Config.HISTORY_MESSAGES)
+            if len(recent) < Config.HISTORY_MESSAGES:
+                return
+            summary, upto = await asyncio.to_thread(session_manager.get_summary, session_id)
+            pending = await asyncio.to_thread(
+                session_manager.get_messages_between,
+                session_id, upto, recent[0]["id"], Config.SUMMARY_BATCH_MESSAGES
+            )
+            if not pending:
+                return
+
+            summary = await self._merge(summary, pending)
+            session_manager.update_summary(session_id, summary, pending[-1]["id"])
+            self.stats["updates"] += 1
+            logger.info(f"🗂️ 会话摘要已更新 ({session_id}): 合并 {len(pending)} 条消息, {len(summary)} 字")
+            if len(pending) < Config.SUMMARY_BATCH_MESSAGES:
+                return
+
+    def _prepare(self, summary, messages):
+        """清洗并截断待合并消息，并把摘要的 token 上限换算成提示词里的字数上限"""
+        cleaned = []
+        for msg in messages:
+            content = (msg["content"] or "").replace("<think>", "").replace("</think>", "")
+            if content:
+                content = self.counter.truncate(content, Config.SUMMARY_MESSAGE_MAX_TOKENS, keep_tail=True)
+                cleaned.append({"role": msg["role"], "content": content})
+        # 模型只能按字数控制长度：按本次对话中文的 字数/token 比换算，留 10% 余量，避免生成后再被 token 截断
+        sample = (summary or "") + "".join(m["content"] for m in cleaned)
+        return cleaned, self.counter.cjk_chars(Config.SUMMARY_MAX_TOKENS * 9 // 10, sample)
+
+    async def _merge(self, summary, messages):
+        # token 计数与截断是 CPU 密集的，在线程中执行
+        cleaned, max_chars = await asyncio.to_thread(self._prepare, summary, messages)
+        if not cleaned:
+            return summary
+
+        # 与回答共用 Ollama 并发上限，低优先级：有用户请求排队时让出槽位
+        async with generation_scheduler.background_slot():
+            response = await self.llm.achat(build_summary_messages(summary, cleaned, max_chars))
+        new_summary = (response.message.content or "").strip()
+        if "</think>" in new_summary:
+            new_summary = new_summary.split("</think>")[-1].strip()
+        new_summary = await asyncio.to_thread(self.counter.truncate, new_summary, Config.SUMMARY_MAX_TOKENS)
+        return new_summary or summary
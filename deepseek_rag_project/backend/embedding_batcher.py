@@ -0,0 +1,75 @@
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class QueryEmbeddingBatcher:
+    """跨请求的 query embedding 微批处理：把几毫秒内到达的查询合并成一次前向计算。"""
+
+    def __init__(self, embed_fn, max_batch_size=Config.QUERY_BATCH_MAX_SIZE, max_wait_ms=Config.QUERY_BATCH_MAX_WAIT_MS):
+        # embed_fn(texts: List[str]) -> List[List[float]]
+        self.embed_fn = embed_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.stats = {"batches": 0, "queries": 0}
+        self.thread = threading.Thread(target=self._loop, name="query-embed-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, text) -> Future:
+        future = Future()
+        self.requests.put((text, future))
+        return future
+
+    def embed(self, text):
+        return self.submit(text).result()
+
+    async def aembed(self, text):
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self):
+        # 阻塞等待第一条，再在 max_wait 窗口内尽量凑满一批
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self.embed_fn(texts)
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                logger.error(f"❌ Query 批量向量化失败: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self.stats["batches"] += 1
+            self.stats["queries"] += len(batch)
+
+_batcher = None
+_batcher_lock = threading.Lock()
+def get_query_batcher():
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                from embedding_provider import get_embedding_provider
+                _batcher = QueryEmbeddingBatcher(get_embedding_provider().embed_queries)
+    return _batcher
@@ -0,0 +1,225 @@
+"""
+Embedding 磁盘缓存：按 (模型, 量化精度, 切片文本哈希) 内容寻址，重复入库、重建集合、调整切片参数时只向量化新切片。
+
+目录 EMBEDDING_CACHE_DIR/<模型>-<精度>/：
+  index.db      SQLite，切片哈希 -> (段号, 行号)；多进程写入通过写事务互斥
+  seg-<n>.f32   定长 float32 行 (与模型输出一致，复用结果与重新计算相同)，读取时 np.memmap 映射
+总大小超过 EMBEDDING_CACHE_MAX_MB 时整段淘汰最旧的段；最旧段中被命中的向量会复制到当前段 (近似 LRU)。
+
+python embedding_cache.py --stats / --clear
+"""
+import os
+import sqlite3
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+import numpy as np
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 单条 SQL 的参数个数上限以内分批查询
+_LOOKUP_BATCH = 500
+
+def cache_dir_for(model_name, precision):
+    return os.path.join(Config.EMBEDDING_CACHE_DIR, f"{model_name.replace('/', '--')}-{precision}")
+
+class EmbeddingCache:
+    def __init__(self, cache_dir, max_bytes=Config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+                 segment_rows=Config.EMBEDDING_CACHE_SEGMENT_ROWS):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.segment_rows = segment_rows
+        self.conn = sqlite3.connect(os.path.join(cache_dir, "index.db"), timeout=Config.SESSION_DB_TIMEOUT, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.lock = threading.RLock()
+        self.maps = {}  # 段号 -> memmap (只读)
+        self.hits = 0
+        self.misses = 0
+        self.create_tables()
+
+    def create_tables(self):
+        with self.lock:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS segments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    rows INTEGER,
+                    dim INTEGER
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    segment INTEGER,
+                    row INTEGER
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_segment ON entries (segment)')
+            self.conn.commit()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.cache_dir, f"seg-{segment}.f32")
+
+    @contextmanager
+    def _write(self):
+        """跨进程写事务：拿到 SQLite 写锁后段文件的追加位置不会被其他进程改变"""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+
+    def _read(self, segment, row, dim):
+        mm = self.maps.get(segment)
+        if mm is None or row >= mm.shape[0]:
+            # 段文件在持续追加，映射过期后按当前大小重新映射
+            try:
+                rows = os.path.getsize(self._segment_path(segment)) // (dim * 4)
+            except FileNotFoundError:
+                return None
+            if row >= rows:
+                return None
+            mm = np.memmap(self._segment_path(segment), dtype=np.float32, mode="r", shape=(rows, dim))
+            self.maps[segment] = mm
+        return np.array(mm[row])
+
+    def get_many(self, keys):
+        """返回 {key: np.ndarray}，不存在的 key 不出现在结果中"""
+        keys = list(dict.fromkeys(keys))
+        found, promote = {}, []
+        with self.lock:
+            oldest, newest, total = self.conn.execute(
+                'SELECT MIN(id), MAX(id), COALESCE(SUM(rows * dim * 4), 0) FROM segments'
+            ).fetchone()
+            for i in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[i:i + _LOOKUP_BATCH]
+                rows = self.conn.execute(
+                    f'SELECT e.key, e.segment, e.row, s.dim FROM entries e JOIN segments s ON s.id = e.segment '
+                    f'WHERE e.key IN ({",".join("?" * len(batch))})', batch
+                ).fetchall()
+                for key, segment, row, dim in rows:
+                    vector = self._read(segment, row, dim)
+                    if vector is None:
+                        continue
+                    found[key] = vector
+                    # 再写满一段就会淘汰最旧段时，才把其中仍在使用的向量搬到当前段
+                    if segment == oldest and oldest != newest and total + self.segment_rows * dim * 4 > self.max_bytes:
+                        promote.append(key)
+            # 其他进程淘汰掉的段不再被引用，释放映射
+            for segment in [s for s in self.maps if oldest is None or s < oldest]:
+                del self.maps[segment]
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        if promote:
+            self.put_many(promote, [found[k] for k in promote], replace=True)
+        return found
+
+    def put_many(self, keys, vectors, replace=False):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(keys):
+            return
+        dim = vectors.shape[1]
+        with self._write():
+            if not replace:
+                existing = set()
+                for i in range(0, len(keys), _LOOKUP_BATCH):
+                    batch = list(keys[i:i + _LOOKUP_BATCH])
+                    existing.update(row[0] for row in self.conn.execute(
+                        f'SELECT key FROM entries WHERE key IN ({",".join("?" * len(batch))})', batch
+                    ))
+                todo = {k: v for k, v in zip(keys, vectors) if k not in existing}
+            else:
+                todo = dict(zip(keys, vectors))
+            if not todo:
+                return
+            keys, vectors = list(todo), np.stack(list(todo.values()))
+
+            current = self.conn.execute('SELECT id, rows, dim FROM segments ORDER BY id DESC LIMIT 1').fetchone()
+            written = 0
+            while written < len(keys):
+                if current is None or current[1] >= self.segment_rows or current[2] != dim:
+                    # 段号自增不复用，其他进程缓存的旧映射不会指向新内容
+                    segment = self.conn.execute('INSERT INTO segments (rows, dim) VALUES (0, ?)', (dim,)).lastrowid
+                    current = (segment, 0, dim)
+                segment, start, _ = current
+                take = min(len(keys) - written, self.segment_rows - start)
+                with open(self._segment_path(segment), "ab") as f:
+                    # 丢弃上次中断写入 (未提交) 留下的尾部
+                    f.truncate(start * dim * 4)
+                    f.write(vectors[written:written + take].tobytes())
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO entries (key, segment, row) VALUES (?, ?, ?)',
+                    [(key, segment, start + j) for j, key in enumerate(keys[written:written + take])]
+                )
+                self.conn.execute('UPDATE segments SET rows = ? WHERE id = ?', (start + take, segment))
+                current = (segment, start + take, dim)
+                written += take
+            self._evict()
+
+    def _evict(self):
+        """整段淘汰最旧的段直到总大小不超过上限 (当前写入段保留)"""
+        segments = self.conn.execute('SELECT id, rows * dim * 4 FROM segments ORDER BY id').fetchall()
+        total = sum(size for _, size in segments)
+        for segment, size in segments[:-1]:
+            if total <= self.max_bytes:
+                break
+            self.conn.execute('DELETE FROM entries WHERE segment = ?', (segment,))
+            self.conn.execute('DELETE FROM segments WHERE id = ?', (segment,))
+            # 其他进程已建立的映射在 unlink 后仍可读，之后查询不会再引用该段
+            try:
+                os.remove(self._segment_path(segment))
+            except FileNotFoundError:
+                pass
+            self.maps.pop(segment, None)
+            total -= size
+            logger.info(f"🧹 Embedding 缓存淘汰段 {segment} ({size / (1024 * 1024):.1f} MB)")
+
+    def clear(self):
+        with self._write():
+            for (segment,) in self.conn.execute('SELECT id FROM segments').fetchall():
+                try:
+                    os.remove(self._segment_path(segment))
+                except FileNotFoundError:
+                    pass
+            self.conn.execute('DELETE FROM entries')
+            self.conn.execute('DELETE FROM segments')
+            self.maps.clear()
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            segments, size = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(rows * dim * 4), 0) FROM segments').fetchone()
+            total = self.hits + self.misses
+            return {
+                "entries": entries,
+                "segments": segments,
+                "disk_mb": round(size / (1024 * 1024), 1),
+                "max_mb": round(self.max_bytes / (1024 * 1024), 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding 磁盘缓存维护")
+    parser.add_argument("--stats", action="store_true", help="打印各模型缓存的条数与磁盘占用")
+    parser.add_argument("--clear", action="store_true", help="清空全部缓存")
+    args = parser.parse_args()
+
+    if not os.path.isdir(Config.EMBEDDING_CACHE_DIR):
+        raise SystemExit(f"缓存目录不存在: {Config.EMBEDDING_CACHE_DIR}")
+    for name in sorted(os.listdir(Config.EMBEDDING_CACHE_DIR)):
+        path = os.path.join(Config.EMBEDDING_CACHE_DIR, name)
+        if not os.path.isdir(path):
+            continue
+        if args.clear:
+            EmbeddingCache(path).clear()
+            print(f"🗑️ 已清空 {name}")
+        else:
+            print(f"{name}: {EmbeddingCache(path).stats()}")
@@ -0,0 +1,125 @@
+import io
+import logging
+import threading
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class EmbeddingProvider:
+    """进程级 Embedding 模型提供者：整个进程只加载一份模型，入库与检索共用同一精度。"""
+
+    def __init__(self):
+        self.model_name = Config.EMBEDDING_MODEL
+        self.precision = Config.EMBEDDING_PRECISION
+        self.memory_bytes = 0
+
+        # torch / HuggingFace 在首次创建模型时才导入，只导入本模块的进程 (如 spawn 出的解析子进程) 不加载它们
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+        logger.info(f"🔌 加载 Embedding: {self.model_name} (Precision={self.precision}, BatchSize={Config.EMBEDDING_BATCH_SIZE})")
+        self.embed_model = HuggingFaceEmbedding(
+            model_name=self.model_name,
+            cache_folder=Config.MODEL_CACHE_DIR,
+            device="cpu",
+            embed_batch_size=Config.EMBEDDING_BATCH_SIZE
+        )
+
+        if self.precision == "int8":
+            self._quantize_int8()
+
+        self.memory_bytes = self._measure_memory()
+        logger.info(f"   📦 Embedding 模型内存占用: {self.memory_bytes / (1024 * 1024):.1f} MB ({self.precision})")
+
+        # 量化失败会回退 fp32，缓存按最终精度分目录
+        self._init_cache()
+
+    def _init_cache(self):
+        self.cache = None
+        if Config.EMBEDDING_CACHE:
+            from embedding_cache import EmbeddingCache, cache_dir_for
+            self.cache = EmbeddingCache(cache_dir_for(self.model_name, self.precision))
+
+    def _transformer(self):
+        # 深入获取内部的 sentence-transformers 模型的 Transformer 本体
+        internal_model = self.embed_model._model
+        if hasattr(internal_model, 'encode'):
+            return internal_model[0].auto_model
+        return None
+
+    def _quantize_int8(self):
+        # 🔥 对 Transformer 的 Linear 层做动态量化 (FP32 -> Int8)
+        import torch
+        try:
+            auto_model = self._transformer()
+            if auto_model is None:
+                raise RuntimeError("未找到 SentenceTransformer 内部模型")
+            torch.quantization.quantize_dynamic(
+                auto_model,
+                {torch.nn.Linear},
+                dtype=torch.qint8,
+                inplace=True
+            )
+            logger.info("   ✅ Embedding 模型量化成功！(FP32 -> Int8)")
+        except Exception as e:
+            logger.warning(f"   ⚠️ Embedding 量化尝试失败 (将使用原精度): {e}")
+            self.precision = "fp32"
+
+    def _measure_memory(self):
+        # 量化后的 packed 权重不在 parameters() 中，序列化 state_dict 统计更准确
+        try:
+            auto_model = self._transformer()
+            if auto_model is None:
+                return 0
+            import torch
+            buffer = io.BytesIO()
+            torch.save(auto_model.state_dict(), buffer)
+            return buffer.tell()
+        except Exception as e:
+            logger.warning(f"   ⚠️ Embedding 内存统计失败: {e}")
+            return 0
+
+    def embed_queries(self, texts):
+        """一次前向计算批量编码多条 query (与 get_query_embedding 结果一致)"""
+        model = self.embed_model
+        if hasattr(model, "_embed"):
+            return model._embed(list(texts), prompt_name="query")
+        return [model.get_query_embedding(t) for t in texts]
+
+    def embed_documents(self, texts):
+        """批量编码入库切片 (与 get_text_embedding_batch 结果一致)：命中磁盘缓存的直接复用，只对新文本前向计算"""
+        texts = list(texts)
+        if self.cache is None or not texts:
+            return self.embed_model.get_text_embedding_batch(texts)
+        from ingest_manifest import hash_text
+        keys = [hash_text(t) for t in texts]
+        found = self.cache.get_many(keys)
+        missing = {k: t for k, t in zip(keys, texts) if k not in found}
+        if missing:
+            vectors = self.embed_model.get_text_embedding_batch(list(missing.values()))
+            self.cache.put_many(list(missing), vectors)
+            found.update(zip(missing, vectors))
+        if found and len(found) > len(missing):
+            logger.info(f"   ♻️ Embedding 缓存命中 {len(found) - len(missing)}/{len(found)} 个切片")
+        return [list(map(float, found[k])) for k in keys]
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "precision": self.precision,
+            "memory_mb": round(self.memory_bytes / (1024 * 1024), 1),
+            "cache": self.cache.stats() if self.cache else None,
+        }
+
+_provider = None
+_provider_lock = threading.Lock()
+def get_embedding_provider():
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = EmbeddingProvider()
+    return _provider
+
+def get_embed_model():
+    return get_embedding_provider().embed_model
@@ -0,0 +1,192 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from collections import deque, OrderedDict
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class GenerationQueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"生成队列已满，请 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+
+class GenerationTicket:
+    __slots__ = ("session_id", "enqueued_at", "started_at", "future", "holding", "released", "background")
+
+    def __init__(self, background=False):
+        self.background = background
+        self.session_id = None
+        self.enqueued_at = None
+        self.started_at = None
+        self.future = None
+        self.holding = False
+        self.released = False
+
+class GenerationScheduler:
+    """
+    LLM 生成的准入控制与公平调度 (Ollama 是单个 CPU 后端，并发越多每路越慢)：
+      - 同时生成的请求数不超过 max_concurrency，其余排队
+      - 准入数 (生成中 + 排队 + 已准入尚在检索) 超过 max_concurrency + max_queue 时直接拒绝，并给出 Retry-After
+      - 排队按会话轮转出队，同一会话连发多个请求不会挤占其他会话
+      - 后台生成 (会话摘要) 走 background_slot()：同样占用并发槽位，但只在没有交互请求排队时分配，不占准入名额
+    只在事件循环线程中使用，无需加锁。
+    """
+
+    def __init__(self, max_concurrency=Config.GENERATION_CONCURRENCY, max_queue=Config.GENERATION_QUEUE_SIZE):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.active = 0
+        self.admitted = 0
+        self.waiting = OrderedDict()  # session_id -> deque[ticket]，OrderedDict 的顺序即轮转顺序
+        self.queued = 0
+        self.background_waiting = deque()
+        self.wait_times = deque(maxlen=1000)
+        self.avg_generation = Config.GENERATION_INITIAL_ESTIMATE
+        self.counters = {"accepted": 0, "rejected": 0, "completed": 0, "timeouts": 0}
+
+    def retry_after(self):
+        """按当前排队长度和平均生成时长估算多久后有空位"""
+        rounds = self.queued / self.max_concurrency + 1
+        return max(1, int(rounds * self.avg_generation + 0.5))
+
+    def admit(self):
+        """请求入口调用 (开始流式响应之前)：超出容量时抛出 GenerationQueueFull"""
+        if self.admitted >= self.max_concurrency + self.max_queue:
+            self.counters["rejected"] += 1
+            raise GenerationQueueFull(self.retry_after())
+        self.admitted += 1
+        self.counters["accepted"] += 1
+        return GenerationTicket()
+
+    def enqueue(self, ticket, session_id):
+        """申请生成槽位，立即分到时返回 True；否则进入该会话的等待队列，之后调用 wait()"""
+        ticket.session_id = session_id
+        ticket.enqueued_at = time.perf_counter()
+        if self.active < self.max_concurrency and not self.queued:
+            self._grant(ticket)
+            return True
+        ticket.future = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(session_id, deque()).append(ticket)
+        self.queued += 1
+        return False
+
+    async def wait(self, ticket):
+        """等待槽位；超时抛出 asyncio.TimeoutError，被取消时自动退出队列"""
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout=Config.GENERATION_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            self._dequeue(ticket)
+            raise
+        except asyncio.CancelledError:
+            self._dequeue(ticket)
+            raise
+
+    @asynccontextmanager
+    async def background_slot(self):
+        """低优先级生成槽位，用法: async with scheduler.background_slot(): await llm.achat(...)"""
+        ticket = GenerationTicket(background=True)
+        ticket.enqueued_at = time.perf_counter()
+        if self.active < self.max_concurrency and not self.queued and not self.background_waiting:
+            self._grant(ticket)
+        else:
+            ticket.future = asyncio.get_running_loop().create_future()
+            self.background_waiting.append(ticket)
+            try:
+                await asyncio.shield(ticket.future)
+            except asyncio.CancelledError:
+                if ticket in self.background_waiting:
+                    self.background_waiting.remove(ticket)
+                elif ticket.holding:
+                    ticket.holding = False
+                    self.active -= 1
+                    self._dispatch()
+                raise
+        try:
+            yield
+        finally:
+            ticket.holding = False
+            self.active -= 1
+            self._dispatch()
+
+    def position(self, ticket):
+        """排队位置 (从 1 开始)，按轮转顺序估算"""
+        queue = self.waiting.get(ticket.session_id)
+        if not queue or ticket not in queue:
+            return 0
+        depth = queue.index(ticket)
+        return sum(min(len(q), depth + 1) for q in self.waiting.values())
+
+    def release(self, ticket):
+        """生成结束或请求中止时调用，可重复调用"""
+        if ticket.released:
+            return
+        ticket.released = True
+        self.admitted -= 1
+        if ticket.holding:
+            ticket.holding = False
+            self.active -= 1
+            self.counters["completed"] += 1
+            elapsed = time.perf_counter() - ticket.started_at
+            self.avg_generation = 0.8 * self.avg_generation + 0.2 * elapsed
+            self._dispatch()
+        else:
+            self._dequeue(ticket)
+
+    def _grant(self, ticket):
+        ticket.holding = True
+        self.active += 1
+        ticket.started_at = time.perf_counter()
+        if not ticket.background:
+            self.wait_times.append(ticket.started_at - ticket.enqueued_at)
+        if ticket.future is not None and not ticket.future.done():
+            ticket.future.set_result(None)
+
+    def _dequeue(self, ticket):
+        queue = self.waiting.get(ticket.session_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self.queued -= 1
+            if not queue:
+                del self.waiting[ticket.session_id]
+        elif ticket.holding:
+            # 已分到槽位但请求在唤醒前被取消，归还槽位
+            ticket.holding = False
+            self.active -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        while self.active < self.max_concurrency and self.waiting:
+            session_id, queue = next(iter(self.waiting.items()))
+            ticket = queue.popleft()
+            self.queued -= 1
+            del self.waiting[session_id]
+            if queue:
+                # 该会话还有请求，排到轮转末尾
+                self.waiting[session_id] = queue
+            self._grant(ticket)
+        # 交互请求都已分到槽位后才轮到后台生成
+        while self.active < self.max_concurrency and self.background_waiting:
+            self._grant(self.background_waiting.popleft())
+
+    def stats(self):
+        waits = sorted(self.wait_times)
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(p / 100 * (len(waits) - 1)))] * 1000, 1) if waits else 0.0
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": self.queued,
+            "background_queued": len(self.background_waiting),
+            "admitted": self.admitted,
+            "wait_ms_p50": pct(50),
+            "wait_ms_p95": pct(95),
+            "avg_generation_s": round(self.avg_generation, 2),
+            **self.counters,
+        }
+
+generation_scheduler = GenerationScheduler()
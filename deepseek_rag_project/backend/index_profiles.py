@@ -0,0 +1,130 @@
+"""
+向量索引 profile：Config.VECTOR_INDEX_PROFILES 中的 Milvus 索引类型、构建/检索参数与重排倍数。
+
+集合为空时 (新建或刚清空) 直接按当前 profile 建索引；已有数据且索引与 profile 不一致时只告警，
+需要显式重建：python index_profiles.py --apply [--profile ivf_sq8]  (释放集合后重建，期间检索不可用；
+不停服可用 VECTOR_INDEX_PROFILE=ivf_sq8 python reindex.py 建新集合后切换别名)
+python index_profiles.py --list [--rows N]  按向量数估算各 profile 的查询节点内存。
+选型用 benchmarks.sweep_index_profiles 在自己的语料上测召回、延迟与内存。
+"""
+import copy
+import json
+import logging
+import argparse
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# bge 向量已归一化，内积即余弦；与已有集合 (llama-index 默认 IP) 保持一致
+METRIC_TYPE = "IP"
+
+def get_index_profile(name=None):
+    """返回 profile 的副本，补齐 name 与 rescore"""
+    name = (name or Config.VECTOR_INDEX_PROFILE).lower()
+    if name not in Config.VECTOR_INDEX_PROFILES:
+        raise ValueError(f"未知的索引 profile: {name} (可选: {', '.join(Config.VECTOR_INDEX_PROFILES)})")
+    profile = copy.deepcopy(Config.VECTOR_INDEX_PROFILES[name])
+    profile.setdefault("rescore", 1)
+    profile["name"] = name
+    return profile
+
+def with_overrides(profile, params=None, search=None, rescore=None):
+    """在 profile 基础上覆盖部分参数 (参数扫描用)，名称带上覆盖项便于在报告里区分"""
+    profile = copy.deepcopy(profile)
+    profile["params"].update(params or {})
+    profile["search"].update(search or {})
+    if rescore is not None:
+        profile["rescore"] = rescore
+    overrides = {**(params or {}), **(search or {}), **({"rescore": rescore} if rescore is not None else {})}
+    if overrides:
+        profile["name"] += "(" + ",".join(f"{k}={v}" for k, v in overrides.items()) + ")"
+    return profile
+
+def index_params(profile):
+    return {"index_type": profile["index_type"], "metric_type": METRIC_TYPE, "params": dict(profile["params"])}
+
+def search_params(profile, limit):
+    params = dict(profile["search"])
+    if "ef" in params:
+        # HNSW 要求 ef >= limit
+        params["ef"] = max(params["ef"], limit)
+    return {"metric_type": METRIC_TYPE, "params": params}
+
+def estimate_memory_bytes(profile, rows, dim=Config.EMBEDDING_DIM):
+    """查询节点加载该索引的近似内存 (只算向量与索引结构，不含标量字段与 Milvus 自身开销)"""
+    index_type, params = profile["index_type"], profile["params"]
+    if index_type == "HNSW":
+        # 原始 float32 向量 + 第 0 层约 2M 个邻居 (int32)
+        return rows * (dim * 4 + params["M"] * 2 * 4)
+    centroids = params.get("nlist", 0) * dim * 4
+    if index_type == "IVF_FLAT":
+        return rows * (dim * 4 + 8) + centroids
+    if index_type == "IVF_SQ8":
+        return rows * (dim + 8) + centroids + dim * 8
+    if index_type == "IVF_PQ":
+        codebooks = (2 ** params["nbits"]) * dim * 4
+        return rows * (params["m"] * params["nbits"] // 8 + 8) + centroids + codebooks
+    return rows * dim * 4
+
+def index_matches(current, profile):
+    """current 为 pymilvus Index.params，如 {"index_type": "HNSW", "metric_type": "IP", "params": {...}}"""
+    if not current or current.get("index_type") != profile["index_type"]:
+        return False
+    params = current.get("params") or {}
+    if isinstance(params, str):
+        params = json.loads(params)
+    # 不同 pymilvus 版本返回的参数值可能是字符串
+    return {k: str(v) for k, v in params.items()} == {k: str(v) for k, v in profile["params"].items()}
+
+def ensure_milvus_index(collection, field, profile, rebuild=False):
+    """collection 为 pymilvus.Collection；索引与 profile 一致时返回 True。
+    空集合直接重建；已有数据时只有 rebuild=True 才重建 (释放 → 删索引 → 建索引 → 加载)"""
+    current = collection.indexes[0].params if collection.indexes else None
+    if index_matches(current, profile):
+        return True
+    rows = collection.num_entities
+    if rows and not rebuild:
+        logger.warning(
+            f"⚠️ 集合 {collection.name} 的索引 {current} 与 profile {profile['name']} 不一致，继续使用现有索引；"
+            f"运行 python index_profiles.py --apply 重建"
+        )
+        return False
+    logger.info(f"🏗️ 按 profile {profile['name']} 建立 Milvus 索引 ({rows} 条向量)")
+    collection.release()
+    if collection.has_index():
+        collection.drop_index()
+    collection.create_index(field, index_params=index_params(profile))
+    collection.load()
+    return True
+
+def _open_collection():
+    from pymilvus import MilvusClient, Collection
+    from milvus_store import resolve_collection
+    client = MilvusClient(uri=Config.MILVUS_URI)
+    name = resolve_collection(client)
+    if not client.has_collection(name):
+        raise SystemExit(f"集合 {name} 不存在")
+    return Collection(name, using=client._using)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Milvus 索引 profile 查看与重建")
+    parser.add_argument("--list", action="store_true", help="列出 profile 及内存估算")
+    parser.add_argument("--rows", type=int, default=None, help="内存估算用的向量数，默认取当前集合")
+    parser.add_argument("--apply", action="store_true", help="按 profile 原地重建索引 (期间检索不可用)")
+    parser.add_argument("--profile", default=None, help="默认 Config.VECTOR_INDEX_PROFILE")
+    args = parser.parse_args()
+
+    if args.apply:
+        from milvus_store import EMBEDDING_FIELD
+        ensure_milvus_index(_open_collection(), EMBEDDING_FIELD, get_index_profile(args.profile), rebuild=True)
+        print(f"✅ 已按 profile {get_index_profile(args.profile)['name']} 重建索引")
+    if args.list or not args.apply:
+        rows = args.rows if args.rows is not None else _open_collection().num_entities
+        print(f"向量数 {rows}，维度 {Config.EMBEDDING_DIM}")
+        for name in Config.VECTOR_INDEX_PROFILES:
+            profile = get_index_profile(name)
+            mem_mb = estimate_memory_bytes(profile, rows) / (1024 * 1024)
+            mark = "*" if name == Config.VECTOR_INDEX_PROFILE else " "
+            print(f" {mark} {name:<9} {profile['index_type']:<9} {mem_mb:>9.1f} MB  "
+                  f"params={profile['params']} search={profile['search']} rescore={profile['rescore']}")
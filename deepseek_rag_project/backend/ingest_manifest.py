@@ -0,0 +1,107 @@
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from config import Config
+
+def hash_file(filepath, block_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class IngestManifest:
+    """入库清单：记录每个文件的内容哈希及其切片哈希 -> 向量 ID，用于增量入库。"""
+
+    def __init__(self):
+        self.conn = sqlite3.connect(Config.DB_PATH, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.create_tables()
+
+    def create_tables(self):
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS ingest_files (
+                    file_name TEXT PRIMARY KEY,
+                    file_hash TEXT,
+                    updated_at TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS ingest_chunks (
+                    file_name TEXT,
+                    chunk_hash TEXT,
+                    node_id TEXT,
+                    PRIMARY KEY (file_name, chunk_hash)
+                )
+            ''')
+            self.conn.commit()
+
+    def get_file_hash(self, file_name):
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT file_hash FROM ingest_files WHERE file_name = ?', (file_name,))
+            result = cursor.fetchone()
+        return result[0] if result else None
+
+    def get_chunks(self, file_name):
+        """返回 {chunk_hash: node_id}"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT chunk_hash, node_id FROM ingest_chunks WHERE file_name = ?', (file_name,))
+            rows = cursor.fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def list_files(self):
+        """返回 {file_name: file_hash}"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT file_name, file_hash FROM ingest_files')
+            rows = cursor.fetchall()
+        return dict(rows)
+
+    def save_file(self, file_name, file_hash, chunks):
+        """整体替换某文件的清单 (chunks: {chunk_hash: node_id})"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM ingest_chunks WHERE file_name = ?', (file_name,))
+            cursor.executemany(
+                'INSERT INTO ingest_chunks (file_name, chunk_hash, node_id) VALUES (?, ?, ?)',
+                [(file_name, h, node_id) for h, node_id in chunks.items()]
+            )
+            cursor.execute(
+                'INSERT OR REPLACE INTO ingest_files (file_name, file_hash, updated_at) VALUES (?, ?, ?)',
+                (file_name, file_hash, datetime.now())
+            )
+            self.conn.commit()
+
+    def remove_file(self, file_name):
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM ingest_chunks WHERE file_name = ?', (file_name,))
+            cursor.execute('DELETE FROM ingest_files WHERE file_name = ?', (file_name,))
+            self.conn.commit()
+
+    def replace_all(self, files):
+        """整体替换清单 (files: {file_name: (file_hash, chunks)})，重建集合切换别名后调用"""
+        now = datetime.now()
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM ingest_chunks')
+            cursor.execute('DELETE FROM ingest_files')
+            cursor.executemany(
+                'INSERT INTO ingest_chunks (file_name, chunk_hash, node_id) VALUES (?, ?, ?)',
+                [(name, h, node_id) for name, (_, chunks) in files.items() for h, node_id in chunks.items()]
+            )
+            cursor.executemany(
+                'INSERT INTO ingest_files (file_name, file_hash, updated_at) VALUES (?, ?, ?)',
+                [(name, file_hash, now) for name, (file_hash, _) in files.items()]
+            )
+            self.conn.commit()
+
+ingest_manifest = IngestManifest()
@@ -0,0 +1,184 @@
+import sqlite3
+import uuid
+import time
+import logging
+import threading
+from datetime import datetime
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class PermanentJobError(Exception):
+    """重试也不会成功的失败 (文件不存在、不支持的文件类型)：任务直接标记失败，不再排队重试"""
+
+class JobQueue:
+    """基于 SQLite 的持久化入库任务队列：按任务类型使用固定大小的工作线程池，失败自动重试，重启后恢复。"""
+
+    def __init__(self):
+        self.conn = sqlite3.connect(Config.DB_PATH, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.handlers = {}
+        self.pool_sizes = {}
+        self.wakeups = {}
+        self.threads = []
+        self.stop_event = threading.Event()
+        self.create_tables()
+
+    def create_tables(self):
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT,
+                    file_path TEXT,
+                    file_name TEXT,
+                    status TEXT,
+                    progress REAL,
+                    message TEXT,
+                    attempts INTEGER,
+                    max_attempts INTEGER,
+                    run_after REAL,
+                    created_at TIMESTAMP,
+                    updated_at TIMESTAMP
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (kind, status, run_after)')
+            self.conn.commit()
+
+    def register(self, kind, handler, workers):
+        """handler(job, progress) -> None，失败时抛出异常 (PermanentJobError 不重试)；progress(ratio, message) 用于上报进度"""
+        self.handlers[kind] = handler
+        self.pool_sizes[kind] = max(1, workers)
+        self.wakeups[kind] = threading.Event()
+
+    def submit(self, kind, file_path, file_name):
+        job_id = str(uuid.uuid4())
+        now = datetime.now()
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                'INSERT INTO jobs (id, kind, file_path, file_name, status, progress, message, attempts, max_attempts, run_after, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, kind, file_path, file_name, "queued", 0.0, "排队中", 0, Config.JOB_MAX_ATTEMPTS, 0.0, now, now)
+            )
+            self.conn.commit()
+        if kind in self.wakeups:
+            self.wakeups[kind].set()
+        return job_id
+
+    def _row_to_job(self, row):
+        return {
+            "id": row[0], "kind": row[1], "file_path": row[2], "file_name": row[3],
+            "status": row[4], "progress": row[5], "message": row[6],
+            "attempts": row[7], "max_attempts": row[8],
+            "created_at": row[9], "updated_at": row[10],
+        }
+
+    _COLUMNS = 'id, kind, file_path, file_name, status, progress, message, attempts, max_attempts, created_at, updated_at'
+
+    def get_job(self, job_id):
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(f'SELECT {self._COLUMNS} FROM jobs WHERE id = ?', (job_id,))
+            row = cursor.fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list_jobs(self, limit=50, status=None):
+        with self.lock:
+            cursor = self.conn.cursor()
+            if status:
+                cursor.execute(f'SELECT {self._COLUMNS} FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?', (status, limit))
+            else:
+                cursor.execute(f'SELECT {self._COLUMNS} FROM jobs ORDER BY created_at DESC LIMIT ?', (limit,))
+            rows = cursor.fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = datetime.now()
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+            self.conn.commit()
+
+    def _claim(self, kind):
+        """原子领取一个到期的排队任务"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "SELECT id FROM jobs WHERE kind = ? AND status = 'queued' AND run_after <= ? ORDER BY created_at ASC LIMIT 1",
+                (kind, time.time())
+            )
+            row = cursor.fetchone()
+            if not row:
+                return None
+            cursor.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, message = ?, updated_at = ? WHERE id = ? AND status = 'queued'",
+                ("处理中", datetime.now(), row[0])
+            )
+            self.conn.commit()
+            if cursor.rowcount != 1:
+                return None
+        return self.get_job(row[0])
+
+    def _worker_loop(self, kind):
+        handler = self.handlers[kind]
+        wakeup = self.wakeups[kind]
+        while not self.stop_event.is_set():
+            # 先清除再领取：领取之后才到达的 submit 会重新 set，不会被漏掉而多等一个轮询周期
+            wakeup.clear()
+            job = self._claim(kind)
+            if job is None:
+                wakeup.wait(timeout=Config.JOB_POLL_INTERVAL)
+                continue
+
+            def progress(ratio, message=None, job_id=job["id"]):
+                fields = {"progress": round(min(max(ratio, 0.0), 1.0), 3)}
+                if message:
+                    fields["message"] = message
+                self._update(job_id, **fields)
+
+            try:
+                logger.info(f"🛠️ 开始任务 [{kind}] {job['file_name']} (第 {job['attempts']} 次)")
+                handler(job, progress)
+                self._update(job["id"], status="done", progress=1.0, message="完成")
+                logger.info(f"✅ 任务完成 [{kind}] {job['file_name']}")
+            except PermanentJobError as e:
+                self._update(job["id"], status="failed", message=str(e))
+                logger.error(f"❌ 任务失败 (不可重试) [{kind}] {job['file_name']}: {e}")
+            except Exception as e:
+                if job["attempts"] < job["max_attempts"]:
+                    # 指数退避后重新排队
+                    delay = Config.JOB_RETRY_BACKOFF * (2 ** (job["attempts"] - 1))
+                    self._update(job["id"], status="queued", run_after=time.time() + delay, message=f"失败，{delay:.0f}s 后重试: {e}")
+                    logger.warning(f"⚠️ 任务失败，将重试 [{kind}] {job['file_name']}: {e}")
+                else:
+                    self._update(job["id"], status="failed", message=str(e))
+                    logger.error(f"❌ 任务失败 [{kind}] {job['file_name']}: {e}")
+
+    def start(self):
+        # 上次进程退出时仍在运行的任务重新排队
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute("UPDATE jobs SET status = 'queued', message = '服务重启，重新排队' WHERE status = 'running'")
+            self.conn.commit()
+
+        self.stop_event.clear()
+        for kind, size in self.pool_sizes.items():
+            for i in range(size):
+                t = threading.Thread(target=self._worker_loop, args=(kind,), name=f"job-{kind}-{i}", daemon=True)
+                t.start()
+                self.threads.append(t)
+        logger.info(f"🧵 入库任务队列已启动: {self.pool_sizes}")
+
+    def stop(self, timeout=5.0):
+        self.stop_event.set()
+        for wakeup in self.wakeups.values():
+            wakeup.set()
+        for t in self.threads:
+            t.join(timeout=timeout)
+        self.threads = []
+
+job_queue = JobQueue()
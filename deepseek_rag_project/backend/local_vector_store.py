@@ -0,0 +1,626 @@
+"""
+嵌入式向量库 (Config.VECTOR_BACKEND = "local")：单机部署不再需要 Milvus 容器，检索没有网络往返。
+
+  - 向量：归一化后的 float16 定长记录，追加写入 vectors.<代>.f16，以 np.memmap 只读映射
+  - 元数据：独立的 SQLite (meta.db)，行号 row 即向量记录号；节点序列化方式与 LlamaIndex 的 Milvus 集成一致
+  - IVF 索引：k-means 粗聚类 + 倒排表，检索只扫描 nprobe 个簇；之后追加的向量作为尾段全量扫描，积累到一定比例再重建
+  - file_name 过滤：只在该文件自己的记录上精确计算
+  - binary 模式 (LOCAL_VECTOR_QUANTIZATION=binary)：内存中只常驻 1-bit 符号编码 (fp16 的 1/16)，
+    汉明距离粗排后取 LOCAL_BINARY_RESCORE 倍候选，再读 fp16 向量精确重打分，不建 IVF
+  - 删除打墓碑，墓碑过多时压缩：写出新一代向量文件后在一个事务里切换，中途崩溃不影响旧数据
+其他进程 (如 bulk_ingest.py) 写入后，按 SQLite 的 data_version 变化自动重新加载。
+
+维护：python local_vector_store.py [--stats] [--rebuild] [--compact]
+"""
+import os
+import re
+import json
+import math
+import glob
+import sqlite3
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import node_to_metadata_dict, metadata_dict_to_node
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_FILE_FILTER_RE = re.compile(r'^\s*file_name\s*==\s*"(.*)"\s*$')
+_ID_AFTER_RE = re.compile(r'^\s*id\s*>\s*"(.*)"\s*$')
+SCAN_BLOCK_ROWS = 65536   # 全量扫描时每次转换为 float32 计算的行数
+MIN_COMPACT_ROWS = 1024   # 已删除向量少于该数量时不压缩
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+def binary_codes(vectors):
+    """符号位打包成 uint64 编码，每条向量 ceil(dim / 64) 个字"""
+    bits = np.packbits(np.asarray(vectors) > 0, axis=1)
+    pad = (-bits.shape[1]) % 8
+    if pad:
+        bits = np.pad(bits, ((0, 0), (0, pad)))
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+def _popcount64(x):
+    # numpy<2 没有 bitwise_count，用 SWAR 按 64 位并行计数
+    x = x - ((x >> np.uint64(1)) & _M1)
+    x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x = (x + (x >> np.uint64(4))) & _M4
+    return (x * _H01) >> np.uint64(56)
+
+def hamming_distances(codes, query_code, block=SCAN_BLOCK_ROWS):
+    """codes (N, W) 与 query_code (W,) 的汉明距离"""
+    distances = np.empty(len(codes), dtype=np.int64)
+    for start in range(0, len(codes), block):
+        distances[start:start + block] = _popcount64(codes[start:start + block] ^ query_code).sum(axis=1)
+    return distances
+
+def assign_clusters(vectors, rows, centroids, block=SCAN_BLOCK_ROWS):
+    """按块计算 rows 对应向量最近的聚类中心 (内积最大)"""
+    labels = np.empty(len(rows), dtype=np.int32)
+    for start in range(0, len(rows), block):
+        chunk = np.asarray(vectors[rows[start:start + block]], dtype=np.float32)
+        labels[start:start + block] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+def spherical_kmeans(data, k, iterations=10, seed=0):
+    """余弦距离的 k-means，返回归一化的聚类中心；空簇用随机样本重新初始化"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign_clusters(data, np.arange(len(data)), centroids)
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(k + 1))
+        for c in range(k):
+            members = order[bounds[c]:bounds[c + 1]]
+            centroids[c] = data[members].sum(axis=0) if len(members) else data[rng.integers(len(data))]
+        centroids = normalize(centroids)
+    return centroids
+
+class IVFIndex:
+    """lists 以 (offsets, rows) 的 CSR 形式保存：第 c 个簇的记录号为 rows[offsets[c]:offsets[c + 1]]"""
+
+    def __init__(self, centroids, offsets, rows, indexed_upto):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+        self.indexed_upto = indexed_upto
+
+    def probe(self, query, nprobe):
+        nearest = np.argsort(-(self.centroids @ query))[:nprobe]
+        return np.concatenate([self.rows[self.offsets[c]:self.offsets[c + 1]] for c in nearest])
+
+class LocalVectorIndex:
+    def __init__(self, index_dir, dim=Config.EMBEDDING_DIM):
+        self.index_dir = index_dir
+        self.dim = dim
+        self.row_bytes = dim * 2
+        self.quantization = Config.LOCAL_VECTOR_QUANTIZATION
+        if self.quantization not in ("fp16", "binary"):
+            raise ValueError(f"LOCAL_VECTOR_QUANTIZATION 只支持 fp16 / binary: {self.quantization}")
+        os.makedirs(index_dir, exist_ok=True)
+
+        self.conn = sqlite3.connect(os.path.join(index_dir, "meta.db"), timeout=Config.SESSION_DB_TIMEOUT, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.lock = threading.RLock()
+        self.rebuild_lock = threading.Lock()
+        self.create_tables()
+        self._load()
+
+    def create_tables(self):
+        with self.lock, self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS vectors (
+                    row INTEGER PRIMARY KEY,
+                    node_id TEXT,
+                    file_name TEXT,
+                    ref_doc_id TEXT,
+                    node TEXT,
+                    deleted INTEGER DEFAULT 0
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_vectors_node ON vectors (node_id)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_vectors_file ON vectors (file_name)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_vectors_ref_doc ON vectors (ref_doc_id)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    # --- 加载 ---
+
+    def _paths(self, generation):
+        return (
+            os.path.join(self.index_dir, f"vectors.{generation}.f16"),
+            os.path.join(self.index_dir, f"ivf.{generation}.npz"),
+        )
+
+    def _get_meta(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def _data_version(self):
+        # 只在其他连接 (其他进程) 提交后变化，本连接自己的提交不影响
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _load(self):
+        with self.lock:
+            self.generation = int(self._get_meta("generation", 0))
+            self.vectors_path, self.ivf_path = self._paths(self.generation)
+            rows = self.conn.execute('SELECT row, node_id, file_name, deleted FROM vectors ORDER BY row').fetchall()
+            count = rows[-1][0] + 1 if rows else 0
+
+            # 文件比元数据长：其他进程正在追加或写入中途退出，多出部分忽略 (下次写入时截掉)
+            file_rows = os.path.getsize(self.vectors_path) // self.row_bytes if os.path.exists(self.vectors_path) else 0
+            if file_rows < count:
+                logger.warning(f"⚠️ 向量文件缺少 {count - file_rows} 条记录，对应切片需要重新入库")
+                rows, count = rows[:file_rows], file_rows
+
+            self.count = count
+            self.alive = np.zeros(max(count, 1024), dtype=bool)
+            self.row_keys = [None] * count
+            self.node_rows = {}
+            self.file_rows = {}
+            for row, node_id, file_name, deleted in rows:
+                self.row_keys[row] = (node_id, file_name)
+                if not deleted:
+                    self._revive(row)
+            self._map()
+            self.codes = self._build_codes()
+            self.ivf = self._load_ivf()
+            self.data_version = self._data_version()
+        logger.info(f"📦 嵌入式向量库已加载: {self.alive_count()} 条向量 (第 {self.generation} 代, IVF={'有' if self.ivf else '无'})")
+
+    def _map(self):
+        if self.count:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float16, mode="r", shape=(self.count, self.dim))
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float16)
+
+    def _build_codes(self):
+        if self.quantization != "binary":
+            return None
+        codes = np.zeros((len(self.alive), (self.dim + 63) // 64), dtype=np.uint64)
+        for start in range(0, self.count, SCAN_BLOCK_ROWS):
+            codes[start:start + SCAN_BLOCK_ROWS] = binary_codes(self.vectors[start:start + SCAN_BLOCK_ROWS])
+        return codes
+
+    def _load_ivf(self):
+        if not os.path.exists(self.ivf_path):
+            return None
+        with np.load(self.ivf_path) as data:
+            ivf = IVFIndex(data["centroids"], data["offsets"], data["rows"], int(data["indexed_upto"]))
+        return ivf if ivf.indexed_upto <= self.count else None
+
+    def _remove_stale_files(self):
+        current = set(self._paths(self.generation))
+        for path in glob.glob(os.path.join(self.index_dir, "vectors.*.f16")) + glob.glob(os.path.join(self.index_dir, "ivf.*.npz")):
+            if path not in current:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _maybe_reload(self):
+        with self.lock:
+            if self._data_version() != self.data_version:
+                logger.info("🔄 向量库已被其他进程修改，重新加载")
+                self._load()
+
+    @contextmanager
+    def _write(self):
+        """跨进程写事务：先拿 SQLite 写锁再同步其他进程的修改，事务内记录号不会被别人改变"""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._maybe_reload()
+                yield
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+
+    # --- 内存状态 (调用方持有 self.lock) ---
+
+    def _revive(self, row):
+        node_id, file_name = self.row_keys[row]
+        self.alive[row] = True
+        self.node_rows[node_id] = row
+        self.file_rows.setdefault(file_name, set()).add(row)
+
+    def _kill(self, row):
+        node_id, file_name = self.row_keys[row]
+        self.alive[row] = False
+        if self.node_rows.get(node_id) == row:
+            del self.node_rows[node_id]
+        rows = self.file_rows.get(file_name)
+        if rows is not None:
+            rows.discard(row)
+            if not rows:
+                del self.file_rows[file_name]
+
+    def alive_count(self):
+        return int(np.count_nonzero(self.alive[:self.count]))
+
+    # --- 写入 ---
+
+    def add(self, node_ids, file_names, ref_doc_ids, payloads, embeddings):
+        """追加向量；node_id 已存在时旧记录标记删除 (与 Milvus 按主键覆盖一致)"""
+        if not node_ids:
+            return
+        vectors = normalize(embeddings).astype(np.float16)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度 {vectors.shape[1]} 与索引维度 {self.dim} 不一致")
+
+        with self.lock:
+            with self._write():
+                start = self.count
+                replaced = [self.node_rows[i] for i in node_ids if i in self.node_rows]
+                # 先截掉上次中途退出留下的残余再追加向量，最后提交元数据
+                self.conn.execute('DELETE FROM vectors WHERE row >= ?', (start,))
+                with open(self.vectors_path, "ab") as f:
+                    f.truncate(start * self.row_bytes)
+                    f.write(vectors.tobytes())
+                self.conn.executemany('UPDATE vectors SET deleted = 1 WHERE row = ?', [(r,) for r in replaced])
+                self.conn.executemany(
+                    'INSERT INTO vectors (row, node_id, file_name, ref_doc_id, node) VALUES (?, ?, ?, ?, ?)',
+                    [(start + i, *record) for i, record in enumerate(zip(node_ids, file_names, ref_doc_ids, payloads))]
+                )
+            # 内存状态在同一次持锁内更新，本进程的并发写入看到的 count 总是最新的
+            for row in replaced:
+                self._kill(row)
+            self.count = start + len(node_ids)
+            if self.count > len(self.alive):
+                grown = np.zeros(max(self.count, len(self.alive) * 2), dtype=bool)
+                grown[:len(self.alive)] = self.alive
+                self.alive = grown
+                if self.codes is not None:
+                    grown = np.zeros((len(self.alive), self.codes.shape[1]), dtype=np.uint64)
+                    grown[:start] = self.codes[:start]
+                    self.codes = grown
+            if self.codes is not None:
+                self.codes[start:self.count] = binary_codes(vectors)
+            self.row_keys.extend(zip(node_ids, file_names))
+            for row in range(start, self.count):
+                self._revive(row)
+            self._map()
+        self._maybe_rebuild()
+
+    def _delete(self, select_rows):
+        """select_rows 在写事务内 (已同步其他进程的修改) 计算要删除的记录号"""
+        with self.lock:
+            with self._write():
+                rows = select_rows()
+                self.conn.executemany('UPDATE vectors SET deleted = 1 WHERE row = ?', [(r,) for r in rows])
+            for row in rows:
+                self._kill(row)
+        self._maybe_compact()
+        return len(rows)
+
+    def delete_ids(self, node_ids):
+        return self._delete(lambda: [self.node_rows[i] for i in node_ids if i in self.node_rows])
+
+    def delete_file(self, file_name):
+        return self._delete(lambda: list(self.file_rows.get(file_name, ())))
+
+    def delete_ref_doc(self, ref_doc_id):
+        return self._delete(lambda: [r for (r,) in self.conn.execute(
+            'SELECT row FROM vectors WHERE ref_doc_id = ? AND deleted = 0 AND row < ?', (ref_doc_id, self.count)
+        )])
+
+    # --- 检索 ---
+
+    def search(self, embedding, top_k, file_names=None, node_ids=None):
+        """返回 [(node_id, 相似度)]，按相似度降序；file_names / node_ids 为 None 表示不过滤"""
+        self._maybe_reload()
+        with self.lock:
+            vectors, count, ivf, row_keys, codes = self.vectors, self.count, self.ivf, self.row_keys, self.codes
+            alive = self.alive[:count].copy()
+            candidates = None
+            if file_names is not None:
+                candidates = [r for name in file_names for r in self.file_rows.get(name, ())]
+            if node_ids is not None:
+                by_id = {self.node_rows[i] for i in node_ids if i in self.node_rows}
+                candidates = by_id if candidates is None else by_id.intersection(candidates)
+        if count == 0 or top_k <= 0:
+            return []
+        query = normalize(embedding)[0]
+
+        if candidates is None and codes is not None:
+            # 汉明距离粗排，候选再用 fp16 向量精确打分
+            distances = hamming_distances(codes[:count], binary_codes(query[None])[0])
+            alive_rows = np.flatnonzero(alive)
+            n = min(len(alive_rows), top_k * Config.LOCAL_BINARY_RESCORE)
+            if not n:
+                return []
+            candidates = alive_rows[np.argpartition(distances[alive_rows], n - 1)[:n]]
+        elif candidates is None and ivf is not None:
+            nprobe = min(Config.LOCAL_IVF_NPROBE, len(ivf.centroids))
+            candidates = np.concatenate([ivf.probe(query, nprobe), np.arange(ivf.indexed_upto, count)])
+        if candidates is not None:
+            rows = np.unique(np.fromiter(candidates, dtype=np.int64, count=len(candidates)))
+            rows = rows[alive[rows]]
+            if not len(rows):
+                return []
+            scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+            return [(row_keys[r][0], s) for r, s in self._top(rows, scores, top_k)]
+
+        # 向量较少 (未建 IVF) 时分块全量扫描
+        best_rows, best_scores = [], []
+        for start in range(0, count, SCAN_BLOCK_ROWS):
+            end = min(start + SCAN_BLOCK_ROWS, count)
+            scores = np.asarray(vectors[start:end], dtype=np.float32) @ query
+            scores[~alive[start:end]] = -np.inf
+            k = min(top_k, end - start)
+            top = np.argpartition(-scores, k - 1)[:k]
+            best_rows.append(top + start)
+            best_scores.append(scores[top])
+        hits = self._top(np.concatenate(best_rows), np.concatenate(best_scores), top_k)
+        return [(row_keys[r][0], s) for r, s in hits]
+
+    @staticmethod
+    def _top(rows, scores, top_k):
+        k = min(top_k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def fetch(self, node_ids):
+        """按 node_id 取序列化的节点 {node_id: node}；检索与读取之间被删除的节点不返回"""
+        if not node_ids:
+            return {}
+        placeholders = ",".join("?" * len(node_ids))
+        with self.lock:
+            return dict(self.conn.execute(
+                f'SELECT node_id, node FROM vectors WHERE node_id IN ({placeholders}) AND deleted = 0', list(node_ids)
+            ).fetchall())
+
+    def scan(self, after_id, limit):
+        """按 node_id 顺序 (键集分页) 遍历未删除的节点，返回 node_id 大于 after_id 的 [(node_id, file_name, 序列化节点)]"""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT node_id, file_name, node FROM vectors WHERE deleted = 0 AND node_id > ? ORDER BY node_id LIMIT ?',
+                (after_id, limit)
+            ).fetchall()
+
+    # --- 索引维护 ---
+
+    def _maybe_rebuild(self):
+        if self.quantization == "binary":
+            return
+        with self.lock:
+            alive = self.alive_count()
+            indexed = self.ivf.indexed_upto if self.ivf else 0
+            tail = self.count - indexed
+        if alive < Config.LOCAL_IVF_MIN_ROWS:
+            return
+        if self.ivf is not None and tail <= Config.LOCAL_IVF_REBUILD_RATIO * indexed:
+            return
+        # 已有重建在进行时跳过，新增部分留在尾段
+        if self.rebuild_lock.acquire(blocking=False):
+            try:
+                self.rebuild_index()
+            finally:
+                self.rebuild_lock.release()
+
+    def rebuild_index(self):
+        """训练 IVF 聚类中心并分配倒排表；耗时部分不持锁，期间的写入留在尾段"""
+        with self.lock:
+            vectors, count, generation = self.vectors, self.count, self.generation
+            alive_rows = np.flatnonzero(self.alive[:count])
+        if not len(alive_rows):
+            return
+
+        nlist = Config.LOCAL_IVF_NLIST or int(4 * math.sqrt(len(alive_rows)))
+        # 每个中心至少约 40 个训练样本，聚类才稳定
+        nlist = max(1, min(nlist, len(alive_rows) // 40 or 1))
+        rng = np.random.default_rng(0)
+        sample_size = min(len(alive_rows), max(nlist * 40, 20000))
+        sample = np.sort(rng.choice(alive_rows, sample_size, replace=False))
+        centroids = spherical_kmeans(np.asarray(vectors[sample], dtype=np.float32), nlist)
+
+        labels = assign_clusters(vectors, alive_rows, centroids)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.searchsorted(labels[order], np.arange(nlist + 1)).astype(np.int64)
+        ivf = IVFIndex(centroids, offsets, alive_rows[order].astype(np.int64), count)
+
+        ivf_path = self._paths(generation)[1]
+        tmp = f"{ivf_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, centroids=ivf.centroids, offsets=ivf.offsets, rows=ivf.rows, indexed_upto=np.int64(count))
+        with self._write():
+            if self.generation != generation:
+                # 期间发生了压缩，记录号已变化，本次结果作废
+                os.remove(tmp)
+                return
+            os.replace(tmp, ivf_path)
+            # 写一条元数据，让其他进程感知到新索引
+            self._set_meta("ivf_rows", count)
+        with self.lock:
+            self.ivf = ivf
+        logger.info(f"🧭 IVF 索引已重建: {len(alive_rows)} 条向量, {nlist} 个簇")
+
+    def _maybe_compact(self):
+        with self.lock:
+            dead = self.count - self.alive_count()
+            needed = dead >= MIN_COMPACT_ROWS and dead > Config.LOCAL_COMPACT_RATIO * self.count
+        if needed:
+            self.compact()
+
+    def compact(self):
+        """只保留未删除的向量，写入下一代文件并重新编号；提交前崩溃时旧一代数据不受影响"""
+        with self.lock:
+            with self._write():
+                alive_rows = np.flatnonzero(self.alive[:self.count])
+                removed = self.count - len(alive_rows)
+                vectors_path = self._paths(self.generation + 1)[0]
+                with open(vectors_path, "wb") as f:
+                    for start in range(0, len(alive_rows), SCAN_BLOCK_ROWS):
+                        f.write(np.asarray(self.vectors[alive_rows[start:start + SCAN_BLOCK_ROWS]]).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.conn.execute('DELETE FROM vectors WHERE deleted = 1 OR row >= ?', (self.count,))
+                # 新编号不大于旧编号，按旧编号升序更新不会冲突
+                self.conn.executemany(
+                    'UPDATE vectors SET row = ? WHERE row = ?',
+                    [(new, int(old)) for new, old in enumerate(alive_rows) if new != old]
+                )
+                self._set_meta("generation", self.generation + 1)
+            self._load()
+            # 其他进程在下次访问时按 data_version 重新加载；已映射的旧文件删除后仍可读
+            self._remove_stale_files()
+        logger.info(f"🗜️ 向量库已压缩: 清除 {removed} 条已删除向量")
+        self._maybe_rebuild()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "backend": "local",
+                "quantization": self.quantization,
+                "vectors": self.alive_count(),
+                "deleted": self.count - self.alive_count(),
+                "files": len(self.file_rows),
+                "generation": self.generation,
+                "ivf_lists": len(self.ivf.centroids) if self.ivf else 0,
+                "ivf_tail": self.count - (self.ivf.indexed_upto if self.ivf else 0),
+                "disk_mb": round(self.count * self.row_bytes / (1024 * 1024), 1),
+                "codes_mb": round(self.codes[:self.count].nbytes / (1024 * 1024), 1) if self.codes is not None else 0.0,
+            }
+
+def _file_name_filter(filters):
+    """把 LlamaIndex 的 MetadataFilters 转成 file_name 集合；只支持 file_name 的 == / in"""
+    if filters is None or not filters.filters:
+        return None
+    sets = []
+    for f in filters.filters:
+        if getattr(f, "key", None) != "file_name" or f.operator not in (FilterOperator.EQ, FilterOperator.IN):
+            raise ValueError(f"嵌入式向量库只支持按 file_name 过滤 (==/in): {f}")
+        sets.append({f.value} if f.operator == FilterOperator.EQ else set(f.value))
+    if filters.condition == FilterCondition.OR:
+        return set().union(*sets)
+    return set.intersection(*sets)
+
+class LocalVectorStore(BasePydanticVectorStore):
+    """LlamaIndex 向量库接口 (add / delete / query)，VectorStoreIndex 可直接使用"""
+
+    stores_text: bool = True
+    flat_metadata: bool = False
+    _index: LocalVectorIndex = PrivateAttr()
+
+    def __init__(self, index, **kwargs):
+        super().__init__(**kwargs)
+        self._index = index
+
+    @classmethod
+    def class_name(cls):
+        return "LocalVectorStore"
+
+    @property
+    def client(self):
+        return self._index
+
+    def add(self, nodes, **add_kwargs):
+        if not nodes:
+            return []
+        self._index.add(
+            [n.node_id for n in nodes],
+            [n.metadata.get("file_name", "") for n in nodes],
+            [n.ref_doc_id for n in nodes],
+            [json.dumps(node_to_metadata_dict(n, remove_text=False, flat_metadata=self.flat_metadata)) for n in nodes],
+            [n.get_embedding() for n in nodes],
+        )
+        return [n.node_id for n in nodes]
+
+    def delete(self, ref_doc_id, **delete_kwargs):
+        self._index.delete_ref_doc(ref_doc_id)
+
+    def query(self, query, **kwargs):
+        if query.query_embedding is None:
+            raise ValueError("嵌入式向量库检索需要 query_embedding")
+        hits = self._index.search(
+            query.query_embedding, query.similarity_top_k,
+            file_names=_file_name_filter(query.filters), node_ids=query.node_ids or None,
+        )
+        payloads = self._index.fetch([node_id for node_id, _ in hits])
+        hits = [(node_id, score) for node_id, score in hits if node_id in payloads]
+        nodes = [metadata_dict_to_node(json.loads(payloads[node_id])) for node_id, _ in hits]
+        return VectorStoreQueryResult(
+            nodes=nodes, similarities=[score for _, score in hits], ids=[node_id for node_id, _ in hits]
+        )
+
+class LocalVectorClient:
+    """MilvusClient 的最小兼容子集 (has_collection / delete / query)，删除文件与补建稀疏索引时与 Milvus 走同一套代码"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def has_collection(self, collection_name, **kwargs):
+        return True
+
+    def delete(self, collection_name, ids=None, filter=None, **kwargs):
+        if ids is not None:
+            return self.index.delete_ids(ids)
+        match = _FILE_FILTER_RE.match(filter or "")
+        if not match:
+            raise ValueError(f"嵌入式向量库只支持按 file_name 删除: {filter}")
+        return self.index.delete_file(match.group(1))
+
+    def query(self, collection_name, filter="", output_fields=None, limit=1000, **kwargs):
+        """只支持按主键的键集分页: filter 为空或 'id > "<上一页最后一个 id>"'，结果按 id 升序"""
+        match = _ID_AFTER_RE.match(filter or "")
+        if match:
+            after_id = match.group(1)
+        elif not filter:
+            after_id = ""
+        else:
+            raise ValueError(f"嵌入式向量库只支持按 id 分页遍历: {filter}")
+        return [
+            {"id": node_id, "file_name": file_name, "text": metadata_dict_to_node(json.loads(node)).get_content()}
+            for node_id, file_name, node in self.index.scan(after_id, limit)
+        ]
+
+_local_index = None
+_local_index_lock = threading.Lock()
+def get_local_vector_index():
+    global _local_index
+    if _local_index is None:
+        with _local_index_lock:
+            if _local_index is None:
+                # 每个集合一个目录，与 Milvus 的集合语义一致 (改 COLLECTION_NAME 即换新库)
+                _local_index = LocalVectorIndex(os.path.join(Config.LOCAL_VECTOR_DIR, Config.COLLECTION_NAME))
+    return _local_index
+
+def get_local_vector_store():
+    return LocalVectorStore(get_local_vector_index())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="嵌入式向量库维护")
+    parser.add_argument("--stats", action="store_true", help="打印向量数、已删除数、IVF 状态")
+    parser.add_argument("--rebuild", action="store_true", help="重建 IVF 索引")
+    parser.add_argument("--compact", action="store_true", help="清除已删除的向量")
+    args = parser.parse_args()
+    index = get_local_vector_index()
+    if args.compact:
+        index.compact()
+    if args.rebuild:
+        index.rebuild_index()
+    print(json.dumps(index.stats(), ensure_ascii=False, indent=2))
@@ -0,0 +1,185 @@
+"""
+轻量指标与追踪：各阶段耗时直方图，以 Prometheus 文本格式暴露在 /metrics (不依赖 prometheus_client)。
+
+用法：
+    with CHAT_STAGE_SECONDS.time(stage="dense_search"):
+        ...
+    CHAT_STAGE_SECONDS.observe(elapsed, stage="ttft")
+trace_id 通过 contextvars 在一次请求内传递 (由 server.py 的中间件设置，并在响应头 X-Trace-Id 返回)。
+"""
+import time
+import uuid
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from config import Config
+
+# 秒：覆盖 embedding (ms 级) 到 LLM 生成 / 视频分析 (分钟级)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_registry = []
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.series = {}  # labels -> [bucket counts..., sum, count]
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = [(key, list(series)) for key, series in self.series.items()]
+        for key, series in sorted(items):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+class Gauge:
+    """取值时回调：fn() 返回数值，或 {标签值元组: 数值}"""
+
+    def __init__(self, name, documentation, fn, labelnames=(), kind="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.fn()
+        except Exception:
+            return lines
+        values = value if isinstance(value, dict) else {(): value}
+        for key, v in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {v}")
+        return lines
+
+def render_metrics():
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- 各阶段耗时 ---
+
+CHAT_STAGE_SECONDS = Histogram(
+    "rag_chat_stage_seconds",
+    "问答各阶段耗时 (embedding / dense_search / sparse_search / rerank / retrieval / prompt_build / queue_wait / ttft / generation / total)",
+    ["stage"],
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "rag_llm_tokens_per_second",
+    "LLM 生成速度 (首 token 之后的流式 chunk 数 / 秒)",
+    buckets=(1, 2, 4, 6, 8, 10, 15, 20, 30, 50, 100),
+)
+INGEST_STAGE_SECONDS = Histogram(
+    "rag_ingest_stage_seconds",
+    "文档入库各阶段耗时 (hash / parse / ocr / chunking / embedding / milvus_insert / milvus_delete / sparse_commit / total)",
+    ["stage"],
+)
+VIDEO_STAGE_SECONDS = Histogram(
+    "rag_video_stage_seconds",
+    "视频分析各阶段耗时 (model_load / vision_batch / visual_analysis / audio_extract / transcription / total)",
+    ["stage"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "rag_http_request_seconds",
+    "HTTP 请求耗时 (流式响应计到最后一个 chunk 发出)",
+    ["method", "route", "status"],
+)
+
+# --- 追踪 ---
+
+trace_id_var = contextvars.ContextVar("trace_id", default="")
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+def current_trace_id():
+    return trace_id_var.get()
+
+class TraceMiddleware:
+    """
+    纯 ASGI 中间件 (不缓冲流式响应)：为每个请求设置 trace_id (沿用请求头 X-Trace-Id，否则生成)，
+    在响应头返回，并按路由模板记录请求耗时。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = ""
+        if Config.TRACE_IDS:
+            incoming = dict(scope.get("headers") or []).get(b"x-trace-id", b"").decode("latin-1")
+            trace_id = incoming[:64] or new_trace_id()
+        token = trace_id_var.set(trace_id)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if trace_id:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"x-trace-id", trace_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # 只用路由模板作标签，避免 session_id 等路径参数撑爆序列数
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope.get("method", ""),
+                route=getattr(route, "path", "unmatched"),
+                status=status["code"],
+            )
+            trace_id_var.reset(token)
@@ -0,0 +1,97 @@
+"""
+Milvus 向量库：按 Config.VECTOR_INDEX_PROFILE 建索引 (index_profiles.py)，
+量化 profile (IVF_SQ8 / IVF_PQ) 检索时多取 rescore 倍候选，再按 id 取回原始向量精确重排。
+
+服务经 Config.COLLECTION_ALIAS 读写，别名指向的物理集合由 reindex.py 切换，切换后检索与写入立即落到新集合。
+"""
+import json
+import logging
+import dataclasses
+import numpy as np
+from pymilvus import Collection, MilvusClient
+from llama_index.core.vector_stores.types import VectorStoreQueryResult
+from llama_index.vector_stores.milvus import MilvusVectorStore
+from llama_index.vector_stores.milvus.base import MILVUS_ID_FIELD
+from config import Config
+from index_profiles import METRIC_TYPE, get_index_profile, search_params, ensure_milvus_index
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_FIELD = "embedding"
+
+class ProfiledMilvusVectorStore(MilvusVectorStore):
+    rescore: int = 1
+
+    def __init__(self, rescore=1, **kwargs):
+        super().__init__(**kwargs)
+        self.rescore = rescore
+
+    @classmethod
+    def class_name(cls):
+        return "ProfiledMilvusVectorStore"
+
+    def query(self, query, **kwargs):
+        if self.rescore <= 1 or query.query_embedding is None:
+            return super().query(query, **kwargs)
+
+        top_k = query.similarity_top_k
+        wide = super().query(dataclasses.replace(query, similarity_top_k=top_k * self.rescore), **kwargs)
+        if not wide.ids:
+            return wide
+        rows = self.client.query(
+            collection_name=self.collection_name,
+            filter=f"{MILVUS_ID_FIELD} in [{','.join(json.dumps(i) for i in wide.ids)}]",
+            output_fields=[MILVUS_ID_FIELD, self.embedding_field],
+        )
+        vectors = {row[MILVUS_ID_FIELD]: row[self.embedding_field] for row in rows}
+        q = np.asarray(query.query_embedding, dtype=np.float32)
+        # 取不到原始向量的候选 (刚被删除) 保留量化后的分数
+        scored = sorted(
+            (
+                (float(np.dot(np.asarray(vectors[i], dtype=np.float32), q)) if i in vectors else score, node, i)
+                for node, score, i in zip(wide.nodes, wide.similarities, wide.ids)
+            ),
+            key=lambda item: -item[0],
+        )[:top_k]
+        return VectorStoreQueryResult(
+            nodes=[node for _, node, _ in scored],
+            similarities=[score for score, _, _ in scored],
+            ids=[i for _, _, i in scored],
+        )
+
+def resolve_collection(client, alias=None):
+    """返回别名当前指向的物理集合名；别名尚未创建 (首次部署) 时返回 Config.COLLECTION_NAME"""
+    alias = alias or Config.COLLECTION_ALIAS
+    # DescribeCollection 会解析别名，返回的是物理集合的 schema
+    if client.has_collection(alias):
+        return client.describe_collection(alias)["collection_name"]
+    return Config.COLLECTION_NAME
+
+def build_milvus_vector_store(profile=None, collection_name=None):
+    """collection_name 为空时读写 Config.COLLECTION_ALIAS (不存在则建好 COLLECTION_NAME 并创建别名)；
+    reindex.py 传入新集合名，直接写物理集合"""
+    profile = profile or get_index_profile()
+    # 检索最多取的候选数 (稠密 Top-K / 混合候选 / 重排候选) × rescore，HNSW 的 ef 不能小于它
+    limit = max(Config.SIMILARITY_TOP_K, Config.HYBRID_CANDIDATES, Config.RERANK_CANDIDATES) * profile["rescore"]
+    physical = collection_name or resolve_collection(MilvusClient(uri=Config.MILVUS_URI))
+    store = ProfiledMilvusVectorStore(
+        uri=Config.MILVUS_URI,
+        collection_name=physical,
+        dim=Config.EMBEDDING_DIM,
+        embedding_field=EMBEDDING_FIELD,
+        similarity_metric=METRIC_TYPE,
+        overwrite=False,
+        search_config=search_params(profile, limit),
+        rescore=profile["rescore"],
+    )
+    # llama-index 只在 overwrite=True 时应用 index_config，新建的集合是 AUTOINDEX，这里按 profile 建索引
+    ensure_milvus_index(Collection(physical, using=store.client._using), EMBEDDING_FIELD, profile)
+    if collection_name is None:
+        alias = Config.COLLECTION_ALIAS
+        if not store.client.has_collection(alias):
+            store.client.create_alias(physical, alias)
+            logger.info(f"🔗 创建别名 {alias} -> {physical}")
+        # 检索 / 删除按名字调用，插入走 _collection，都换成别名，reindex 切换后无需重启
+        store.collection_name = alias
+        store._collection = Collection(alias, using=store.client._using)
+    return store
@@ -0,0 +1,248 @@
+"""
+PDF 按页并行解析：解析进程池按页段抽取文本层，没有文本层 (扫描件) 或文本层是乱码的页栅格化后交给有界 OCR 进程池识别。
+页面按页码顺序流式产出，调用方边解析边切片、向量化 (iter_page_windows)，大 PDF 不必等整份解析完。
+
+依赖按需导入：pypdf 抽取文本层；栅格化优先 pypdfium2，其次 PyMuPDF (fitz)；OCR 用 RapidOCR。
+缺少栅格化或 OCR 依赖时扫描页保留文本层原文 (通常为空) 并告警。
+"""
+import os
+import re
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 可读字符：中文、字母数字与常见标点；文本层有效字符太少或可读占比太低的页走 OCR
+_READABLE_RE = re.compile(r"[\u4e00-\u9fff0-9A-Za-z，。、；：？！“”‘’（）《》【】,.;:?!()\-]")
+_READABLE_MIN_RATIO = 0.6
+
+_worker_ocr = None
+_worker_ocr_threads = 1
+_warned_missing = False
+
+def needs_ocr(text):
+    compact = re.sub(r"\s+", "", text or "")
+    if len(compact) < Config.PDF_OCR_MIN_CHARS:
+        return True
+    return len(_READABLE_RE.findall(compact)) / len(compact) < _READABLE_MIN_RATIO
+
+def count_pages(filepath):
+    from pypdf import PdfReader
+    return len(PdfReader(filepath).pages)
+
+def _extract_pages(filepath, start, end):
+    """解析进程：抽取 [start, end) 页的文本层，返回 [(页序号, 页码标签, 文本)]"""
+    from pypdf import PdfReader
+    reader = PdfReader(filepath)
+    pages = []
+    for index in range(start, end):
+        try:
+            text = reader.pages[index].extract_text() or ""
+        except Exception as e:
+            logger.warning(f"⚠️ 第 {index + 1} 页文本层抽取失败，改用 OCR: {e}")
+            text = ""
+        try:
+            label = reader.page_labels[index]
+        except Exception:
+            label = str(index + 1)
+        pages.append((index, label, text))
+    return pages
+
+def _render_page(filepath, index, dpi):
+    """栅格化单页，返回 BGR ndarray (与 cv2 读图一致)"""
+    try:
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(filepath)
+        try:
+            bitmap = pdf[index].render(scale=dpi / 72)
+            return bitmap.to_numpy()[:, :, :3].copy()
+        finally:
+            pdf.close()
+    except ImportError:
+        pass
+    import fitz
+    import numpy as np
+    with fitz.open(filepath) as doc:
+        pix = doc[index].get_pixmap(dpi=dpi)
+        image = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+        return image[:, :, 2::-1].copy()
+
+def _init_ocr_worker(threads):
+    global _worker_ocr_threads
+    _worker_ocr_threads = threads
+
+def _ocr_page(filepath, index):
+    """OCR 进程：栅格化并识别单页；缺少依赖或识别失败返回 None"""
+    global _worker_ocr, _warned_missing
+    try:
+        image = _render_page(filepath, index, Config.PDF_OCR_DPI)
+        if _worker_ocr is None:
+            from rapidocr_onnxruntime import RapidOCR
+            _worker_ocr = RapidOCR(num_threads=_worker_ocr_threads)
+        result, _ = _worker_ocr(image)
+    except ImportError as e:
+        if not _warned_missing:
+            _warned_missing = True
+            logger.warning(f"⚠️ 缺少 PDF 栅格化/OCR 依赖 (pypdfium2 或 PyMuPDF、rapidocr_onnxruntime)，跳过扫描页: {e}")
+        return None
+    except Exception as e:
+        logger.warning(f"⚠️ 第 {index + 1} 页 OCR 失败: {e}")
+        return None
+    return "\n".join(line[1] for line in (result or []) if line and len(line) >= 2)
+
+# 进程池在服务内共享：多个文件同时入库时解析与 OCR 的总进程数仍有上限
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _get_pool(kind):
+    with _pools_lock:
+        pool = _pools.get(kind)
+        if pool is None:
+            # 服务进程已加载 torch 等多线程库，fork 子进程可能死锁，统一用 spawn。
+            # spawn 子进程只需导入本模块与 config；以 python server.py 启动时主模块会被重新导入一遍，
+            # 因此 server 依赖的模块在导入时不加载模型、不启动线程 (见 embedding_provider / video_service / session_manager)
+            context = multiprocessing.get_context("spawn")
+            if kind == "ocr":
+                threads = max(1, Config.OCR_THREADS // Config.PDF_OCR_WORKERS)
+                pool = ProcessPoolExecutor(max_workers=Config.PDF_OCR_WORKERS, mp_context=context,
+                                           initializer=_init_ocr_worker, initargs=(threads,))
+            else:
+                pool = ProcessPoolExecutor(max_workers=Config.PDF_PARSE_WORKERS, mp_context=context)
+            _pools[kind] = pool
+        return pool
+
+def _reset_pool(kind):
+    with _pools_lock:
+        pool = _pools.pop(kind, None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def _run_inline(fn, *args):
+    future = Future()
+    future.set_result(fn(*args))
+    return future
+
+def _submitter(kind, parallel):
+    if not parallel:
+        return _run_inline
+    return lambda fn, *args: _get_pool(kind).submit(fn, *args)
+
+def _ordered(futures, window):
+    """futures 为提交任务的生成器：最多 window 个在途，按提交顺序取结果"""
+    pending = deque()
+    for future in futures:
+        pending.append(future)
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def iter_pdf_pages(filepath, parallel=True):
+    """按页码顺序逐页产出 Document (跳过空白页)，metadata 与 PDFReader 一致 (page_label, file_name)。
+    parallel=False 时在当前进程内串行解析与 OCR (bulk_ingest 等已按文件多进程并行的场景)"""
+    from llama_index.core import Document
+
+    filename = os.path.basename(filepath)
+    total = count_pages(filepath)
+    submit_parse = _submitter("parse", parallel)
+    submit_ocr = _submitter("ocr", parallel)
+    parse_window = max(1, Config.PDF_PARSE_WORKERS) * 2 if parallel else 1
+    ocr_window = max(1, Config.PDF_OCR_WORKERS) * 2 if parallel else 1
+
+    def parse_tasks():
+        for start in range(0, total, Config.PDF_PAGE_BATCH):
+            yield submit_parse(_extract_pages, filepath, start, min(start + Config.PDF_PAGE_BATCH, total))
+
+    ocr_pages = []
+
+    def page_tasks():
+        for batch in _ordered(parse_tasks(), parse_window):
+            for index, label, text in batch:
+                future = None
+                if needs_ocr(text):
+                    ocr_pages.append(index)
+                    future = submit_ocr(_ocr_page, filepath, index)
+                yield (index, label, text), future
+
+    try:
+        # 文本层页与 OCR 页在同一个有序窗口里排队：队首的 OCR 页未完成时最多再排 ocr_window 页
+        pending = deque()
+        for task in page_tasks():
+            pending.append(task)
+            while pending and (len(pending) >= ocr_window or pending[0][1] is None or pending[0][1].done()):
+                yield from _to_document(*pending.popleft(), filename, Document)
+        while pending:
+            yield from _to_document(*pending.popleft(), filename, Document)
+    except BrokenProcessPool:
+        # 子进程崩溃 (如 OOM) 后池不可再用，下次调用重建
+        _reset_pool("parse")
+        _reset_pool("ocr")
+        raise
+    if ocr_pages:
+        logger.info(f"   👁️ {filename}: {len(ocr_pages)}/{total} 页无文本层，已 OCR 识别")
+
+def _to_document(page, future, filename, document_cls):
+    _, label, text = page
+    result = future.result() if future is not None else None
+    # OCR 不可用时保留文本层原文
+    text = result if result is not None else text
+    if text and text.strip():
+        yield document_cls(text=text, metadata={"page_label": label, "file_name": filename})
+
+def _split_page(page, offset):
+    """在 offset 处把一页拆成前后两个 Document (元数据相同)"""
+    from llama_index.core import Document
+    text = page.get_content()
+    return (Document(text=text[:offset], metadata=dict(page.metadata)),
+            Document(text=text[offset:], metadata=dict(page.metadata)))
+
+def _window_cut(buffer, block_offsets):
+    """最靠后的可断开位置 (页序号, 页内偏移)：优先在条款起始处，断开后前一窗口不能为空"""
+    if block_offsets is None:
+        return len(buffer), 0
+    for i in range(len(buffer) - 1, -1, -1):
+        offsets = [o for o in block_offsets(buffer[i].get_content()) if i > 0 or o > 0]
+        if offsets:
+            return i, max(offsets)
+    return None
+
+def iter_page_windows(pages, splitter=None, window=None):
+    """把流式页面攒成窗口交给切片：攒够 window 页后在最后一个 splitter.block_offsets 位置断开 (法规在条款起始处断开，
+    条款不跨窗口；必要时把该页拆成两段)，找不到时攒到 2 * window 页强制断开；没有该方法的切片器按页断开。
+    splitter.carry_over 返回的标题行补到下一窗口开头，保持法规名与章节上下文"""
+    window = window or Config.PDF_STREAM_PAGES
+    block_offsets = getattr(splitter, "block_offsets", None)
+    carry_over = getattr(splitter, "carry_over", None)
+    buffer, header = [], ""
+    for page in pages:
+        if header:
+            page.text = f"{header}\n{page.text}"
+            header = ""
+        buffer.append(page)
+        if len(buffer) < window:
+            continue
+        cut = _window_cut(buffer, block_offsets)
+        if cut is None:
+            if len(buffer) < 2 * window:
+                continue
+            cut = (len(buffer), 0)
+        index, offset = cut
+        if offset:
+            before, after = _split_page(buffer[index], offset)
+            head, buffer = buffer[:index] + [before], [after] + buffer[index + 1:]
+        else:
+            head, buffer = buffer[:index], buffer[index:]
+        header = carry_over(head) if carry_over else ""
+        if header and buffer:
+            buffer[0].text = f"{header}\n{buffer[0].text}"
+            header = ""
+        yield head
+    if buffer:
+        yield buffer
@@ -1,4 +1,14 @@
+import logging
 from llama_index.core.llms import ChatMessage, MessageRole
+from config import Config
+from token_budget import get_token_counter, allocate
+
+logger = logging.getLogger(__name__)
+
+# 每条消息的模板开销 (role 标记等)
+MESSAGE_OVERHEAD_TOKENS = 8
+# 单个资料片段剩余预算低于此值时不再截断放入
+MIN_CHUNK_TOKENS = 64
 
 # 基础 RAG 提示词模板 (保持不变)
 DEFAULT_RAG_TEMPLATE = (
@@ -12,33 +22,162 @@ DEFAULT_RAG_TEMPLATE = (
     "2. 诚实原则：如果是知识库中没有的信息，明确告知未找到，不要编造。\n"
 )
 
-# 动态构建系统提示词逻辑
-def build_system_prompt(video_context: str = "", rag_context: str = "") -> str:
+# 静态系统提示词：所有请求逐字节一致，作为 Ollama KV cache 可复用的公共前缀。
+# ⚠️ 不要在这里拼接任何按请求/会话变化的内容，动态内容统一放在它之后的消息中。
+SYSTEM_PROMPT = (
+    "你是一个专业的企业智能助手。\n"
+    "【核心指令】\n"
+    "1. 你的任务是回答用户问题。信息来源有两个：【视频分析报告】和【知识库参考资料】。\n"
+    "2. 优先级判断：\n"
+    "   - 询问画面内容/发生什么：只看【视频分析报告】，忽略无关资料。\n"
+    "   - 询问政策/具体定义：优先看【知识库参考资料】。\n"
+    "3. 严禁提及模型自身的内部版本信息。\n"
+    "4. 🚀【视频回答规范】(至关重要)：\n"
+    "   - 视频分析报告中包含大量时间戳(如[0s], [5s])，这是给机器看的。\n"
+    "   - **给用户回答时，请自动过滤掉所有时间戳**，除非用户明确询问“第几秒发生了什么”。\n"
+    "   - **请进行总结性描述**：将不同时间段的画面整合成一段通顺、连贯的文字。\n"
+    "   - 错误示范：“0秒时有狗，2秒时狗在跑”\n"
+    "   - 正确示范：“视频展示了三只拉布拉多犬在草地上欢快奔跑的场景，背景是蓝天白云，氛围非常轻松。”\n"
+)
+
+NO_RAG_NOTICE = "（当前无相关知识库参考资料，请仅基于已有知识或视频回答）"
+
+def build_video_context(video_context: str) -> str:
+    """会话级视频报告：同一会话内不变，紧跟系统提示词之后，可随前缀一起复用"""
+    return f"=== 🎥 视频/图片分析报告 (高优先级) ===\n{video_context}"
+
+def build_user_prompt(query: str, rag_context: str = "") -> str:
+    """本轮检索到的资料随当前问题放在最后一条消息，不破坏前面的公共前缀"""
+    if rag_context:
+        return f"=== 📚 知识库参考资料 ===\n{rag_context}\n\n用户问题: {query}"
+    return f"{NO_RAG_NOTICE}\n\n用户问题: {query}"
+
+def build_conversation_summary(summary: str) -> str:
+    """滚动摘要：概括已滑出历史窗口的早期对话，放在视频报告之后、最近几轮对话之前"""
+    return f"=== 🗂️ 早期对话摘要 ===\n{summary}"
+
+# 滚动摘要的更新提示词 (conversation_summary.py)
+SUMMARY_SYSTEM_PROMPT = (
+    "你是对话记录员。请将【已有摘要】与【新增对话】合并为一份新的摘要。\n"
+    "要求：保留用户关心的问题、涉及的法规/文件名称、关键结论和未解决事项；去掉寒暄与重复内容；"
+    "使用第三人称陈述，不要编造对话中没有的信息；只输出摘要正文，不超过 {max_chars} 字。"
+)
+
+def build_summary_messages(summary: str, messages, max_chars: int):
+    lines = [f"{'用户' if m['role'] == 'user' else '助手'}: {m['content']}" for m in messages]
+    content = f"【已有摘要】\n{summary or '（无）'}\n\n【新增对话】\n" + "\n".join(lines)
+    return [
+        ChatMessage(role=MessageRole.SYSTEM, content=SUMMARY_SYSTEM_PROMPT.format(max_chars=max_chars)),
+        ChatMessage(role=MessageRole.USER, content=content),
+    ]
+
+def format_rag_chunks(chunks) -> str:
+    return "\n\n".join(f"---资料 {i+1} (仅供参考)---\n{c}" for i, c in enumerate(chunks))
+
+def _fit_chunks(counter, chunks, budget):
+    # 按相关性顺序整段放入，最后一段放不下时截断
+    kept = []
+    for chunk in chunks:
+        cost = counter.count(chunk) + MESSAGE_OVERHEAD_TOKENS
+        if cost <= budget:
+            kept.append(chunk)
+            budget -= cost
+        else:
+            if budget - MESSAGE_OVERHEAD_TOKENS >= MIN_CHUNK_TOKENS:
+                kept.append(counter.truncate(chunk, budget - MESSAGE_OVERHEAD_TOKENS))
+            break
+    return kept
+
+def _fit_history(counter, history, budget):
+    # 从最近一条往前放，放不下的那条保留结尾部分；更早的消息直接丢弃
+    # (滑出 HISTORY_MESSAGES 窗口的消息由 conversation_summary 在后台合并进摘要，这里不再同步调用 LLM 摘要)
+    kept = []
+    for msg in reversed(history):
+        cost = counter.count(msg["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if cost <= budget:
+            kept.append(msg)
+            budget -= cost
+        else:
+            if budget - MESSAGE_OVERHEAD_TOKENS >= MIN_CHUNK_TOKENS:
+                content = counter.fit(msg["content"], budget - MESSAGE_OVERHEAD_TOKENS, from_end=True)
+                kept.append({"role": msg["role"], "content": "……" + content})
+            break
+    return list(reversed(kept))
+
+def build_chat_messages(query: str, history=None, video_context: str = "", rag_chunks=None, empty_rag_notice: str = "", summary: str = ""):
     """
-    动态构建系统提示词，根据上下文内容自动调整策略。
+    按 "静态系统提示词 → 会话视频报告 → 早期对话摘要 → 历史对话 → 本轮资料 + 问题" 的顺序组装消息，
+    越稳定的内容越靠前，多轮对话时 Ollama 可复用前缀的 KV cache。
+
+    Token 预算：CONTEXT_WINDOW 先扣除输出预留、系统提示词和当前问题，
+    剩余部分按权重在 视频报告 / 知识库片段 / 历史对话 之间分配，未用完的份额让给其他部分；
+    摘要计入历史对话的份额，最多占其一半。
+    tokenizer 计数与二分截断是 CPU 密集的，调用方应在线程池中执行，不要直接在事件循环里调用。
+    返回 (messages, breakdown)。
     """
-    base_prompt = (
-        "你是一个专业的企业智能助手。\n"
-        "【核心指令】\n"
-        "1. 你的任务是回答用户问题。信息来源有两个：【视频分析报告】和【知识库参考资料】。\n"
-        "2. 优先级判断：\n"
-        "   - 询问画面内容/发生什么：只看【视频分析报告】，忽略无关资料。\n"
-        "   - 询问政策/具体定义：优先看【知识库参考资料】。\n"
-        "3. 严禁提及模型自身的内部版本信息。\n"
-        "4. 🚀【视频回答规范】(至关重要)：\n"
-        "   - 视频分析报告中包含大量时间戳(如[0s], [5s])，这是给机器看的。\n"
-        "   - **给用户回答时，请自动过滤掉所有时间戳**，除非用户明确询问“第几秒发生了什么”。\n"
-        "   - **请进行总结性描述**：将不同时间段的画面整合成一段通顺、连贯的文字。\n"
-        "   - 错误示范：“0秒时有狗，2秒时狗在跑”\n"
-        "   - 正确示范：“视频展示了三只拉布拉多犬在草地上欢快奔跑的场景，背景是蓝天白云，氛围非常轻松。”\n"
+    counter = get_token_counter()
+    history = history or []
+    rag_chunks = rag_chunks or []
+
+    query_tokens = counter.count(query)
+    if query_tokens > Config.CONTEXT_WINDOW // 2:
+        query = counter.truncate(query, Config.CONTEXT_WINDOW // 2)
+        query_tokens = counter.count(query)
+
+    system_tokens = counter.count(SYSTEM_PROMPT)
+    available = (
+        Config.CONTEXT_WINDOW - Config.RESERVED_OUTPUT_TOKENS
+        - system_tokens - counter.count(build_user_prompt(query, empty_rag_notice))
+        - 2 * MESSAGE_OVERHEAD_TOKENS
     )
+    demands = {
+        "video": counter.count(build_video_context(video_context)) + MESSAGE_OVERHEAD_TOKENS if video_context else 0,
+        "rag": sum(counter.count(c) + MESSAGE_OVERHEAD_TOKENS for c in rag_chunks),
+        "history": sum(counter.count(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in history)
+                   + (counter.count(build_conversation_summary(summary)) + MESSAGE_OVERHEAD_TOKENS if summary else 0),
+    }
+    budget = allocate(available, demands, Config.PROMPT_BUDGET_WEIGHTS)
 
+    video_text = ""
     if video_context:
-        base_prompt += f"\n=== 🎥 视频/图片分析报告 (高优先级) ===\n{video_context}\n"
-    
-    if rag_context:
-        base_prompt += f"\n=== 📚 知识库参考资料 ===\n{rag_context}\n"
-    else:
-        base_prompt += "\n（当前无相关知识库参考资料，请仅基于已有知识或视频回答）\n"
+        header_tokens = counter.count(build_video_context("")) + MESSAGE_OVERHEAD_TOKENS
+        video_text = counter.truncate(video_context, budget["video"] - header_tokens, keep_tail=True)
+    kept_chunks = _fit_chunks(counter, rag_chunks, budget["rag"])
+    history_budget = budget["history"]
+    summary_text = ""
+    if summary:
+        header_tokens = counter.count(build_conversation_summary("")) + MESSAGE_OVERHEAD_TOKENS
+        summary_budget = min(counter.count(summary), history_budget // 2 - header_tokens)
+        if summary_budget >= MIN_CHUNK_TOKENS or summary_budget == counter.count(summary):
+            summary_text = counter.truncate(summary, summary_budget)
+            history_budget -= counter.count(build_conversation_summary(summary_text)) + MESSAGE_OVERHEAD_TOKENS
+    kept_history = _fit_history(counter, history, history_budget)
 
-    return base_prompt
\ No newline at end of file
+    messages = [ChatMessage(role=MessageRole.SYSTEM, content=SYSTEM_PROMPT)]
+    if video_text:
+        messages.append(ChatMessage(role=MessageRole.SYSTEM, content=build_video_context(video_text)))
+    if summary_text:
+        messages.append(ChatMessage(role=MessageRole.SYSTEM, content=build_conversation_summary(summary_text)))
+    for msg in kept_history:
+        role = MessageRole.USER if msg["role"] == "user" else MessageRole.ASSISTANT
+        messages.append(ChatMessage(role=role, content=msg["content"]))
+    rag_text = format_rag_chunks(kept_chunks) if kept_chunks else empty_rag_notice
+    messages.append(ChatMessage(role=MessageRole.USER, content=build_user_prompt(query, rag_text)))
+
+    breakdown = {
+        "system": system_tokens,
+        "video": counter.count(video_text),
+        "rag": counter.count(rag_text) if kept_chunks else 0,
+        "summary": counter.count(summary_text),
+        "history": sum(counter.count(m["content"]) for m in kept_history),
+        "query": query_tokens,
+        "reserved_output": Config.RESERVED_OUTPUT_TOKENS,
+    }
+    breakdown["prompt_total"] = sum(counter.count(m.content) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+    logger.info(
+        f"🧮 Token 预算 (Ctx={Config.CONTEXT_WINDOW}): system={breakdown['system']} "
+        f"video={breakdown['video']}/{demands['video']} rag={breakdown['rag']}/{demands['rag']} "
+        f"summary={breakdown['summary']} history={breakdown['history']}/{demands['history']} query={query_tokens} "
+        f"prompt={breakdown['prompt_total']} output_reserved={Config.RESERVED_OUTPUT_TOKENS}"
+    )
+    return messages, breakdown
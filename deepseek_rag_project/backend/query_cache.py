@@ -0,0 +1,97 @@
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from config import Config
+
+_TRAILING_PUNCT = "?？!！。.,，;；~～ "
+
+def normalize_query(query: str) -> str:
+    """全角转半角、合并空白、去掉句尾标点，使同一问题的不同写法命中同一缓存"""
+    text = unicodedata.normalize("NFKC", query).strip().lower()
+    text = re.sub(r"\s+", " ", text)
+    return text.rstrip(_TRAILING_PUNCT)
+
+class LRUTTLCache:
+    """线程安全的 LRU + TTL 缓存"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at > time.monotonic():
+                    self.data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + self.ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+class QueryCache:
+    """Query 向量缓存 + 检索结果缓存。检索结果按集合版本号区分，知识库变更时版本号递增即失效。
+    版本号是进程内的；bulk_ingest.py 等独立进程写入的数据依靠 TTL 在 QUERY_CACHE_TTL 内生效。"""
+
+    def __init__(self):
+        self.version = 0
+        self.version_lock = threading.Lock()
+        self.embeddings = LRUTTLCache(Config.QUERY_CACHE_SIZE, Config.QUERY_CACHE_TTL)
+        self.results = LRUTTLCache(Config.QUERY_CACHE_SIZE, Config.QUERY_CACHE_TTL)
+
+    def invalidate(self):
+        """process_file / insert_text / delete_file_index 修改集合后调用"""
+        with self.version_lock:
+            self.version += 1
+        self.results.clear()
+
+    def get_embedding(self, key):
+        # 向量只与模型和精度有关，集合变更不影响
+        return self.embeddings.get(key)
+
+    def put_embedding(self, key, embedding):
+        self.embeddings.put(key, embedding)
+
+    def get_results(self, key, top_k):
+        return self.results.get((key, top_k, self.version))
+
+    def put_results(self, key, top_k, version, nodes):
+        self.results.put((key, top_k, version), nodes)
+
+    def stats(self):
+        return {
+            "collection_version": self.version,
+            "embeddings": self.embeddings.stats(),
+            "results": self.results.stats(),
+        }
+
+query_cache = QueryCache()
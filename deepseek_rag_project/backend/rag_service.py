@@ -1,12 +1,23 @@
+import time
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from llama_index.core import VectorStoreIndex, Settings
-from llama_index.core.llms import ChatMessage, MessageRole
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core.schema import QueryBundle, TextNode, NodeWithScore
 from llama_index.llms.ollama import Ollama
-from llama_index.vector_stores.milvus import MilvusVectorStore
 from config import Config
 from session_manager import session_manager
-from prompts import build_system_prompt
+from prompts import build_chat_messages
+from embedding_provider import get_embed_model
+from embedding_batcher import get_query_batcher
+from query_cache import query_cache, normalize_query
+from answer_cache import answer_cache
+from sparse_index import get_sparse_index, reciprocal_rank_fusion
+from vector_store import build_vector_store
+from reranker import get_reranker
+from conversation_summary import ConversationSummarizer
+from generation_scheduler import generation_scheduler, GenerationQueueFull
+from metrics import CHAT_STAGE_SECONDS, LLM_TOKENS_PER_SECOND, current_trace_id
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,14 +27,20 @@ class RAGService:
         logger.info("🤖 初始化 RAG 服务 (7B 极速版)...")
         
         try:
-            logger.info(f"🔌 加载 Embedding: {Config.EMBEDDING_MODEL}")
-            Settings.embed_model = HuggingFaceEmbedding(
-                model_name=Config.EMBEDDING_MODEL,
-                cache_folder=Config.MODEL_CACHE_DIR
-            )
+            # 与 VectorStoreService 共用同一份 Embedding 模型
+            Settings.embed_model = get_embed_model()
             
             logger.info(f"🧠 连接 LLM: {Config.LLM_MODEL}")
             # 🚀【核心优化】手动调优 Ollama 参数
+            llm_kwargs = {}
+            # 🚀 模型常驻：keep_alive 期间 Ollama 保留上一轮的 KV cache，公共前缀 (系统提示词/视频报告/历史) 无需重算
+            if "keep_alive" in Ollama.__fields__:
+                llm_kwargs["keep_alive"] = Config.LLM_KEEP_ALIVE
+            else:
+                logger.warning(
+                    f"⚠️ 当前 llama-index-llms-ollama 不支持 keep_alive，"
+                    f"请在 Ollama 服务端设置 OLLAMA_KEEP_ALIVE={Config.LLM_KEEP_ALIVE}"
+                )
             Settings.llm = Ollama(
                 model=Config.LLM_MODEL, 
                 base_url=Config.LLM_API_BASE,
@@ -37,97 +54,294 @@ class RAGService:
                     # 通常 8-16 之间是内存带宽的甜点。建议设为 12。
                     "num_thread": 12, 
                     "num_predict": -1,
-                } 
+                },
+                **llm_kwargs
             )
         except Exception as e:
             logger.error(f"❌ 模型加载失败: {e}")
             raise e
 
-        # 移除 Reranker，追求极致响应速度
-        self.reranker = None 
+        self.llm = Settings.llm
+        # 所有生成请求经过同一个调度器：限制并发、按会话公平排队
+        self.scheduler = generation_scheduler
+        # 滑出历史窗口的早期对话在后台合并为滚动摘要
+        self.summarizer = ConversationSummarizer(self.llm) if Config.CONVERSATION_SUMMARY else None
+
+        # Reranker 默认关闭以追求极致响应速度；开启时带硬性延迟预算
+        self.reranker = get_reranker() if Config.RERANK else None
+
+        # 检索是 CPU (embedding) + 网络 (Milvus) 的同步调用，放到有界线程池中执行
+        self.retrieval_executor = ThreadPoolExecutor(
+            max_workers=Config.RETRIEVAL_WORKERS, thread_name_prefix="retrieval"
+        )
+        # 并发查询的 embedding 合并成一次前向计算
+        self.query_batcher = get_query_batcher() if Config.QUERY_BATCHING else None
+        # BM25 稀疏索引，补足条款号/法规名等精确词的召回
+        self.sparse_index = get_sparse_index() if Config.HYBRID_SEARCH else None
 
         try:
-            vector_store = MilvusVectorStore(
-                uri=Config.MILVUS_URI,
-                collection_name=Config.COLLECTION_NAME,
-                dim=Config.EMBEDDING_DIM,
-                overwrite=False
-            )
+            vector_store = build_vector_store()
             self.index = VectorStoreIndex.from_vector_store(vector_store=vector_store)
             logger.info("✅ RAG 索引连接成功")
         except Exception as e:
             logger.error(f"❌ RAG 索引初始化失败: {e}")
             self.index = None
 
+    def _retrieve_sync(self, query: str, embedding=None, top_k=Config.SIMILARITY_TOP_K):
+        candidates = max(Config.HYBRID_CANDIDATES, top_k) if self.sparse_index else top_k
+        retriever = self.index.as_retriever(similarity_top_k=candidates)
+        # 已有 query 向量时直接检索，跳过 retriever 内部的 embedding
+        with CHAT_STAGE_SECONDS.time(stage="dense_search"):
+            dense = retriever.retrieve(QueryBundle(query_str=query, embedding=embedding))
+        if not self.sparse_index:
+            return dense
+        with CHAT_STAGE_SECONDS.time(stage="sparse_search"):
+            sparse_hits = self.sparse_index.search(query, candidates)
+        return self._fuse(dense, sparse_hits, top_k)
+
+    def _fuse(self, dense, sparse_hits, top_k):
+        """RRF 融合稠密与 BM25 结果，只被 BM25 命中的切片从稀疏索引中补全内容"""
+        by_id = {n.node.node_id: n for n in dense}
+        fused = reciprocal_rank_fusion(
+            [list(by_id), [node_id for node_id, _ in sparse_hits]], k=Config.RRF_K
+        )[:top_k]
+        missing = [node_id for node_id, _ in fused if node_id not in by_id]
+        for node_id, (text, file_name) in self.sparse_index.get_chunks(missing).items():
+            by_id[node_id] = NodeWithScore(
+                node=TextNode(text=text, id_=node_id, metadata={"file_name": file_name})
+            )
+        # RRF 原始分数只在 0.016 ~ 0.033 之间，前端按百分比展示相关度；
+        # 除以理论最大值 (两路都排第 1) 缩放到 [0, 1]，排序 (即 RRF 名次) 不变
+        best = 2.0 / (Config.RRF_K + 1)
+        results = []
+        for node_id, score in fused:
+            if node_id in by_id:
+                by_id[node_id].score = min(1.0, score / best)
+                results.append(by_id[node_id])
+        return results
+
+    def _load_history(self, query: str, session_id: str):
+        """返回 (最近的历史消息, 滚动摘要)"""
+        history = []
+        history_data = session_manager.get_recent_messages(session_id, Config.HISTORY_MESSAGES + 1)
+        # 当前问题已由调用方写入，放在最后一条消息里，不再重复计入历史
+        if history_data and history_data[-1]["role"] == "user" and history_data[-1]["content"] == query:
+            history_data = history_data[:-1]
+        for msg in history_data[-Config.HISTORY_MESSAGES:]:
+            if msg["content"]:
+                clean_content = msg["content"].replace("<think>", "").replace("</think>", "")
+                history.append({"role": msg["role"], "content": clean_content})
+        summary = session_manager.get_summary(session_id)[0] if self.summarizer else ""
+        return history, summary
+
+    async def embed_query(self, query: str):
+        """Query 向量：先查缓存，再走微批处理 (未启用时在检索线程池中单独编码)。
+        编码的是规范化后的文本，缓存的向量与缓存键一一对应，不取决于第一次出现的写法"""
+        key = normalize_query(query)
+        embedding = query_cache.get_embedding(key)
+        if embedding is None:
+            start = time.perf_counter()
+            if self.query_batcher:
+                embedding = await self.query_batcher.aembed(key)
+            else:
+                loop = asyncio.get_running_loop()
+                embedding = await loop.run_in_executor(
+                    self.retrieval_executor, Settings.embed_model.get_query_embedding, key
+                )
+            CHAT_STAGE_SECONDS.observe(time.perf_counter() - start, stage="embedding")
+            query_cache.put_embedding(key, embedding)
+        return embedding
+
+    async def retrieve(self, query: str):
+        """异步检索：先查缓存；Milvus 检索在检索线程池中执行，不阻塞 uvicorn 事件循环。
+        稀疏检索与 Rerank 同样使用规范化后的文本，缓存结果只取决于缓存键"""
+        query = key = normalize_query(query)
+        top_k = Config.SIMILARITY_TOP_K
+        version = query_cache.version
+        nodes = query_cache.get_results(key, top_k)
+        if nodes is not None:
+            return nodes
+
+        # 🚀【优化】最终只取 Top 2
+        # 7B 模型阅读速度快，Top 2 (约 700 tokens) 可以在 1-2秒内读完。
+        # 既保证了有足够的资料，又不会让预处理时间太长。启用 Rerank 时先取更宽的候选集。
+        fetch_k = Config.RERANK_CANDIDATES if self.reranker else top_k
+        embedding = await self.embed_query(query)
+        loop = asyncio.get_running_loop()
+        nodes = await loop.run_in_executor(
+            self.retrieval_executor, self._retrieve_sync, query, embedding, fetch_k
+        )
+
+        cacheable = True
+        if self.reranker:
+            with CHAT_STAGE_SECONDS.time(stage="rerank"):
+                nodes, cacheable = await self.reranker.rerank(query, nodes, top_k)
+        if cacheable:
+            # 使用检索开始前的版本号，检索期间集合发生变更时该结果不会被命中
+            query_cache.put_results(key, top_k, version, nodes)
+        return nodes
+
+    def schedule_summary(self, session_id: str):
+        """回答落库后调用：后台更新该会话的滚动摘要"""
+        if self.summarizer:
+            self.summarizer.schedule(session_id)
+
     async def chat_stream(self, query: str, session_id: str, context: str = ""):
+        """纯文本流 (text/plain 协议)：只输出回答文本"""
+        async for event in self.chat_events(query, session_id, context):
+            if event["type"] == "token":
+                yield event["text"]
+            elif event["type"] == "error":
+                yield event["message"]
+
+    async def chat_events(self, query: str, session_id: str, context: str = "", ticket=None):
+        """
+        结构化事件流，事件均为 dict：
+          {"type": "stage", "stage": ..., "status": "start" | "done"}  阶段进度 (queue 阶段带排队位置 position)
+          {"type": "sources", "sources": [{"id", "name", "score"}]}    引用资料
+          {"type": "token", "text": ...}                               回答文本
+          {"type": "timing", ...}                                      各阶段耗时 (ms)，最后发送
+        """
+        start = time.perf_counter()
+        timing = {}
         if not self.index:
-            yield "系统初始化失败，无法连接到知识库。\n"
+            yield {"type": "token", "text": "系统初始化失败，无法连接到知识库。\n"}
             return
 
-        knowledge_text = ""
+        rag_chunks = []
+        empty_rag_notice = ""
+        # 语义答案缓存：仅在无视频上下文、且会话没有历史对话和摘要时使用 (缓存键不含对话上下文)
+        cache_key = None
+        loop = asyncio.get_running_loop()
+        # 只读最近几条消息 + 滚动摘要，读库量与 prompt 长度不随会话增长；
+        # 读己之写可能要等写线程提交，放到线程池中与检索并行执行，不阻塞事件循环
+        history_future = loop.run_in_executor(self.retrieval_executor, self._load_history, query, session_id)
         
         # 1. 上下文互斥策略 (有视频就不查文档)
         if context:
             logger.info("🎥 检测到视频上下文，跳过 RAG 检索。")
-            knowledge_text = "" 
         else:
             logger.info(f"🔍 开始检索知识库: {query[:20]}")
+            yield {"type": "stage", "stage": "retrieval", "status": "start"}
             try:
-                # 🚀【优化】只取 Top 2
-                # 7B 模型阅读速度快，Top 2 (约 700 tokens) 可以在 1-2秒内读完。
-                # 既保证了有足够的资料，又不会让预处理时间太长。
-                retriever = self.index.as_retriever(similarity_top_k=2)
-                nodes = retriever.retrieve(query)
-                
+                nodes = await self.retrieve(query)
+                CHAT_STAGE_SECONDS.observe(time.perf_counter() - start, stage="retrieval")
+                timing["retrieval_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                yield {"type": "stage", "stage": "retrieval", "status": "done"}
                 if nodes:
-                    knowledge_lines = []
-                    for i, n in enumerate(nodes):
-                        knowledge_lines.append(f"---资料 {i+1} (仅供参考)---\n{n.get_content()}")
-                    
-                    if knowledge_lines:
-                        knowledge_text = "\n\n".join(knowledge_lines)
+                    yield {"type": "sources", "sources": [
+                        {"id": i + 1, "name": n.node.metadata.get("file_name", "未知文件"), "score": float(n.score or 0.0)}
+                        for i, n in enumerate(nodes)
+                    ]}
+
+                history, summary = await history_future
+                if Config.ANSWER_CACHE and nodes and not history and not summary:
+                    query_embedding = await self.embed_query(query)
+                    chunk_ids = [n.node.node_id for n in nodes]
+                    cached_answer = answer_cache.lookup(query_embedding, chunk_ids)
+                    if cached_answer is not None:
+                        logger.info("⚡ 命中语义答案缓存，直接返回")
+                        yield {"type": "token", "text": cached_answer}
+                        timing["answer_cache_hit"] = True
+                        timing["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                        yield {"type": "timing", **timing}
+                        return
+                    file_names = [n.node.metadata.get("file_name", "") for n in nodes]
+                    cache_key = (query_embedding, chunk_ids, file_names)
                 
-                if not knowledge_text:
-                    knowledge_text = "（未检索到高相关性文档，请忽略此部分）"
+                rag_chunks = [n.get_content() for n in nodes if n.get_content()]
+                if not rag_chunks:
+                    empty_rag_notice = "（未检索到高相关性文档，请忽略此部分）"
                     
             except Exception as e:
                 logger.error(f"❌ 检索失败: {e}")
-                knowledge_text = ""
+                yield {"type": "stage", "stage": "retrieval", "status": "error"}
 
-        # 2. 构建消息
-        chat_messages = []
-        system_content = build_system_prompt(video_context=context, rag_context=knowledge_text)
-        chat_messages.append(ChatMessage(role=MessageRole.SYSTEM, content=system_content))
+        # 2. 按 token 预算构建消息 (视频报告 / 知识库片段 / 历史对话 各自裁剪到预算内)
+        prompt_start = time.perf_counter()
+        history, summary = await history_future
 
-        history_data = session_manager.get_messages(session_id)
-        for msg in history_data[-4:]:
-            role = MessageRole.USER if msg["role"] == "user" else MessageRole.ASSISTANT
-            if msg["content"]:
-                clean_content = msg["content"].replace("<think>", "").replace("</think>", "")
-                chat_messages.append(ChatMessage(role=role, content=clean_content))
+        # token 计数与截断的二分查找同样放到线程池，长视频报告时可达数十毫秒
+        chat_messages, _ = await loop.run_in_executor(
+            self.retrieval_executor, lambda: build_chat_messages(
+                query, history=history, video_context=context,
+                rag_chunks=rag_chunks, empty_rag_notice=empty_rag_notice, summary=summary
+            )
+        )
+        CHAT_STAGE_SECONDS.observe(time.perf_counter() - prompt_start, stage="prompt_build")
+
+        # 3. 生成调度：入口未预先准入时在这里准入 (队列满则直接返回提示)
+        if ticket is None:
+            try:
+                ticket = self.scheduler.admit()
+            except GenerationQueueFull as e:
+                yield {"type": "error", "message": f"当前请求过多，{e}"}
+                return
+        try:
+            async for event in self._generate(chat_messages, session_id, ticket, start, timing, cache_key):
+                yield event
+        finally:
+            self.scheduler.release(ticket)
+
+        CHAT_STAGE_SECONDS.observe(time.perf_counter() - start, stage="total")
+        timing["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        if current_trace_id():
+            timing["trace_id"] = current_trace_id()
+        yield {"type": "timing", **timing}
 
-        chat_messages.append(ChatMessage(role=MessageRole.USER, content=query))
+    async def _generate(self, chat_messages, session_id, ticket, start, timing, cache_key):
+        queue_start = time.perf_counter()
+        if not self.scheduler.enqueue(ticket, session_id):
+            yield {"type": "stage", "stage": "queue", "status": "start", "position": self.scheduler.position(ticket)}
+            try:
+                await self.scheduler.wait(ticket)
+            except asyncio.TimeoutError:
+                yield {"type": "stage", "stage": "queue", "status": "error"}
+                yield {"type": "error", "message": "排队等待超时，请稍后重试。"}
+                return
+            yield {"type": "stage", "stage": "queue", "status": "done"}
+        CHAT_STAGE_SECONDS.observe(time.perf_counter() - queue_start, stage="queue_wait")
+        timing["queue_ms"] = round((time.perf_counter() - queue_start) * 1000, 1)
 
-        # 3. 异步流式生成
+        # 4. 异步流式生成
+        yield {"type": "stage", "stage": "generation", "status": "start"}
+        generation_start = time.perf_counter()
         try:
-            logger.info(f"🚀 向 Ollama 发送请求 (Thread=12, Ctx={Config.CONTEXT_WINDOW})...")
+            logger.info(f"🚀 向 Ollama 发送请求 (Thread=12, Ctx={Config.CONTEXT_WINDOW}, Trace={current_trace_id() or '-'})...")
             
             # 使用 astream_chat 确保非阻塞
-            response_stream = await Settings.llm.astream_chat(chat_messages)
+            response_stream = await self.llm.astream_chat(chat_messages)
             
             has_content = False
+            answer_parts = []
             async for chunk in response_stream:
                 content = chunk.delta
                 if content:
+                    if not has_content:
+                        first_token_at = time.perf_counter()
+                        CHAT_STAGE_SECONDS.observe(first_token_at - generation_start, stage="ttft")
+                        timing["ttft_ms"] = round((first_token_at - start) * 1000, 1)
                     has_content = True
-                    yield content
+                    answer_parts.append(content)
+                    yield {"type": "token", "text": content}
             
             if not has_content:
-                yield "模型思考超时或返回为空，请重试。"
+                yield {"type": "token", "text": "模型思考超时或返回为空，请重试。"}
+            elif cache_key:
+                query_embedding, chunk_ids, file_names = cache_key
+                answer_cache.store(query_embedding, chunk_ids, file_names, "".join(answer_parts))
+            generation_end = time.perf_counter()
+            CHAT_STAGE_SECONDS.observe(generation_end - generation_start, stage="generation")
+            if len(answer_parts) > 1 and generation_end > first_token_at:
+                LLM_TOKENS_PER_SECOND.observe((len(answer_parts) - 1) / (generation_end - first_token_at))
+            timing["generation_ms"] = round((generation_end - generation_start) * 1000, 1)
+            timing["chunks"] = len(answer_parts)
+            yield {"type": "stage", "stage": "generation", "status": "done"}
 
         except Exception as e:
             logger.error(f"❌ 生成出错: {e}")
-            yield f"\n[系统错误: {str(e)}]"
+            yield {"type": "token", "text": f"\n[系统错误: {str(e)}]"}
+            yield {"type": "stage", "stage": "generation", "status": "error"}
 
 _rag_service = None
 def get_rag_service():
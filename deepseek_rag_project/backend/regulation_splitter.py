@@ -0,0 +1,222 @@
+"""
+法规结构切片：按 编/章/节/条 切分，条款不被截断；相邻短条款合并到 token 预算 (CHUNK_SIZE)，
+跨章节合并时正文中保留章节标题；超长条款再按句切分。识别不到条款结构的文档回退 SentenceSplitter。
+切片带 regulation (法规名)、chapter、section、articles (如 "第十二条" / "第十二条至第十五条") 元数据，
+前三项进入 embedding 与 LLM 上下文 (条款号已在正文开头)。
+
+PDF 按页产生多个 Document，同一文件的相邻页先拼接再切分，条款不会被页边界截断；
+切片的 page_label 等元数据取自条款起始页。流式入库 (pdf_pipeline.iter_page_windows) 在 block_offsets 给出的条款起始处分窗，
+下一窗口开头补上 carry_over 返回的法规名与章节标题，保持解析上下文。
+对比切片数与检索命中：python -m benchmarks.bench_chunking
+"""
+import os
+import re
+from typing import Callable, Optional
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.node_parser import NodeParser, SentenceSplitter
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.utils import get_tokenizer
+
+_NUM = r"[一二三四五六七八九十百千零〇两\d]+"
+# 条款号须位于行首且后跟空白 (含全角空格)，避免把正文中 "依照本法第十二条规定" 这类引用当作新条款
+ARTICLE_RE = re.compile(rf"^[ \t　]*(第{_NUM}条(?:之{_NUM})?)(?:[ \t　]+|$)")
+# OCR 识别的文本条款号后通常没有空白：上一行已结束 (句末标点或标题) 时才按条款号起始处理
+ARTICLE_LOOSE_RE = re.compile(rf"^[ \t　]*(第{_NUM}条(?:之{_NUM})?)")
+CHAPTER_RE = re.compile(rf"^[ \t　]*(第{_NUM}[编章])(?:[ \t　]*(.*))?$")
+SECTION_RE = re.compile(rf"^[ \t　]*(第{_NUM}节)(?:[ \t　]*(.*))?$")
+# 页眉页脚中的页码行 ("－1－"、"- 12 -"、"3")，解析时跳过
+PAGE_NUMBER_RE = re.compile(r"^[-－—–\s]*\d{1,4}[-－—–\s]*$")
+# 标题行：较短且不以句末标点结尾
+_HEADING_MAX_CHARS = 40
+_SENTENCE_ENDS = ("。", "；", "：", "！", "？", ".", ";", ":")
+
+def _heading(match):
+    text = " ".join(part.strip() for part in match.groups() if part and part.strip())
+    # "总  则" 这类排版用空格去掉
+    return re.sub(r"(?<=[\u4e00-\u9fff])\s+(?=[\u4e00-\u9fff])", "", text)
+
+def _join_lines(lines):
+    """PDF 抽取的文本按版面折行，句中折行直接拼接 (保持中文词语连续)，句末换行保留"""
+    text = lines[0]
+    for line in lines[1:]:
+        text += ("\n" if text.endswith(_SENTENCE_ENDS) else "") + line
+    return text
+
+def parse_articles(text):
+    """返回 (法规名, [(章, 节, 条款号, 条文, 起始字符位置)])；条款号为空的是首条之前的序言/正文"""
+    title, articles, _, _ = _parse_structure(text)
+    return title, articles
+
+def _parse_structure(text):
+    """parse_articles 的实现，另返回文本末尾所在的章、节"""
+    title, chapter, section = None, "", ""
+    articles = []
+    current = None  # [章, 节, 条款号, 行列表, 起始位置]
+    offset, first, line_ended = 0, True, True
+    for line in text.splitlines(keepends=True):
+        start, offset = offset, offset + len(line)
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if PAGE_NUMBER_RE.match(stripped):
+            continue
+        is_first, first = first, False
+        after_break, line_ended = line_ended, True
+        if re.sub(r"\s", "", stripped) == "目录":
+            continue
+        short = len(stripped) <= _HEADING_MAX_CHARS and not stripped.endswith(_SENTENCE_ENDS)
+        chapter_match = CHAPTER_RE.match(stripped) if short else None
+        section_match = SECTION_RE.match(stripped) if short else None
+        article_match = ARTICLE_RE.match(stripped) or (after_break and ARTICLE_LOOSE_RE.match(stripped))
+        if chapter_match or section_match:
+            # 章节标题 (含目录中的标题) 只更新上下文，不进入正文
+            if chapter_match:
+                chapter, section = _heading(chapter_match), ""
+            else:
+                section = _heading(section_match)
+            current = None
+            continue
+        if article_match:
+            current = [chapter, section, article_match.group(1), [stripped], start]
+            articles.append(current)
+            line_ended = stripped.endswith(_SENTENCE_ENDS)
+            continue
+        if is_first and short:
+            # 首行的短文本视为法规名
+            title = stripped
+            continue
+        if current is None:
+            current = [chapter, section, "", [], start]
+            articles.append(current)
+        current[3].append(stripped)
+        line_ended = stripped.endswith(_SENTENCE_ENDS)
+    return title, [(c, s, no, _join_lines(lines), pos) for c, s, no, lines, pos in articles if lines], chapter, section
+
+def _article_range(numbers):
+    numbers = [n for n in numbers if n]
+    if not numbers:
+        return ""
+    return numbers[0] if len(numbers) == 1 else f"{numbers[0]}至{numbers[-1]}"
+
+class RegulationSplitter(NodeParser):
+    """按条款切分法规文本，接口与 SentenceSplitter 相同 (可直接作为 Settings.text_splitter)"""
+
+    chunk_size: int = Field(default=512, description="每个切片的 token 上限", gt=0)
+    chunk_overlap: int = Field(default=50, description="超长条款按句切分时的重叠 token 数", ge=0)
+
+    _tokenizer: Callable = PrivateAttr()
+    _fallback: SentenceSplitter = PrivateAttr()
+
+    def __init__(self, chunk_size: int = 512, chunk_overlap: int = 50, tokenizer: Optional[Callable] = None, **kwargs):
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **kwargs)
+        self._tokenizer = tokenizer or get_tokenizer()
+        self._fallback = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, tokenizer=self._tokenizer)
+
+    @classmethod
+    def class_name(cls):
+        return "RegulationSplitter"
+
+    def block_offsets(self, text):
+        """各条款在文本中的起始位置：流式分窗时在这些位置断开不会截断条款"""
+        return [start for _, _, number, _, start in parse_articles(text)[1] if number]
+
+    def carry_over(self, docs):
+        """分窗后下一窗口开头的标题行：本窗口的法规名与末尾所在的章、节 (只更新解析上下文，不进入切片正文)"""
+        title, articles, chapter, section = _parse_structure("\n".join(doc.get_content() for doc in docs))
+        # 没有条款结构的窗口走 SentenceSplitter，标题行会进入正文
+        if not any(number for _, _, number, _, _ in articles):
+            return ""
+        return "\n".join(line for line in (title, chapter, section) if line)
+
+    def _count(self, text):
+        return len(self._tokenizer(text))
+
+    def _parse_nodes(self, nodes, show_progress=False, **kwargs):
+        result = []
+        for group in self._group_by_file(nodes):
+            parsed = self._split_group(group)
+            if parsed is None:
+                parsed = self._fallback._parse_nodes(group, show_progress=show_progress)
+            result.extend(parsed)
+        return result
+
+    def _group_by_file(self, nodes):
+        """同一文件的相邻 Document (PDF 的各页) 归为一组"""
+        groups = []
+        for node in nodes:
+            if groups and groups[-1][0].metadata.get("file_name") == node.metadata.get("file_name"):
+                groups[-1].append(node)
+            else:
+                groups.append([node])
+        return groups
+
+    def _split_group(self, docs):
+        texts, starts, offset = [], [], 0
+        for doc in docs:
+            text = doc.get_content()
+            texts.append(text)
+            starts.append(offset)
+            offset += len(text) + 1
+        title, articles = parse_articles("\n".join(texts))
+        if not any(number for _, _, number, _, _ in articles):
+            return None
+
+        file_name = docs[0].metadata.get("file_name", "")
+        title = title or os.path.splitext(file_name)[0]
+        # 与 SentenceSplitter 一样扣除元数据占用的 token (按本文件最长的章节名估算)
+        longest = {
+            **docs[-1].metadata,
+            "regulation": title,
+            "chapter": max((a[0] for a in articles), key=len),
+            "section": max((a[1] for a in articles), key=len),
+        }
+        metadata_tokens = self._count("\n".join(f"{k}: {v}" for k, v in longest.items()))
+        budget = max(self.chunk_size - metadata_tokens, self.chunk_overlap + 1)
+        splitter = SentenceSplitter(chunk_size=budget, chunk_overlap=self.chunk_overlap, tokenizer=self._tokenizer)
+
+        def page_of(position):
+            index = 0
+            while index + 1 < len(starts) and starts[index + 1] <= position:
+                index += 1
+            return docs[index]
+
+        nodes = []
+
+        def emit(texts, numbers, headings, position):
+            metadata = {
+                "regulation": title,
+                "chapter": " / ".join(dict.fromkeys(c for c, _ in headings if c)),
+                "section": " / ".join(dict.fromkeys(x for _, x in headings if x)),
+                "articles": _article_range(numbers),
+            }
+            for node in build_nodes_from_splits(texts, page_of(position), id_func=self.id_func):
+                node.metadata.update({k: v for k, v in metadata.items() if v})
+                # 条款号已在正文开头，不再重复进入 embedding 与 LLM 上下文
+                node.excluded_embed_metadata_keys = [*node.excluded_embed_metadata_keys, "articles"]
+                node.excluded_llm_metadata_keys = [*node.excluded_llm_metadata_keys, "articles"]
+                nodes.append(node)
+
+        pending, numbers, headings, tokens, position = [], [], [], 0, 0
+        for chapter, section, number, text, start in articles:
+            heading = (chapter, section)
+            size = self._count(text)
+            # 跨章节合并时正文里保留新章节的标题
+            label = " ".join(h for h in heading if h) if pending and heading != headings[-1] else ""
+            extra = self._count(label) + 1 if label else 0
+            if pending and tokens + size + extra > budget:
+                emit(["\n".join(pending)], numbers, headings, position)
+                pending, numbers, headings, tokens = [], [], [], 0
+                label, extra = "", 0
+            if size > budget:
+                # 单条超长：按句切分，各段沿用同一条款号
+                emit(splitter.split_text(text), [number], [heading], start)
+                continue
+            if not pending:
+                position = start
+            pending.append(f"{label}\n{text}" if label else text)
+            numbers.append(number)
+            headings.append(heading)
+            tokens += size + extra
+        if pending:
+            emit(["\n".join(pending)], numbers, headings, position)
+        return nodes
@@ -0,0 +1,316 @@
+"""
+集合重建与别名切换：换 EMBEDDING_MODEL 或 CHUNK_SIZE 后不中断检索地重建向量库 (仅 Milvus 后端)。
+
+python reindex.py                 建新集合 -> 校验 -> 切换别名 -> 追平重建期间的上传/删除
+python reindex.py --no-swap       只建新集合并校验
+python reindex.py --swap NAME     把别名切换到已建好的集合 (也用于回滚到旧集合)
+python reindex.py --list          列出集合与别名当前指向
+可加 --drop-old 在切换后删除旧集合 (默认保留，便于回滚)。
+
+数据来源：data/files 下的文档/图片 (与 bulk_ingest 相同的解析切片) 和 data/reports 下保存的视频分析报告；
+报告落盘之前入库的视频没有原文，沿用现有切片文本重新向量化。
+重建期间在线服务照常读写别名指向的旧集合；重建进程降低优先级、限制 torch 线程数，
+小批量 embedding 并按 REINDEX_DUTY_CYCLE 休眠，避免抢占在线检索的 CPU。
+切换别名后整体替换入库清单与稀疏索引，再按文件哈希追平重建期间变化的文件。
+
+只改切片参数时一步完成，服务无需重启 (检索结果缓存在 QUERY_CACHE_TTL 后过期)。
+换 embedding 模型时在线服务的 query 向量须与集合一致：先 --no-swap 建好新集合，
+更新服务配置后执行 --swap NAME 并重启服务。
+"""
+import os
+import json
+import time
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 切换前抽样自检：切片用自身向量检索，应出现在 Top-5 中
+SELF_CHECK_SAMPLES = 100
+SELF_CHECK_TOP_K = 5
+SELF_CHECK_MIN_RECALL = 0.9
+
+def staging_path(collection_name):
+    """新集合对应的入库清单与稀疏索引切片，切换别名时整体替换"""
+    return os.path.join(os.path.dirname(Config.DB_PATH), "reindex", f"{collection_name}.json")
+
+def lower_priority():
+    try:
+        os.nice(Config.REINDEX_NICE)
+    except (AttributeError, OSError):
+        pass
+    try:
+        import torch
+        torch.set_num_threads(Config.REINDEX_THREADS)
+    except ImportError:
+        pass
+
+class Throttle:
+    """按占空比限速：一批工作耗时 t，随后休眠 t·(1-duty)/duty"""
+
+    def __init__(self, duty=Config.REINDEX_DUTY_CYCLE):
+        self.duty = min(max(duty, 0.05), 1.0)
+        self.slept = 0.0
+
+    def run(self, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        pause = (time.perf_counter() - start) * (1 - self.duty) / self.duty
+        if pause > 0:
+            time.sleep(pause)
+            self.slept += pause
+        return result
+
+class Reindexer:
+    def __init__(self, collection_name, batch=Config.REINDEX_BATCH, throttle=None):
+        from milvus_store import build_milvus_vector_store
+        from embedding_provider import get_embedding_provider
+        self.collection_name = collection_name
+        self.store = build_milvus_vector_store(collection_name=collection_name)
+        self.embedder = get_embedding_provider()
+        self.batch = batch
+        self.throttle = throttle or Throttle()
+
+        self.buffer = []
+        self.files = {}   # {file_name: (file_hash, {chunk_hash: node_id})}
+        self.chunks = []  # [(node_id, file_name, text)]，切换后写入稀疏索引
+        self.samples = []  # [(node_id, embedding)]，切换前自检用
+        self.stats = {"files": 0, "reports": 0, "legacy_reports": 0, "failed": 0, "vectors": 0}
+
+    def add(self, filename, file_hash, nodes):
+        """按与 VectorStoreService.plan_sync 相同的规则分配 ID，同一文件内重复切片只保留一个"""
+        from ingest_manifest import hash_text
+        from vector_store import chunk_node_id
+
+        chunks = {}
+        for node in nodes:
+            chunk_hash = hash_text(node.get_content())
+            if chunk_hash in chunks:
+                continue
+            node.id_ = chunk_node_id(filename, chunk_hash)
+            chunks[chunk_hash] = node.node_id
+            self._append(node, filename)
+        self.files[filename] = (file_hash, chunks)
+
+    def add_existing(self, filename, file_hash, chunks, texts):
+        """沿用已有切片 (ID 与文本不变) 重新向量化，chunks: {chunk_hash: node_id}，texts: {node_id: text}"""
+        from llama_index.core.schema import TextNode
+        for node_id in chunks.values():
+            if node_id in texts:
+                self._append(TextNode(id_=node_id, text=texts[node_id], metadata={"file_name": filename}), filename)
+        self.files[filename] = (file_hash, {h: i for h, i in chunks.items() if i in texts})
+
+    def _append(self, node, filename):
+        self.buffer.append(node)
+        self.chunks.append((node.node_id, filename, node.get_content()))
+        if len(self.buffer) >= self.batch:
+            self.throttle.run(self.flush)
+
+    def flush(self):
+        from llama_index.core.schema import MetadataMode
+        if not self.buffer:
+            return
+        embeddings = self.embedder.embed_documents(
+            [n.get_content(metadata_mode=MetadataMode.EMBED) for n in self.buffer]
+        )
+        for node, embedding in zip(self.buffer, embeddings):
+            node.embedding = embedding
+        self.store.add(self.buffer)
+        if len(self.samples) < SELF_CHECK_SAMPLES:
+            self.samples.append((self.buffer[0].node_id, self.buffer[0].embedding))
+        self.stats["vectors"] += len(self.buffer)
+        self.buffer = []
+
+    def save_staging(self):
+        path = staging_path(self.collection_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files, "chunks": self.chunks}, f)
+        return path
+
+def video_files(directory):
+    return [
+        f for f in sorted(os.listdir(directory))
+        if os.path.isfile(os.path.join(directory, f)) and os.path.splitext(f)[1].lower() in Config.VIDEO_EXTS
+    ]
+
+def add_reports(reindexer, directory):
+    """视频报告：有原文的重新切片，没有原文的沿用稀疏索引中保存的切片文本"""
+    from llama_index.core import Document
+    from ingest_manifest import ingest_manifest, hash_text
+    from sparse_index import get_sparse_index
+    from vector_store import build_text_splitter, report_path
+
+    splitter = build_text_splitter()
+    for filename in video_files(directory):
+        if os.path.exists(report_path(filename)):
+            with open(report_path(filename), encoding="utf-8") as f:
+                report = f.read()
+            doc = Document(text=report)
+            doc.metadata["file_name"] = filename
+            reindexer.add(filename, hash_text(report), splitter.get_nodes_from_documents([doc]))
+            reindexer.stats["reports"] += 1
+            continue
+        file_hash = ingest_manifest.get_file_hash(filename)
+        texts = dict(get_sparse_index().get_file_chunks(filename))
+        if file_hash is None or not texts:
+            logger.warning(f"⚠️ 视频 {filename} 没有分析报告，跳过")
+            continue
+        reindexer.add_existing(filename, file_hash, ingest_manifest.get_chunks(filename), texts)
+        reindexer.stats["legacy_reports"] += 1
+
+def count_entities(client, collection_name):
+    from pymilvus import Collection
+    Collection(collection_name, using=client._using).flush()
+    rows = client.query(collection_name, filter="", output_fields=["count(*)"], consistency_level="Strong")
+    return rows[0]["count(*)"]
+
+def self_check(client, collection_name, samples):
+    """返回自身向量检索 Top-K 命中率"""
+    from index_profiles import get_index_profile, search_params
+    if not samples:
+        return 1.0
+    results = client.search(
+        collection_name,
+        data=[embedding for _, embedding in samples],
+        limit=SELF_CHECK_TOP_K,
+        search_params=search_params(get_index_profile(), SELF_CHECK_TOP_K),
+        consistency_level="Strong",
+    )
+    hits = sum(node_id in {hit["id"] for hit in hits} for (node_id, _), hits in zip(samples, results))
+    return hits / len(samples)
+
+def build(client, collection_name, workers):
+    from bulk_ingest import parse_file, collect_files
+
+    if client.has_collection(collection_name):
+        raise SystemExit(f"集合 {collection_name} 已存在")
+    lower_priority()
+    reindexer = Reindexer(collection_name)
+    files = collect_files(Config.FILES_DIR)
+    logger.info(f"🏗️ 重建集合 {collection_name}: 文件 {len(files)} 个 (模型 {Config.EMBEDDING_MODEL}, "
+                f"切片 {Config.CHUNK_SIZE}/{Config.CHUNK_OVERLAP}, 占空比 {reindexer.throttle.duty})")
+    start = time.perf_counter()
+
+    # 解析子进程继承降低后的优先级
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(parse_file, path): path for path in files}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                filename, file_hash, _, nodes = future.result()
+                reindexer.add(filename, file_hash, nodes)
+                reindexer.stats["files"] += 1
+            except Exception as e:
+                reindexer.stats["failed"] += 1
+                logger.error(f"❌ 处理失败 {os.path.basename(path)}: {e}")
+    add_reports(reindexer, Config.FILES_DIR)
+    reindexer.throttle.run(reindexer.flush)
+
+    s = reindexer.stats
+    logger.info(f"   📦 文件 {s['files']} / 报告 {s['reports']} (沿用切片 {s['legacy_reports']}) / 失败 {s['failed']}, "
+                f"向量 {s['vectors']}, 耗时 {time.perf_counter() - start:.1f}s (限速休眠 {reindexer.throttle.slept:.1f}s)")
+
+    count = count_entities(client, collection_name)
+    if count != s["vectors"]:
+        raise SystemExit(f"❌ 校验失败: 集合 {collection_name} 有 {count} 条向量，应为 {s['vectors']}，未切换别名")
+    recall = self_check(client, collection_name, reindexer.samples)
+    if recall < SELF_CHECK_MIN_RECALL:
+        raise SystemExit(f"❌ 校验失败: 抽样自检 Top-{SELF_CHECK_TOP_K} 命中率 {recall:.2f}，未切换别名")
+    logger.info(f"   ✅ 校验通过: {count} 条向量，抽样自检命中率 {recall:.2f}")
+    return reindexer.save_staging()
+
+def swap(client, collection_name, drop_old=False):
+    from milvus_store import resolve_collection
+    from ingest_manifest import ingest_manifest
+    from sparse_index import get_sparse_index
+
+    if not client.has_collection(collection_name):
+        raise SystemExit(f"集合 {collection_name} 不存在")
+    alias = Config.COLLECTION_ALIAS
+    old = resolve_collection(client)
+    if client.has_collection(alias):
+        client.alter_alias(collection_name, alias)
+    else:
+        client.create_alias(collection_name, alias)
+    logger.info(f"🔀 别名 {alias}: {old} -> {collection_name}")
+
+    path = staging_path(collection_name)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            staging = json.load(f)
+        ingest_manifest.replace_all({name: (h, chunks) for name, (h, chunks) in staging["files"].items()})
+        sparse_index = get_sparse_index()
+        sparse_index.replace_all([tuple(c) for c in staging["chunks"]])
+        sparse_index.commit()
+    else:
+        logger.warning(f"⚠️ 没有 {collection_name} 的重建清单，沿用现有入库清单与稀疏索引")
+    catch_up()
+
+    if drop_old and old != collection_name:
+        client.drop_collection(old)
+        logger.info(f"🗑️ 已删除旧集合 {old}")
+
+def catch_up():
+    """别名已指向新集合：按文件哈希同步重建期间上传、修改、删除的文件 (未变化的文件直接跳过)"""
+    from bulk_ingest import collect_files
+    from ingest_manifest import ingest_manifest
+    from vector_store import get_vector_service, report_path, remove_report
+
+    service = get_vector_service()
+    present = set(os.listdir(Config.FILES_DIR))
+    for filename in ingest_manifest.list_files():
+        if filename not in present:
+            service.delete_file_index(filename)
+            remove_report(filename)
+    for path in collect_files(Config.FILES_DIR):
+        service.process_file(path)
+    for filename in video_files(Config.FILES_DIR):
+        if os.path.exists(report_path(filename)):
+            with open(report_path(filename), encoding="utf-8") as f:
+                service.insert_text(f.read(), filename)
+
+def list_collections(client):
+    from milvus_store import resolve_collection
+    active = resolve_collection(client) if client.has_collection(Config.COLLECTION_ALIAS) else None
+    print(f"别名 {Config.COLLECTION_ALIAS} -> {active or '(未创建)'}")
+    for name in sorted(client.list_collections()):
+        mark = "*" if name == active else " "
+        print(f" {mark} {name}")
+
+def main():
+    parser = argparse.ArgumentParser(description="后台重建向量集合并原子切换别名")
+    parser.add_argument("--target", default=None, help="新集合名，默认 <COLLECTION_NAME>_<时间戳>")
+    parser.add_argument("--no-swap", action="store_true", help="只建新集合并校验，不切换别名")
+    parser.add_argument("--swap", metavar="NAME", default=None, help="把别名切换到已建好的集合")
+    parser.add_argument("--drop-old", action="store_true", help="切换后删除旧集合")
+    parser.add_argument("--list", action="store_true", help="列出集合与别名指向")
+    parser.add_argument("--workers", type=int, default=1, help="解析进程数 (默认 1，避免抢占在线服务)")
+    args = parser.parse_args()
+
+    if Config.VECTOR_BACKEND != "milvus":
+        raise SystemExit("集合重建与别名切换仅支持 Milvus 后端 (嵌入式向量库可直接删除 LOCAL_VECTOR_DIR 后重新入库)")
+    from pymilvus import MilvusClient
+    client = MilvusClient(uri=Config.MILVUS_URI)
+
+    if args.list:
+        list_collections(client)
+        return
+    if args.swap:
+        swap(client, args.swap, drop_old=args.drop_old)
+        return
+
+    target = args.target or f"{Config.COLLECTION_NAME}_{time.strftime('%Y%m%d%H%M%S')}"
+    build(client, target, args.workers)
+    if args.no_swap:
+        print(f"✅ 新集合 {target} 已就绪，切换: python reindex.py --swap {target}")
+        return
+    swap(client, target, drop_old=args.drop_old)
+    print(f"✅ 已切换到新集合 {target}")
+
+if __name__ == "__main__":
+    main()
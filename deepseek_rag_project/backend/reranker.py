@@ -0,0 +1,125 @@
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class CrossEncoderReranker:
+    """可选的重排序阶段：量化 (torch int8) 或 ONNX 导出的 cross-encoder，在独立线程池中运行，超出延迟预算即回退稠密排序。"""
+
+    def __init__(self):
+        from transformers import AutoTokenizer
+
+        self.model_name = Config.RERANK_MODEL
+        self.budget = Config.RERANK_BUDGET_MS / 1000
+        self.executor = ThreadPoolExecutor(max_workers=Config.RERANK_WORKERS, thread_name_prefix="rerank")
+        self.stats = {"reranked": 0, "fallbacks": 0, "busy": 0}
+        # 在途打分任务数：线程池占满时不再排队提交，直接回退
+        self.inflight = 0
+        self.inflight_lock = threading.Lock()
+
+        logger.info(f"🔀 加载 Reranker: {self.model_name} (Backend={Config.RERANK_BACKEND}, Budget={Config.RERANK_BUDGET_MS}ms)")
+        if Config.RERANK_BACKEND == "onnx":
+            import onnxruntime as ort
+            # 需预先用 optimum 导出: optimum-cli export onnx --model BAAI/bge-reranker-v2-m3 <RERANK_ONNX_PATH>
+            self.tokenizer = AutoTokenizer.from_pretrained(Config.RERANK_ONNX_PATH)
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = Config.RERANK_THREADS
+            self.session = ort.InferenceSession(
+                f"{Config.RERANK_ONNX_PATH}/model.onnx", options, providers=["CPUExecutionProvider"]
+            )
+            self.input_names = {i.name for i in self.session.get_inputs()}
+            self.model = None
+        else:
+            import torch
+            from transformers import AutoModelForSequenceClassification
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name, cache_dir=Config.MODEL_CACHE_DIR)
+            self.model = AutoModelForSequenceClassification.from_pretrained(
+                self.model_name, cache_dir=Config.MODEL_CACHE_DIR
+            ).eval()
+            # 🔥 与 Embedding 相同的动态量化 (FP32 -> Int8)
+            torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+            self.session = None
+
+    def score(self, query, texts):
+        """同步打分，返回与 texts 对齐的相关性分数"""
+        inputs = self.tokenizer(
+            [query] * len(texts), texts,
+            padding=True, truncation=True, max_length=Config.RERANK_MAX_LENGTH,
+            return_tensors="np" if self.session else "pt"
+        )
+        if self.session:
+            feeds = {k: v for k, v in inputs.items() if k in self.input_names}
+            logits = self.session.run(None, feeds)[0]
+            return [float(x) for x in logits.reshape(-1)]
+
+        import torch
+        with torch.inference_mode():
+            logits = self.model(**inputs).logits
+        return logits.view(-1).float().tolist()
+
+    def _score_until(self, query, texts, deadline):
+        """分块打分，每块之前检查截止时间：超时放弃 (返回 None)，不占用线程池继续算完"""
+        try:
+            scores = []
+            for i in range(0, len(texts), Config.RERANK_CHUNK):
+                if time.perf_counter() >= deadline:
+                    return None
+                scores.extend(self.score(query, texts[i:i + Config.RERANK_CHUNK]))
+            return scores
+        finally:
+            with self.inflight_lock:
+                self.inflight -= 1
+
+    async def rerank(self, query, nodes, top_n):
+        """返回 (nodes, 是否完成重排)。超时或出错时按原 (稠密/融合) 顺序截断"""
+        if len(nodes) <= 1:
+            return nodes[:top_n], False
+
+        with self.inflight_lock:
+            busy = self.inflight >= Config.RERANK_WORKERS
+            if not busy:
+                self.inflight += 1
+        if busy:
+            self.stats["busy"] += 1
+            self.stats["fallbacks"] += 1
+            logger.warning("⏱️ Rerank 线程池繁忙，回退稠密排序")
+            return nodes[:top_n], False
+
+        texts = [n.node.get_content() for n in nodes]
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        future = loop.run_in_executor(self.executor, self._score_until, query, texts, start + self.budget)
+        try:
+            scores = await asyncio.wait_for(future, timeout=self.budget)
+            if scores is None:
+                raise asyncio.TimeoutError()
+        except asyncio.TimeoutError:
+            self.stats["fallbacks"] += 1
+            logger.warning(f"⏱️ Rerank 超出预算 {Config.RERANK_BUDGET_MS}ms，回退稠密排序")
+            return nodes[:top_n], False
+        except Exception as e:
+            self.stats["fallbacks"] += 1
+            logger.error(f"❌ Rerank 失败，回退稠密排序: {e}")
+            return nodes[:top_n], False
+
+        ranked = sorted(zip(nodes, scores), key=lambda x: x[1], reverse=True)[:top_n]
+        for node, s in ranked:
+            node.score = s
+        self.stats["reranked"] += 1
+        logger.info(f"🔀 Rerank {len(nodes)} -> {top_n} 用时 {(time.perf_counter() - start) * 1000:.0f}ms")
+        return [node for node, _ in ranked], True
+
+_reranker = None
+_reranker_lock = threading.Lock()
+def get_reranker():
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = CrossEncoderReranker()
+    return _reranker
@@ -2,26 +2,59 @@ import os
 import shutil
 import threading
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Response
 from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from typing import Optional
-from pymilvus import MilvusClient
 
 from config import Config
 from utils import get_file_info_list
-from vector_store import get_vector_service
+from vector_store import get_vector_service, remove_report
 from rag_service import get_rag_service
 from session_manager import session_manager
+from job_queue import job_queue, PermanentJobError
+from query_cache import query_cache
+from answer_cache import answer_cache
+from streaming import STREAM_MEDIA_TYPES, encode_event, coalesce_tokens
+from generation_scheduler import generation_scheduler, GenerationQueueFull
 from video_service import get_video_service
+from metrics import TraceMiddleware, Gauge, render_metrics
 
-Config.validate()
+# 入库任务：由 job_queue 的固定大小线程池执行，失败抛异常触发重试 (PermanentJobError 直接失败)
+def check_job_file(job, exts):
+    """文件缺失或类型不支持时重试也不会成功，直接让任务失败"""
+    if not os.path.isfile(job["file_path"]):
+        raise PermanentJobError(f"文件不存在: {job['file_name']}")
+    ext = os.path.splitext(job["file_name"])[1].lower()
+    if ext not in exts:
+        raise PermanentJobError(f"不支持的文件类型: {ext or job['file_name']}")
+
+def process_document_job(job, progress):
+    check_job_file(job, Config.DOC_EXTS + Config.IMAGE_EXTS)
+    if not get_vector_service().process_file(job["file_path"], progress=progress):
+        raise RuntimeError("文档解析或入库失败，详见服务日志")
+
+def process_video_job(job, progress):
+    check_job_file(job, Config.VIDEO_EXTS)
+    video_svc = get_video_service()
+    vector_svc = get_vector_service()
+    progress(0.05, "多模态分析中")
+    report = video_svc.process_video(job["file_path"])
+    progress(0.8, "分析报告入库中")
+    if not vector_svc.insert_text(report, job["file_name"]):
+        raise RuntimeError("视频报告入库失败，详见服务日志")
 
 # 🚀【新增】生命周期管理器：服务启动时自动预加载模型
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # 校验与任务注册放在启动钩子里：PDF 解析的 spawn 子进程若重新导入本模块，不会重复执行
+    Config.validate()
+    job_queue.register("document", process_document_job, Config.DOC_INGEST_WORKERS)
+    job_queue.register("video", process_video_job, Config.VIDEO_INGEST_WORKERS)
+
     print("\n🚀 [System] 正在后台预加载 AI 模型，请稍候...")
     
     # 1. 在后台线程预加载 VideoService (视觉+听觉模型)
@@ -36,11 +69,18 @@ async def lifespan(app: FastAPI):
             print(f"❌ [System] 模型预加载失败: {e}")
 
     # 启动后台线程进行加载，不阻塞 Server 启动
-    threading.Thread(target=preload_models, daemon=True).start()
+    if Config.PRELOAD_VIDEO_MODELS:
+        threading.Thread(target=preload_models, daemon=True).start()
+
+    # 2. 启动持久化入库任务队列 (会恢复上次未完成的任务)
+    job_queue.start()
     
     yield
-    # 服务关闭时的清理逻辑 (如果有)
+    # 服务关闭时的清理逻辑
     print("👋 [System] 服务正在关闭...")
+    job_queue.stop()
+    # 提交 write-behind 队列中尚未落盘的消息
+    session_manager.close()
 
 app = FastAPI(title="DeepSeek RAG Enterprise", lifespan=lifespan)
 
@@ -49,23 +89,65 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["X-Session-Id"] 
+    expose_headers=["X-Session-Id", "X-Next-Cursor", "Retry-After", "X-Trace-Id"]
+)
+# 放在 CORS 之后注册 = 最外层，耗时包含整个中间件栈
+app.add_middleware(TraceMiddleware)
+
+# 调度器与写队列的实时状态，随 /metrics 一起采集
+Gauge("rag_generation_active", "正在生成的请求数", lambda: generation_scheduler.active)
+Gauge("rag_generation_queued", "排队等待生成的请求数", lambda: generation_scheduler.queued)
+Gauge(
+    "rag_generation_requests_total", "生成调度累计计数 (accepted / rejected / completed / timeouts)",
+    lambda: {(k,): v for k, v in generation_scheduler.counters.items()}, ["result"], kind="counter",
 )
+Gauge("rag_session_pending_writes", "会话存储 write-behind 队列中未落盘的语句数", lambda: len(session_manager.pending))
 
 class ChatRequest(BaseModel):
     input: str
     session_id: Optional[str] = None
+    # text (默认) / ndjson / sse，见 streaming.py
+    stream_format: Optional[str] = None
+
+def resolve_stream_format(stream_format):
+    fmt = (stream_format or "text").lower()
+    if fmt not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"不支持的流式格式: {stream_format}")
+    return fmt
+
+async def release_generation(ticket):
+    generation_scheduler.release(ticket)
 
-# 后台任务：处理永久入库的视频
-def process_video_task(file_path: str, filename: str):
+def stream_response(generator, fmt, session_id, ticket=None):
+    return StreamingResponse(
+        generator,
+        media_type=STREAM_MEDIA_TYPES[fmt],
+        # 关闭 nginx 对该响应的缓冲，合并后的 chunk 直接转发
+        headers={"X-Session-Id": session_id, "Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # 响应结束后归还生成名额 (release 可重复调用)：客户端在读取响应体前断开、生成器从未启动时也会执行
+        background=BackgroundTask(release_generation, ticket) if ticket is not None else None
+    )
+
+def admit_generation():
+    """在开始流式响应前准入，队列已满时直接返回 429 + Retry-After"""
     try:
-        video_svc = get_video_service()
-        vector_svc = get_vector_service()
-        report = video_svc.process_video(file_path)
-        vector_svc.insert_text(report, filename)
-        print(f"✅ 视频 {filename} 处理并入库完成")
-    except Exception as e:
-        print(f"❌ 视频处理后台任务失败: {e}")
+        return generation_scheduler.admit()
+    except GenerationQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def stream_answer(rag, query, session_id, context, fmt, ticket):
+    """转发 chat_events (合并小 token 后按协议编码)，回答以列表累积，结束后落库并触发摘要"""
+    answer_parts = []
+    async for event in coalesce_tokens(rag.chat_events(query, session_id, context=context, ticket=ticket)):
+        if event["type"] == "token":
+            answer_parts.append(event["text"])
+        elif event["type"] == "error":
+            answer_parts.append(event["message"])
+        data = encode_event(event, fmt)
+        if data:
+            yield data
+    session_manager.add_message(session_id, "assistant", "".join(answer_parts))
+    rag.schedule_summary(session_id)
 
 @app.post("/api/chat/upload")
 async def upload_chat_file(
@@ -82,7 +164,7 @@ async def upload_chat_file(
         video_svc = get_video_service()
         
         ext = os.path.splitext(file.filename)[1].lower()
-        if ext in ['.mp4', '.avi', '.mov', '.mkv', '.flv']:
+        if ext in Config.VIDEO_EXTS:
             # 放入线程池执行，防止卡死
             report = await run_in_threadpool(video_svc.process_video, file_path)
             
@@ -105,36 +187,36 @@ async def upload_chat_file(
 
 @app.post("/api/chat")
 async def chat_endpoint(req: ChatRequest):
-    session_id = req.session_id
-    if not session_id:
-        session_id = session_manager.create_session(title=req.input[:20])
-    
-    session_manager.add_message(session_id, "user", req.input)
-    current_context = session_manager.get_session_context(session_id)
+    fmt = resolve_stream_format(req.stream_format)
+    ticket = admit_generation()
+    try:
+        session_id = req.session_id
+        if not session_id:
+            session_id = session_manager.create_session(title=req.input[:20])
+
+        session_manager.add_message(session_id, "user", req.input)
+        current_context = session_manager.get_session_context(session_id)
+    except BaseException:
+        # 响应返回前出错，名额不会再经过生成器或 BackgroundTask 归还
+        generation_scheduler.release(ticket)
+        raise
 
     async def response_generator():
-        rag = get_rag_service()
-        full_answer = ""
         try:
-            async for chunk in rag.chat_stream(req.input, session_id, context=current_context):
-                full_answer += chunk
-                yield chunk
-            
-            clean_answer = full_answer.split("__SOURCES__")[0]
-            session_manager.add_message(session_id, "assistant", clean_answer)
+            rag = get_rag_service()
+            async for data in stream_answer(rag, req.input, session_id, current_context, fmt, ticket):
+                yield data
         except Exception as e:
             err_msg = f"Error: {str(e)}"
-            yield err_msg
+            yield encode_event({"type": "error", "message": err_msg}, fmt)
             session_manager.add_message(session_id, "assistant", err_msg)
+        finally:
+            generation_scheduler.release(ticket)
 
-    return StreamingResponse(
-        response_generator(), 
-        media_type="text/plain",
-        headers={"X-Session-Id": session_id}
-    )
+    return stream_response(response_generator(), fmt, session_id, ticket)
 
 @app.post("/api/upload")
-async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...)):
     try:
         file_path = os.path.join(Config.FILES_DIR, file.filename)
         with open(file_path, "wb") as buffer:
@@ -142,17 +224,41 @@ async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File
             
         file_ext = os.path.splitext(file.filename)[1].lower()
         
-        if file_ext in ['.mp4', '.avi', '.mov', '.mkv', '.flv']:
-            background_tasks.add_task(process_video_task, file_path, file.filename)
-            return {"message": "视频已上传，系统正在后台进行多模态分析...", "filename": file.filename}
+        if file_ext in Config.VIDEO_EXTS:
+            job_id = job_queue.submit("video", file_path, file.filename)
+            return {"message": "视频已上传，系统正在后台进行多模态分析...", "filename": file.filename, "job_id": job_id}
         else:
-            vector_service = get_vector_service()
-            background_tasks.add_task(vector_service.process_file, file_path)
-            return {"message": "上传成功，后台处理中...", "filename": file.filename}
+            job_id = job_queue.submit("document", file_path, file.filename)
+            return {"message": "上传成功，后台处理中...", "filename": file.filename, "job_id": job_id}
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/jobs")
+def list_jobs(limit: int = 50, status: Optional[str] = None):
+    return job_queue.list_jobs(limit=min(limit, 200), status=status)
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+@app.get("/api/generation/stats")
+def generation_stats():
+    """生成调度器：并发、排队深度、排队等待 p50/p95、拒绝次数"""
+    return generation_scheduler.stats()
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus 文本格式：各阶段耗时直方图 (rag_chat_stage_seconds 等) 与调度状态"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    return {**query_cache.stats(), "answers": answer_cache.stats()}
+
 @app.get("/api/files")
 def list_files():
     return get_file_info_list(Config.FILES_DIR)
@@ -160,15 +266,10 @@ def list_files():
 @app.delete("/api/files/{filename}")
 def delete_file(filename: str):
     file_path = os.path.join(Config.FILES_DIR, filename)
-    try:
-        client = MilvusClient(uri=Config.MILVUS_URI)
-        if client.has_collection(Config.COLLECTION_NAME):
-            client.delete(
-                collection_name=Config.COLLECTION_NAME,
-                filter=f'file_name == "{filename}"'
-            )
-    except Exception as e:
-        print(f"⚠️ 向量删除警告: {e}")
+    # 向量、稀疏索引、清单与缓存的删除顺序由 delete_file_index 统一维护
+    if not get_vector_service().delete_file_index(filename):
+        print(f"⚠️ 向量删除警告: {filename} 的索引未能完全删除")
+    remove_report(filename)
 
     if os.path.exists(file_path):
         try:
@@ -179,13 +280,25 @@ def delete_file(filename: str):
             
     raise HTTPException(status_code=404, detail="文件不存在")
 
+# 游标分页：响应体仍为列表，下一页游标放在 X-Next-Cursor 响应头 (没有更多时不返回)
 @app.get("/api/sessions")
-def list_sessions():
-    return session_manager.get_sessions()
+def list_sessions(response: Response, limit: int = Config.SESSIONS_PAGE_SIZE, cursor: Optional[str] = None):
+    try:
+        sessions, next_cursor = session_manager.get_sessions(limit=max(1, min(limit, Config.MAX_PAGE_SIZE)), cursor=cursor)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return sessions
 
 @app.get("/api/sessions/{session_id}/messages")
-def get_session_history(session_id: str):
-    return session_manager.get_messages(session_id)
+def get_session_history(session_id: str, response: Response, limit: int = Config.MESSAGES_PAGE_SIZE, before: Optional[int] = None):
+    messages, next_cursor = session_manager.get_messages(
+        session_id, limit=max(1, min(limit, Config.MAX_PAGE_SIZE)), before=before
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return messages
 
 @app.delete("/api/sessions/{session_id}")
 def delete_session_endpoint(session_id: str):
@@ -199,21 +312,31 @@ def delete_session_endpoint(session_id: str):
 async def chat_multimodal_endpoint(
     file: UploadFile = File(...),
     input: Optional[str] = Form(None),
-    session_id: Optional[str] = Form(None)
+    session_id: Optional[str] = Form(None),
+    stream_format: Optional[str] = Form(None)
 ):
+    fmt = resolve_stream_format(stream_format)
+    ticket = admit_generation()
     user_input = input if input else "请分析这个视频"
     current_session_id = session_id
 
-    if not current_session_id or current_session_id == "null" or current_session_id == "":
-        current_session_id = session_manager.create_session(title=user_input[:20])
-    
     file_path = os.path.join(Config.FILES_DIR, f"temp_chat_{file.filename}")
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    try:
+        if not current_session_id or current_session_id == "null" or current_session_id == "":
+            current_session_id = session_manager.create_session(title=user_input[:20])
+
+        with open(file_path, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+    except BaseException:
+        generation_scheduler.release(ticket)
+        raise
 
     async def response_generator():
         try:
-            yield "⏳ 正在调用多模态模型分析视频（预加载模型已就绪）...\n"
+            yield encode_event({
+                "type": "stage", "stage": "video_analysis", "status": "start",
+                "message": "⏳ 正在调用多模态模型分析视频（预加载模型已就绪）...\n"
+            }, fmt)
             
             video_svc = get_video_service()
             # 此时模型应该已经加载好了，直接跑
@@ -224,32 +347,28 @@ async def chat_multimodal_endpoint(
             if os.path.exists(file_path):
                 os.remove(file_path)
                 
-            yield "✅ 视频分析完成！正在生成回答...\n"
+            yield encode_event({
+                "type": "stage", "stage": "video_analysis", "status": "done",
+                "message": "✅ 视频分析完成！正在生成回答...\n"
+            }, fmt)
             
             session_manager.add_message(current_session_id, "user", user_input)
             
             rag = get_rag_service()
             current_context = session_manager.get_session_context(current_session_id)
             
-            full_answer = ""
-            async for chunk in rag.chat_stream(user_input, current_session_id, context=current_context):
-                full_answer += chunk
-                yield chunk
-                
-            clean_answer = full_answer.split("__SOURCES__")[0]
-            session_manager.add_message(current_session_id, "assistant", clean_answer)
+            async for data in stream_answer(rag, user_input, current_session_id, current_context, fmt, ticket):
+                yield data
             
         except Exception as e:
             err_msg = f"\n❌ 处理出错: {str(e)}"
-            yield err_msg
+            yield encode_event({"type": "error", "message": err_msg}, fmt)
             session_manager.add_message(current_session_id, "assistant", err_msg)
+        finally:
+            generation_scheduler.release(ticket)
 
-    return StreamingResponse(
-        response_generator(), 
-        media_type="text/plain",
-        headers={"X-Session-Id": current_session_id}
-    )
+    return stream_response(response_generator(), fmt, current_session_id, ticket)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=Config.API_PORT)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=Config.API_PORT)
@@ -2,26 +2,69 @@ import sqlite3
 import uuid
 import json
 import time
+import base64
+import logging
 import threading
+from collections import Counter
 from datetime import datetime
 from config import Config
 
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _is_transient(error):
+    """其他连接持有写锁导致的失败，稍后重试即可成功"""
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
 class SessionManager:
-    def __init__(self):
-        # check_same_thread=False 允许在不同线程使用连接，但需要应用层加锁
-        self.conn = sqlite3.connect(Config.DB_PATH, check_same_thread=False)
-        self.lock = threading.Lock() # 🔒 核心优化：添加线程锁
+    """
+    会话存储：WAL 模式下读写互不阻塞，每个线程持有自己的连接，读操作并行执行。
+
+    写入采用 write-behind：调用方只把语句放进内存队列即返回，后台写线程每隔几毫秒或攒够 N 条
+    合并成一个事务提交，请求路径上不再承担 fsync。读某个会话前若它还有未落盘的写入，
+    先等这些写入提交 (读己之写，会阻塞调用线程，异步代码需放到线程中调用)；会话上下文直接从内存中的待写值读取，无需等待。
+    数据库被锁等暂时失败的语句放回队首重试，超过次数或其他错误才记录完整语句后丢弃。
+    """
+
+    def __init__(self, db_path=Config.DB_PATH):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
         self.create_tables()
 
+        self.cond = threading.Condition()
+        self.pending = []                  # [(session_id, sql, params)]，按提交顺序执行
+        self.pending_sessions = Counter()  # session_id -> 未落盘 (含正在提交) 的语句数
+        self.pending_context = {}          # session_id -> 未落盘的最新上下文
+        self.creating = set()              # 建会话语句尚未落盘的 session_id
+        self.flush_requested = False
+        self.stopping = False
+        self.stats = {"batches": 0, "rows": 0, "errors": 0}
+        self.retries = {}                  # id(待重试语句) -> 已失败次数，只由写线程访问
+        # 写线程在第一次写入时启动：只导入本模块的进程 (如 spawn 出的解析子进程) 不会多出一个线程
+        self.writer = None
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=Config.SESSION_DB_TIMEOUT, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # WAL 下 NORMAL 只在断电时可能丢失最近的提交，不会损坏数据库
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
     def create_tables(self):
-        with self.lock:
-            cursor = self.conn.cursor()
+        conn = self._conn()
+        with self.write_lock, conn:
+            cursor = conn.cursor()
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS sessions (
                     id TEXT PRIMARY KEY,
                     title TEXT,
                     created_at TIMESTAMP,
-                    context TEXT  
+                    context TEXT
                 )
             ''')
             cursor.execute('''
@@ -34,64 +77,252 @@ class SessionManager:
                     FOREIGN KEY (session_id) REFERENCES sessions (id)
                 )
             ''')
-            self.conn.commit()
+            # 滚动摘要：summary 概括 id <= summary_upto 的消息 (旧库自动补列)
+            columns = {row[1] for row in cursor.execute('PRAGMA table_info(sessions)')}
+            if "summary" not in columns:
+                cursor.execute("ALTER TABLE sessions ADD COLUMN summary TEXT DEFAULT ''")
+            if "summary_upto" not in columns:
+                cursor.execute('ALTER TABLE sessions ADD COLUMN summary_upto INTEGER DEFAULT 0')
+            # 按会话取消息 / 按时间倒序分页取会话，均走索引
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions (created_at, id)')
+
+    # --- write-behind ---
+
+    def _enqueue(self, session_id, sql, params=()):
+        with self.cond:
+            if self.stopping:
+                raise RuntimeError("会话存储已关闭")
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._writer_loop, name="session-writer", daemon=True)
+                self.writer.start()
+            self.pending.append((session_id, sql, params))
+            self.pending_sessions[session_id] += 1
+            # 队列由空变非空时唤醒写线程开始计时，攒够一批时立即提交
+            if len(self.pending) == 1 or len(self.pending) >= Config.WRITE_BEHIND_BATCH:
+                self.cond.notify_all()
+
+    def _writer_loop(self):
+        max_wait = Config.WRITE_BEHIND_MAX_WAIT_MS / 1000
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopping:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                deadline = time.monotonic() + max_wait
+                while len(self.pending) < Config.WRITE_BEHIND_BATCH and not (self.flush_requested or self.stopping):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                ops, self.pending = self.pending, []
+                self.flush_requested = False
+
+            retry = self._apply(ops)
+
+            with self.cond:
+                # 暂时失败 (如数据库被其他写入方锁住) 的语句放回队首，保持与后续写入的顺序，下一批重试
+                if retry:
+                    self.pending[:0] = retry
+                    retried = Counter(session_id for session_id, _, _ in retry)
+                else:
+                    retried = Counter()
+                for session_id, _, _ in ops:
+                    if retried[session_id] > 0:
+                        retried[session_id] -= 1
+                        continue
+                    self.pending_sessions[session_id] -= 1
+                    if self.pending_sessions[session_id] <= 0:
+                        del self.pending_sessions[session_id]
+                        self.pending_context.pop(session_id, None)
+                    # 会话的第一条语句就是建会话，同批或更早批次已提交
+                    self.creating.discard(session_id)
+                self.cond.notify_all()
+
+    def _apply(self, ops):
+        """提交一批语句，返回需要重试的语句"""
+        conn = self._conn()
+        try:
+            with self.write_lock, conn:
+                for _, sql, params in ops:
+                    conn.execute(sql, params)
+            self.stats["batches"] += 1
+            self.stats["rows"] += len(ops)
+            self.retries.clear()
+            return []
+        except sqlite3.Error as e:
+            # 整批失败时逐条重试，只处理真正出错的语句
+            logger.error(f"❌ 会话批量写入失败，逐条重试: {e}")
+        retry = []
+        for op in ops:
+            _, sql, params = op
+            if retry:
+                # 前面有语句等待重试时，后续语句一并延后，保持写入顺序
+                retry.append(op)
+                continue
+            try:
+                with self.write_lock, conn:
+                    conn.execute(sql, params)
+                self.retries.pop(id(op), None)
+                self.stats["rows"] += 1
+            except sqlite3.OperationalError as row_error:
+                if not _is_transient(row_error):
+                    self._drop(op, row_error)
+                    continue
+                attempts = self.retries.get(id(op), 0) + 1
+                if attempts <= Config.WRITE_BEHIND_MAX_RETRIES:
+                    self.retries[id(op)] = attempts
+                    retry.append(op)
+                    logger.warning(f"⚠️ 会话写入暂时失败，稍后重试 ({attempts}/{Config.WRITE_BEHIND_MAX_RETRIES}): {row_error}")
+                else:
+                    self.retries.pop(id(op), None)
+                    self._drop(op, row_error)
+            except sqlite3.Error as row_error:
+                self._drop(op, row_error)
+        if retry:
+            # 给占用数据库的写入方让出时间
+            time.sleep(Config.WRITE_BEHIND_MAX_WAIT_MS / 1000)
+        return retry
+
+    def _drop(self, op, error):
+        session_id, sql, params = op
+        self.stats["errors"] += 1
+        logger.error(f"❌ 会话写入失败，已丢弃: {error} (session={session_id}, sql={sql}, params={params!r})")
+
+    def _wait_until(self, idle):
+        """等待 idle() 成立，期间要求写线程立即提交而不是等满批"""
+        with self.cond:
+            if idle():
+                return
+            self.flush_requested = True
+            self.cond.notify_all()
+            while not idle():
+                self.cond.wait()
+
+    def _wait_for(self, session_id):
+        self._wait_until(lambda: session_id not in self.pending_sessions)
+
+    def flush(self):
+        self._wait_until(lambda: not self.pending_sessions)
+
+    def close(self):
+        """服务关闭时调用：提交全部待写语句后停止写线程"""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+            writer = self.writer
+        if writer is not None:
+            writer.join()
+        logger.info(f"💾 会话存储已落盘: {self.stats['rows']} 条写入, {self.stats['batches']} 个批次")
+
+    def _read(self, sql, params=()):
+        return self._conn().execute(sql, params).fetchall()
 
     def create_session(self, title="新会话"):
         session_id = str(uuid.uuid4())
-        with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute(
+        with self.cond:
+            self.pending_context[session_id] = ""
+            self.creating.add(session_id)
+            self._enqueue(
+                session_id,
                 'INSERT INTO sessions (id, title, created_at, context) VALUES (?, ?, ?, ?)',
                 (session_id, title, datetime.now(), "")
             )
-            self.conn.commit()
         return session_id
 
     def update_session_context(self, session_id, context_text):
-        with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                'UPDATE sessions SET context = ? WHERE id = ?',
-                (context_text, session_id)
-            )
-            self.conn.commit()
+        with self.cond:
+            self.pending_context[session_id] = context_text
+            self._enqueue(session_id, 'UPDATE sessions SET context = ? WHERE id = ?', (context_text, session_id))
 
     def get_session_context(self, session_id):
-        # 读操作通常不需要加锁，但为了保险起见避免争用，也可以加
-        with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT context FROM sessions WHERE id = ?', (session_id,))
-            result = cursor.fetchone()
-        return result[0] if result else ""
+        with self.cond:
+            if session_id in self.pending_context:
+                return self.pending_context[session_id]
+        rows = self._read('SELECT context FROM sessions WHERE id = ?', (session_id,))
+        return rows[0][0] if rows else ""
 
     def add_message(self, session_id, role, content):
-        with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                'INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)',
-                (session_id, role, content, datetime.now())
+        self._enqueue(
+            session_id,
+            'INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)',
+            (session_id, role, content, datetime.now())
+        )
+
+    def get_messages(self, session_id, limit=Config.MESSAGES_PAGE_SIZE, before=None):
+        """
+        倒序分页：返回 id < before 的最近 limit 条 (按时间正序) 和下一页游标。
+        游标即本页最早一条消息的 id，没有更早的消息时为 None。
+        """
+        self._wait_for(session_id)
+        if before is None:
+            rows = self._read(
+                'SELECT id, role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?',
+                (session_id, limit + 1)
+            )
+        else:
+            rows = self._read(
+                'SELECT id, role, content FROM messages WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?',
+                (session_id, before, limit + 1)
+            )
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        messages = [{"id": row[0], "role": row[1], "content": row[2]} for row in reversed(rows[:limit])]
+        return messages, next_cursor
+
+    def get_recent_messages(self, session_id, limit):
+        """只取最近 limit 条 (按时间正序)，读取量不随会话长度增长"""
+        return self.get_messages(session_id, limit)[0]
+
+    def get_messages_between(self, session_id, after_id, before_id, limit):
+        """取 after_id < id < before_id 的最早 limit 条，供摘要增量合并"""
+        self._wait_for(session_id)
+        rows = self._read(
+            'SELECT id, role, content FROM messages WHERE session_id = ? AND id > ? AND id < ? ORDER BY id ASC LIMIT ?',
+            (session_id, after_id, before_id, limit)
+        )
+        return [{"id": row[0], "role": row[1], "content": row[2]} for row in rows]
+
+    def get_summary(self, session_id):
+        """返回 (摘要, 已概括到的消息 id)"""
+        self._wait_for(session_id)
+        rows = self._read('SELECT summary, summary_upto FROM sessions WHERE id = ?', (session_id,))
+        return (rows[0][0] or "", rows[0][1] or 0) if rows else ("", 0)
+
+    def update_summary(self, session_id, summary, upto):
+        self._enqueue(
+            session_id,
+            'UPDATE sessions SET summary = ?, summary_upto = ? WHERE id = ?',
+            (summary, upto, session_id)
+        )
+
+    def get_sessions(self, limit=Config.SESSIONS_PAGE_SIZE, cursor=None):
+        """按创建时间倒序的游标分页，返回 (sessions, next_cursor)；游标编码了上一页最后一条的 (created_at, id)"""
+        # 只需等待新建的会话落盘，不必等其他会话的消息写入
+        self._wait_until(lambda: not self.creating)
+        if cursor is None:
+            rows = self._read(
+                'SELECT id, title, created_at FROM sessions ORDER BY created_at DESC, id DESC LIMIT ?',
+                (limit + 1,)
+            )
+        else:
+            created_at, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            rows = self._read(
+                'SELECT id, title, created_at FROM sessions '
+                'WHERE created_at < ? OR (created_at = ? AND id < ?) '
+                'ORDER BY created_at DESC, id DESC LIMIT ?',
+                (created_at, created_at, last_id, limit + 1)
             )
-            self.conn.commit()
-
-    def get_messages(self, session_id):
-        with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT role, content FROM messages WHERE session_id = ? ORDER BY id ASC', (session_id,))
-            rows = cursor.fetchall()
-        return [{"role": row[0], "content": row[1]} for row in rows]
-
-    def get_sessions(self):
-        with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT id, title, created_at FROM sessions ORDER BY created_at DESC')
-            rows = cursor.fetchall()
-        return [{"id": row[0], "title": row[1], "created_at": row[2]} for row in rows]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = base64.urlsafe_b64encode(json.dumps([last[2], last[0]]).encode()).decode()
+        return [{"id": row[0], "title": row[1], "created_at": row[2]} for row in rows[:limit]], next_cursor
 
     def delete_session(self, session_id):
-        with self.lock:
-            cursor = self.conn.cursor()
-            cursor.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
-            cursor.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
-            self.conn.commit()
+        # 与该会话之前的写入保持顺序，并等待删除真正生效后再返回
+        self._enqueue(session_id, 'DELETE FROM messages WHERE session_id = ?', (session_id,))
+        self._enqueue(session_id, 'DELETE FROM sessions WHERE id = ?', (session_id,))
+        self._wait_for(session_id)
 
-session_manager = SessionManager()
\ No newline at end of file
+session_manager = SessionManager()
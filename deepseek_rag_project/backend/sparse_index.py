@@ -0,0 +1,521 @@
+"""
+中文 BM25 稀疏倒排索引：入库时增量登记切片，落盘为若干只读段 seg-<版本>/ ("词典 JSON + 倒排表二进制"，倒排表以 mmap 方式加载)。
+每次 commit() 只把改动过的切片写成一个增量段，被删除或替换的旧切片记为墓碑，写出新清单 manifest-<版本>.json
+后原子替换指针文件 CURRENT 发布；查询方按 CURRENT 加载清单，未变化的段直接复用。
+段数或墓碑占比超过阈值 (SPARSE_MAX_SEGMENTS / SPARSE_MERGE_RATIO) 时后台从 SQLite 全量合并为一个基础段。
+
+补建已有集合的索引：python sparse_index.py --backfill；立即合并所有段：python sparse_index.py --rebuild
+"""
+import os
+import re
+import json
+import math
+import time
+import mmap
+import heapq
+import sqlite3
+import logging
+import uuid
+import fcntl
+import shutil
+import argparse
+import threading
+from contextlib import contextmanager
+import unicodedata
+from array import array
+from collections import Counter, defaultdict
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 保留最近几份清单及其引用的段：加载中的查询方读到指针后，对应文件不会立即被删除
+_KEEP_GENERATIONS = 3
+# 单条 SQL 的参数个数上限以内分批查询
+_LOOKUP_BATCH = 500
+
+_TOKEN_RE = re.compile(r"[\u4e00-\u9fff]+|[a-z0-9]+")
+
+def tokenize(text: str):
+    """中文按字 bigram 切分 (无需分词词典，"第二十三条" 这类条款号也能精确命中)，字母数字按整词"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for run in _TOKEN_RE.findall(text):
+        if run[0].isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """RRF 融合多路排序结果，返回 [(id, score)]，按分数降序"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+class _Segment:
+    """只读段：doc_ids / doc_lens / 词典在内存，倒排表 mmap；seq 为发布时的改动日志序号"""
+    __slots__ = ("name", "seq", "doc_ids", "doc_lens", "total_len", "terms", "postings", "mm", "positions")
+
+    def __init__(self, name, seq, meta, postings, mm):
+        self.name = name
+        self.seq = seq
+        self.doc_ids = meta["doc_ids"]
+        self.doc_lens = meta["doc_lens"]
+        self.total_len = sum(self.doc_lens)
+        self.terms = meta["terms"]
+        self.postings = postings
+        self.mm = mm
+        self.positions = {node_id: i for i, node_id in enumerate(self.doc_ids)}
+
+class SparseIndex:
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, index_dir=None):
+        # 运行时读取配置 (压测替身会在导入后改写 SPARSE_INDEX_DIR)
+        index_dir = index_dir or Config.SPARSE_INDEX_DIR
+        self.index_dir = index_dir
+        self.current_path = os.path.join(index_dir, "CURRENT")
+        self.lock_path = os.path.join(index_dir, "commit.lock")
+        os.makedirs(index_dir, exist_ok=True)
+
+        # 切片词频是索引的权威来源，落盘段由它构建；sparse_log 记录每次改动的切片，commit 据此写增量段
+        self.conn = sqlite3.connect(Config.DB_PATH, timeout=Config.SESSION_DB_TIMEOUT, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.lock = threading.Lock()
+        # 段的构建与发布串行：进程内 commit_lock，跨进程 (reindex.py 等) 再加文件锁
+        self.commit_lock = threading.Lock()
+        self.create_tables()
+
+        self.loaded_version = None
+        self.manifest = None
+        self.segments = {}  # 段名 -> _Segment，未变化的段在重新加载时复用
+        # (段列表, 墓碑 {node_id: seq}, 有效切片数, 平均长度) 整体替换，查询方拿到的始终是同一版本
+        self.state = ([], {}, 0, 0.0)
+        self.full_rebuild = False
+        self.merging = False
+        self._maybe_reload()
+        if self.manifest is None:
+            # 首次启动或旧版单段格式：从 SQLite 全量构建
+            self.commit(full=True)
+
+    def create_tables(self):
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sparse_chunks (
+                    node_id TEXT PRIMARY KEY,
+                    file_name TEXT,
+                    text TEXT,
+                    terms TEXT
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_sparse_chunks_file ON sparse_chunks (file_name)')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sparse_log (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    node_id TEXT
+                )
+            ''')
+            self.conn.commit()
+
+    # --- 写入 (入库时调用，最后 commit() 发布增量段) ---
+
+    def add_chunks(self, chunks):
+        """chunks: [(node_id, file_name, text)]"""
+        rows = [
+            (node_id, file_name, text, json.dumps(Counter(tokenize(text))))
+            for node_id, file_name, text in chunks
+        ]
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO sparse_chunks (node_id, file_name, text, terms) VALUES (?, ?, ?, ?)', rows
+            )
+            self.conn.executemany('INSERT INTO sparse_log (node_id) VALUES (?)', [(row[0],) for row in rows])
+            self.conn.commit()
+
+    def add_nodes(self, nodes):
+        self.add_chunks([(n.node_id, n.metadata.get("file_name", ""), n.get_content()) for n in nodes])
+
+    def remove_ids(self, node_ids):
+        with self.lock:
+            self.conn.executemany('DELETE FROM sparse_chunks WHERE node_id = ?', [(i,) for i in node_ids])
+            self.conn.executemany('INSERT INTO sparse_log (node_id) VALUES (?)', [(i,) for i in node_ids])
+            self.conn.commit()
+
+    def remove_file(self, file_name):
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO sparse_log (node_id) SELECT node_id FROM sparse_chunks WHERE file_name = ?', (file_name,)
+            )
+            self.conn.execute('DELETE FROM sparse_chunks WHERE file_name = ?', (file_name,))
+            self.conn.commit()
+
+    def replace_all(self, chunks):
+        """整体替换切片 (chunks: [(node_id, file_name, text)])，重建集合切换别名后调用，随后 commit() 全量构建"""
+        rows = [
+            (node_id, file_name, text, json.dumps(Counter(tokenize(text))))
+            for node_id, file_name, text in chunks
+        ]
+        with self.lock:
+            self.conn.execute('DELETE FROM sparse_chunks')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO sparse_chunks (node_id, file_name, text, terms) VALUES (?, ?, ?, ?)', rows
+            )
+            self.conn.commit()
+            self.full_rebuild = True
+
+    @contextmanager
+    def _commit_guard(self):
+        with self.commit_lock:
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _segment_dir(self, name):
+        return os.path.join(self.index_dir, f"seg-{name}")
+
+    def _manifest_path(self, version):
+        return os.path.join(self.index_dir, f"manifest-{version}.json")
+
+    def _read_current(self):
+        try:
+            with open(self.current_path, encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _new_version():
+        # 版本号按时间递增，附随机后缀保证多进程下唯一
+        return f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+
+    @staticmethod
+    def _write_durable(path, write):
+        with open(path, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_segment(self, rows):
+        """rows: [(node_id, terms_json)]，写出一个段目录并返回段名"""
+        doc_ids, doc_lens = [], []
+        inverted = defaultdict(list)
+        for doc_idx, (node_id, terms_json) in enumerate(rows):
+            terms = json.loads(terms_json)
+            doc_ids.append(node_id)
+            doc_lens.append(sum(terms.values()))
+            for term, tf in terms.items():
+                inverted[term].append((doc_idx, tf))
+
+        postings = array("I")
+        term_dict = {}
+        for term in sorted(inverted):
+            entries = inverted[term]
+            term_dict[term] = [len(postings) // 2, len(entries)]
+            for doc_idx, tf in entries:
+                postings.append(doc_idx)
+                postings.append(tf)
+
+        name = self._new_version()
+        meta = {"version": name, "doc_ids": doc_ids, "doc_lens": doc_lens, "terms": term_dict}
+        seg_dir = self._segment_dir(name)
+        os.makedirs(seg_dir)
+        self._write_durable(os.path.join(seg_dir, "postings.bin"), postings.tofile)
+        self._write_durable(
+            os.path.join(seg_dir, "meta.json"),
+            lambda f: f.write(json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        )
+        return name
+
+    def _publish(self, segments, tombstones, log_seq):
+        """写出新清单后原子替换 CURRENT 指针，查询方按版本自动重新加载"""
+        version = self._new_version()
+        manifest = {"version": version, "log_seq": log_seq, "segments": segments, "tombstones": tombstones}
+        self._write_durable(
+            self._manifest_path(version),
+            lambda f: f.write(json.dumps(manifest, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        )
+        tmp_current = f"{self.current_path}.{version}.tmp"
+        with open(tmp_current, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_current, self.current_path)
+        # 已发布的改动不再需要日志
+        with self.lock:
+            self.conn.execute('DELETE FROM sparse_log WHERE seq <= ?', (log_seq,))
+            self.conn.commit()
+        self._prune(version)
+
+    def commit(self, full=False):
+        """发布改动：只把本次改动的切片写成增量段，被删除或替换的旧切片记为墓碑；
+        full=True (或 replace_all 之后) 从 SQLite 全量构建单个基础段。段数或墓碑过多时在后台合并。"""
+        with self._commit_guard():
+            # 其他进程可能刚发布过，先加载磁盘上的最新清单
+            self._maybe_reload()
+            # 增量段必须基于磁盘上的最新清单，加载失败时退回全量构建；持有提交锁期间指针不会再变
+            with self.lock:
+                stale = self.loaded_version != self._read_current()
+            if full or stale or self.full_rebuild or self.manifest is None:
+                self._rebuild()
+            else:
+                self._commit_delta()
+        self._maybe_reload()
+        self._maybe_merge()
+
+    def _rebuild(self):
+        with self.lock:
+            log_seq = self.conn.execute('SELECT COALESCE(MAX(seq), 0) FROM sparse_log').fetchone()[0]
+            rows = self.conn.execute('SELECT node_id, terms FROM sparse_chunks ORDER BY node_id').fetchall()
+            self.full_rebuild = False
+        name = self._write_segment(rows)
+        self._publish([[name, log_seq]], {}, log_seq)
+        logger.info(f"📇 稀疏索引已全量构建: {len(rows)} 个切片")
+
+    def _commit_delta(self):
+        with self.lock:
+            manifest, loaded = self.manifest, self.state[0]
+            since = manifest["log_seq"]
+            log = self.conn.execute(
+                'SELECT seq, node_id FROM sparse_log WHERE seq > ? ORDER BY seq', (since,)
+            ).fetchall()
+            if not log:
+                return
+            log_seq = log[-1][0]
+            touched = list({node_id for _, node_id in log})
+            rows = []
+            for i in range(0, len(touched), _LOOKUP_BATCH):
+                batch = touched[i:i + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows.extend(self.conn.execute(
+                    f'SELECT node_id, terms FROM sparse_chunks WHERE node_id IN ({placeholders})', batch
+                ).fetchall())
+
+        segments = list(manifest["segments"])
+        if rows:
+            segments.append([self._write_segment(sorted(rows)), log_seq])
+        # 旧段中的同 ID 切片 (已删除或被增量段中的新版本替换) 记为墓碑；从未落盘过的切片无需记录
+        tombstones = dict(manifest["tombstones"])
+        for node_id in touched:
+            if any(node_id in seg.positions for seg in loaded):
+                tombstones[node_id] = log_seq
+        self._publish(segments, tombstones, log_seq)
+        logger.info(f"📇 稀疏索引增量段已发布: 改动 {len(touched)} 个切片, 共 {len(segments)} 个段, {len(tombstones)} 个墓碑")
+
+    def _needs_merge(self):
+        segments, tombstones, n_docs, _ = self.state
+        if len(segments) <= 1:
+            return False
+        delta_docs = sum(len(seg.doc_ids) for seg in segments[1:])
+        return (len(segments) > Config.SPARSE_MAX_SEGMENTS
+                or delta_docs + len(tombstones) > Config.SPARSE_MERGE_RATIO * max(n_docs, 1))
+
+    def _maybe_merge(self):
+        with self.lock:
+            if self.merging or not self._needs_merge():
+                return
+            self.merging = True
+        threading.Thread(target=self._merge, name="sparse-merge", daemon=True).start()
+
+    def _merge(self):
+        """后台合并：从 SQLite 全量构建基础段替换所有段；合并期间的新改动留在日志中，由下一次 commit 补上"""
+        try:
+            with self._commit_guard():
+                self._maybe_reload()
+                if self._needs_merge():
+                    self._rebuild()
+            self._maybe_reload()
+        except Exception as e:
+            logger.error(f"❌ 稀疏索引后台合并失败: {e}")
+        finally:
+            self.merging = False
+
+    def _prune(self, current):
+        """保留最近几份清单及其引用的段，其余删除 (含旧版本的 gen-* 目录与单文件格式、中断留下的临时指针)"""
+        manifests = sorted(name[9:-5] for name in os.listdir(self.index_dir)
+                           if name.startswith("manifest-") and name.endswith(".json"))
+        keep = set(manifests[-_KEEP_GENERATIONS:]) | {current}
+        referenced = set()
+        for version in manifests:
+            if version not in keep:
+                try:
+                    os.remove(self._manifest_path(version))
+                except FileNotFoundError:
+                    pass
+                continue
+            try:
+                with open(self._manifest_path(version), encoding="utf-8") as f:
+                    referenced.update(name for name, _ in json.load(f)["segments"])
+            except (FileNotFoundError, ValueError):
+                pass
+        for name in os.listdir(self.index_dir):
+            path = os.path.join(self.index_dir, name)
+            if (name.startswith("seg-") and name[4:] not in referenced) or name.startswith("gen-"):
+                shutil.rmtree(path, ignore_errors=True)
+            elif name in ("sparse.meta.json", "sparse.postings.bin") or (name.startswith("CURRENT.") and name.endswith(".tmp")):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    # --- 查询 ---
+
+    def _load_segment(self, name, seq):
+        seg_dir = self._segment_dir(name)
+        with open(os.path.join(seg_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != name:
+            raise ValueError(f"段版本不一致: {meta.get('version')} != {name}")
+        postings, mm = None, None
+        postings_path = os.path.join(seg_dir, "postings.bin")
+        if os.path.getsize(postings_path) > 0:
+            with open(postings_path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            postings = memoryview(mm).cast("I")
+        return _Segment(name, seq, meta, postings, mm)
+
+    def _load_version(self, version):
+        with open(self._manifest_path(version), encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != version:
+            raise ValueError(f"清单版本不一致: {manifest.get('version')} != {version}")
+        # 未变化的段直接复用，增量提交只加载新段
+        segments = [self.segments.get(name) or self._load_segment(name, seq) for name, seq in manifest["segments"]]
+        return manifest, segments
+
+    def _maybe_reload(self):
+        version = self._read_current()
+        if version is None or version == self.loaded_version:
+            return
+        with self.lock:
+            # 在锁内重读指针：等锁期间其他线程可能已加载更新的版本，不能回退到旧版本
+            version = self._read_current()
+            # 读到指针后清单或段可能已被更新的提交清理：重读指针重试，仍失败则继续使用已加载的版本
+            for _ in range(3):
+                if version is None or version == self.loaded_version:
+                    return
+                try:
+                    manifest, segments = self._load_version(version)
+                    break
+                except (FileNotFoundError, ValueError) as e:
+                    latest = self._read_current()
+                    if latest == version:
+                        # 指针未变 (如旧版格式)，重试无意义
+                        logger.warning(f"⚠️ 稀疏索引版本 {version} 加载失败: {e}")
+                        return
+                    version = latest
+            else:
+                return
+            tombstones = manifest["tombstones"]
+            n_docs = sum(len(seg.doc_ids) for seg in segments)
+            total_len = sum(seg.total_len for seg in segments)
+            for node_id, seq in tombstones.items():
+                for seg in segments:
+                    pos = seg.positions.get(node_id)
+                    if pos is not None and seg.seq < seq:
+                        n_docs -= 1
+                        total_len -= seg.doc_lens[pos]
+            # 旧 mmap 交给 GC 回收，避免正在进行的查询读到已关闭的映射
+            self.segments = {seg.name: seg for seg in segments}
+            self.state = (segments, tombstones, n_docs, total_len / n_docs if n_docs else 0.0)
+            self.manifest = manifest
+            self.loaded_version = version
+
+    def search(self, query: str, top_k: int):
+        """BM25 检索 (跨段合并，跳过墓碑)，返回 [(node_id, score)]"""
+        self._maybe_reload()
+        segments, tombstones, n_docs, avgdl = self.state
+        if not n_docs:
+            return []
+
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            hits = []
+            for seg in segments:
+                entry = seg.terms.get(term)
+                if not entry or seg.postings is None:
+                    continue
+                offset, df = entry
+                block = seg.postings[offset * 2:(offset + df) * 2]
+                for i in range(0, len(block), 2):
+                    node_id = seg.doc_ids[block[i]]
+                    if tombstones:
+                        deleted = tombstones.get(node_id)
+                        if deleted is not None and seg.seq < deleted:
+                            continue
+                    hits.append((node_id, block[i + 1], seg.doc_lens[block[i]]))
+            if not hits:
+                continue
+            df = len(hits)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for node_id, tf, doc_len in hits:
+                norm = self.K1 * (1 - self.B + self.B * doc_len / avgdl)
+                scores[node_id] += idf * tf * (self.K1 + 1) / (tf + norm)
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda x: x[1])
+
+    def get_chunks(self, node_ids):
+        """返回 {node_id: (text, file_name)}，用于补全只被稀疏检索命中的切片"""
+        if not node_ids:
+            return {}
+        placeholders = ",".join("?" * len(node_ids))
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT node_id, text, file_name FROM sparse_chunks WHERE node_id IN ({placeholders})', list(node_ids)
+            ).fetchall()
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def get_file_chunks(self, file_name):
+        """返回 [(node_id, text)]"""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT node_id, text FROM sparse_chunks WHERE file_name = ?', (file_name,)
+            ).fetchall()
+
+    def backfill_from_vector_store(self, batch=1000):
+        """从现有向量库补建索引。按主键键集分页 (id > 上一页最后一个 id)：Milvus 的 offset + limit 不能超过 16384，
+        而按主键过滤的 query 结果按主键升序返回，任意规模的集合都能遍历完"""
+        from vector_store import build_vector_client
+        client = build_vector_client()
+        last_id, total = "", 0
+        while True:
+            rows = client.query(
+                collection_name=Config.COLLECTION_ALIAS,
+                filter=f'id > "{last_id}"',
+                output_fields=["id", "text", "file_name"],
+                limit=batch,
+            )
+            if not rows:
+                break
+            self.add_chunks([(r["id"], r.get("file_name", ""), r.get("text", "")) for r in rows])
+            total += len(rows)
+            last_id = max(r["id"] for r in rows)
+            logger.info(f"   📇 已补建 {total} 个切片")
+        self.commit(full=True)
+        return total
+
+_sparse_index = None
+_sparse_lock = threading.Lock()
+def get_sparse_index():
+    global _sparse_index
+    if _sparse_index is None:
+        with _sparse_lock:
+            if _sparse_index is None:
+                _sparse_index = SparseIndex()
+    return _sparse_index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BM25 稀疏索引维护")
+    parser.add_argument("--backfill", action="store_true", help="从向量库 (Milvus / 嵌入式) 补建索引")
+    parser.add_argument("--rebuild", action="store_true", help="从 SQLite 全量构建，合并所有增量段")
+    args = parser.parse_args()
+    if args.rebuild:
+        get_sparse_index().commit(full=True)
+    if args.backfill:
+        count = get_sparse_index().backfill_from_vector_store()
+        print(f"✅ 已补建 {count} 个切片")
@@ -0,0 +1,75 @@
+"""
+聊天流式输出协议：
+  - text   (默认，兼容旧前端)：text/plain，只输出回答文本
+  - ndjson：application/x-ndjson，每行一个 JSON 事件
+  - sse   ：text/event-stream，event 字段为事件类型，data 为 JSON
+事件类型见 RAGService.chat_events；相邻的小 token 先合并再写出，减少 chunk 数 (系统调用 / nginx 转发开销)。
+"""
+import json
+import asyncio
+from config import Config
+
+STREAM_MEDIA_TYPES = {
+    "text": "text/plain",
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+def encode_event(event, fmt):
+    if fmt == "text":
+        # 纯文本只携带回答与带提示语的阶段事件 (如视频分析进度)
+        if event["type"] == "token":
+            return event["text"]
+        return event.get("message", "")
+    data = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+    if fmt == "sse":
+        return f"event: {event['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+async def coalesce_tokens(events, max_chars=Config.STREAM_FLUSH_CHARS, max_wait_ms=Config.STREAM_FLUSH_MS):
+    """
+    合并相邻的 token 事件：攒够 max_chars 个字符，或第一个 token 等待超过 max_wait_ms 即写出；
+    第一个 token 立即写出，不增加首字延迟；其他类型的事件会先冲刷已缓冲的文本，保证顺序不变。
+    """
+    loop = asyncio.get_running_loop()
+    max_wait = max_wait_ms / 1000
+    iterator = events.__aiter__()
+    buffer, size, first_at = [], 0, 0.0
+    started = False
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(0.0, first_at + max_wait - loop.time()) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # 上游暂时没有新 token，按时限写出已缓冲的部分
+                yield {"type": "token", "text": "".join(buffer)}
+                buffer, size = [], 0
+                continue
+
+            task, pending = pending, None
+            try:
+                event = task.result()
+            except StopAsyncIteration:
+                break
+
+            if event["type"] == "token":
+                if not buffer:
+                    first_at = loop.time()
+                buffer.append(event["text"])
+                size += len(event["text"])
+                if size < max_chars and started:
+                    continue
+                started = True
+            if buffer:
+                yield {"type": "token", "text": "".join(buffer)}
+                buffer, size = [], 0
+            if event["type"] != "token":
+                yield event
+        if buffer:
+            yield {"type": "token", "text": "".join(buffer)}
+    finally:
+        if pending is not None:
+            pending.cancel()
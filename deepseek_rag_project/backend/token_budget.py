@@ -0,0 +1,90 @@
+import re
+import logging
+import threading
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+class TokenCounter:
+    """优先使用 LLM 对应的 tokenizer (仅本地缓存，不触发下载)；不可用时按字符估算 (中文 1 字 ≈ 1 token，偏保守)"""
+
+    def __init__(self):
+        self.tokenizer = None
+        try:
+            from transformers import AutoTokenizer
+            self.tokenizer = AutoTokenizer.from_pretrained(
+                Config.TOKENIZER_MODEL, cache_dir=Config.MODEL_CACHE_DIR, local_files_only=True
+            )
+            logger.info(f"🔢 Token 计数使用 tokenizer: {Config.TOKENIZER_MODEL}")
+        except Exception as e:
+            logger.warning(f"⚠️ 未找到本地 tokenizer ({Config.TOKENIZER_MODEL})，使用字符估算: {e}")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        cjk = len(_CJK_RE.findall(text))
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def cjk_chars(self, max_tokens: int, sample: str = "") -> int:
+        """把 token 上限换算成中文字数 (提示词里给模型的长度要求)，按 sample 中中文字符的实际 token 比例估算"""
+        cjk = "".join(_CJK_RE.findall(sample or ""))
+        ratio = len(cjk) / max(1, self.count(cjk)) if cjk else 1.0
+        return max(1, int(max_tokens * ratio))
+
+    def fit(self, text: str, budget: int, from_end: bool = False) -> str:
+        """token 数不超过 budget 的最长前缀 (from_end 时为后缀)，不加省略标记；二分查找"""
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            part = text[len(text) - mid:] if from_end else text[:mid]
+            if self.count(part) <= budget:
+                lo = mid
+            else:
+                hi = mid - 1
+        return text[len(text) - lo:] if from_end else text[:lo]
+
+    def truncate(self, text: str, max_tokens: int, keep_tail: bool = False) -> str:
+        """截断到 max_tokens 以内；keep_tail 时保留头尾、省略中间"""
+        if self.count(text) <= max_tokens:
+            return text
+        marker = "\n……（中间内容已省略）……\n" if keep_tail else "……（已截断）"
+        budget = max_tokens - self.count(marker)
+        if budget <= 0:
+            return ""
+        if keep_tail:
+            return self.fit(text, budget // 2) + marker + self.fit(text, budget - budget // 2, from_end=True)
+        return self.fit(text, budget) + marker
+
+def allocate(available: int, demands: dict, weights: dict) -> dict:
+    """按权重切分预算；需求小于份额的部分让给其他部分 (water-filling)"""
+    alloc = {k: 0 for k in demands}
+    active = {k for k, v in demands.items() if v > 0}
+    remaining = max(available, 0)
+    while active and remaining > 0:
+        total_weight = sum(weights[k] for k in active)
+        shares = {k: remaining * weights[k] // total_weight for k in active}
+        satisfied = {k for k in active if demands[k] - alloc[k] <= shares[k]}
+        if not satisfied:
+            for k in active:
+                alloc[k] += shares[k]
+            break
+        for k in satisfied:
+            remaining -= demands[k] - alloc[k]
+            alloc[k] = demands[k]
+        active -= satisfied
+    return alloc
+
+_counter = None
+_counter_lock = threading.Lock()
+def get_token_counter():
+    global _counter
+    if _counter is None:
+        with _counter_lock:
+            if _counter is None:
+                _counter = TokenCounter()
+    return _counter
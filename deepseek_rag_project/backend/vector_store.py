@@ -7,12 +7,17 @@ from llama_index.core import (
     Document
 )
 from llama_index.core.node_parser import SentenceSplitter
-from llama_index.vector_stores.milvus import MilvusVectorStore
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core.schema import MetadataMode, NodeRelationship
 from llama_index.llms.ollama import Ollama
-from pymilvus import MilvusClient
+from embedding_provider import get_embed_model, get_embedding_provider
+from ingest_manifest import ingest_manifest, hash_file, hash_text
+from query_cache import query_cache
+from answer_cache import answer_cache
+from sparse_index import get_sparse_index
+from metrics import INGEST_STAGE_SECONDS
+from pdf_pipeline import iter_pdf_pages, iter_page_windows
 import os
-import torch
+import time
 import logging
 import multiprocessing
 
@@ -32,6 +37,61 @@ try:
 except ImportError:
     pass
 
+def build_text_splitter(strategy=None):
+    if (strategy or Config.CHUNK_STRATEGY) == "regulation":
+        from regulation_splitter import RegulationSplitter
+        return RegulationSplitter(chunk_size=Config.CHUNK_SIZE, chunk_overlap=Config.CHUNK_OVERLAP)
+    return SentenceSplitter(
+        chunk_size=Config.CHUNK_SIZE,
+        chunk_overlap=Config.CHUNK_OVERLAP
+    )
+
+def build_file_extractor():
+    return {
+        ".txt": FlatReader(),
+        ".md": FlatReader(),
+        ".pdf": PDFReader(),
+        ".docx": DocxReader(),
+        ".doc": DocxReader()
+    }
+
+def build_vector_store():
+    """按 Config.VECTOR_BACKEND 创建 LlamaIndex 向量库；Milvus 的索引由 Config.VECTOR_INDEX_PROFILE 决定"""
+    if Config.VECTOR_BACKEND == "local":
+        from local_vector_store import get_local_vector_store
+        return get_local_vector_store()
+    from milvus_store import build_milvus_vector_store
+    return build_milvus_vector_store()
+
+def chunk_node_id(filename, chunk_hash):
+    """切片向量 ID 由文件名与切片内容决定，重新入库或重建集合时未变的切片 ID 不变"""
+    return f"{hash_text(filename)[:16]}-{chunk_hash[:32]}"
+
+def report_path(filename):
+    return os.path.join(Config.REPORTS_DIR, f"{filename}.txt")
+
+def save_report(filename, text):
+    """保存视频分析报告原文，换模型或切片参数重建集合时 (reindex.py) 无需重新分析视频"""
+    os.makedirs(Config.REPORTS_DIR, exist_ok=True)
+    tmp = report_path(filename) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, report_path(filename))
+
+def remove_report(filename):
+    try:
+        os.remove(report_path(filename))
+    except FileNotFoundError:
+        pass
+
+def build_vector_client():
+    """按 id / file_name 删除、分页遍历向量用的客户端：pymilvus.MilvusClient 或嵌入式向量库的兼容实现"""
+    if Config.VECTOR_BACKEND == "local":
+        from local_vector_store import LocalVectorClient, get_local_vector_index
+        return LocalVectorClient(get_local_vector_index())
+    from pymilvus import MilvusClient
+    return MilvusClient(uri=Config.MILVUS_URI)
+
 class VectorStoreService:
     def __init__(self):
         logger.info(f"⚙️ 初始化 LlamaIndex (高性能量化版)...")
@@ -46,36 +106,8 @@ class VectorStoreService:
             except Exception as e:
                 logger.warning(f"RapidOCR 初始化失败: {e}")
         
-        # 🚀 优化2: Embedding 模型动态量化与批处理
-        logger.info(f"   🔌 加载 Embedding: {Config.EMBEDDING_MODEL}")
-        logger.info(f"   ⚡ 正在应用 Embedding 动态量化 (Int8) + BatchSize={Config.EMBEDDING_BATCH_SIZE}...")
-        
-        # 1. 设置 Embedding 模型
-        # 注意：这里我们通过 Settings 间接加载，稍后手动 hack 进行量化
-        embed_model = HuggingFaceEmbedding(
-            model_name=Config.EMBEDDING_MODEL,
-            cache_folder=Config.MODEL_CACHE_DIR,
-            device="cpu",
-            embed_batch_size=Config.EMBEDDING_BATCH_SIZE # ✅ 启用批处理
-        )
-        
-        # 🔥【黑科技】手动对 LlamaIndex 内部的 Torch 模型进行动态量化
-        try:
-            # 深入获取内部的 sentence-transformers 模型
-            internal_model = embed_model._model
-            if hasattr(internal_model, 'encode'): # 确认是 SentenceTransformer
-                # 对其内部的 auto_model (Transformer本体) 进行量化
-                torch.quantization.quantize_dynamic(
-                    internal_model[0].auto_model, 
-                    {torch.nn.Linear}, 
-                    dtype=torch.qint8,
-                    inplace=True
-                )
-                logger.info("   ✅ Embedding 模型量化成功！(FP32 -> Int8)")
-        except Exception as e:
-            logger.warning(f"   ⚠️ Embedding 量化尝试失败 (将使用原精度): {e}")
-
-        Settings.embed_model = embed_model
+        # 🚀 优化2: Embedding 模型由进程级 Provider 统一加载 (只加载一次，入库与检索同精度)
+        Settings.embed_model = get_embed_model()
 
         # 2. 设置 LLM (DeepSeek/Qwen via Ollama)
         Settings.llm = Ollama(
@@ -84,34 +116,17 @@ class VectorStoreService:
             request_timeout=600.0
         )
 
-        Settings.text_splitter = SentenceSplitter(
-            chunk_size=Config.CHUNK_SIZE, 
-            chunk_overlap=Config.CHUNK_OVERLAP
-        )
+        Settings.text_splitter = build_text_splitter()
         
-        # 🚀 优化3: 强制使用 HNSW 高速索引
-        # HNSW 是目前内存中检索速度最快、精度最高的算法
-        logger.info(f"🔌 连接 Milvus (HNSW Accelerated): {Config.MILVUS_URI}")
-        self.vector_store = MilvusVectorStore(
-            uri=Config.MILVUS_URI,
-            collection_name=Config.COLLECTION_NAME,
-            dim=Config.EMBEDDING_DIM,
-            overwrite=False,
-            # 🔥 核心优化点：定义 HNSW 索引参数
-            index_config={
-                "index_type": "HNSW",
-                "metric_type": "COSINE", # 余弦相似度
-                "params": {
-                    "M": 16,             # 节点最大连接数 (8-32, 越大精度越高但构建越慢)
-                    "efConstruction": 64 # 构建时的搜索深度 (64-200)
-                }
-            },
-            search_config={
-                "params": {"ef": 64}     # 搜索时的候选集大小
-            }
-        )
+        # 🚀 优化3: 索引 profile (HNSW / IVF_SQ8 / IVF_PQ ...) 由 Config.VECTOR_INDEX_PROFILE 选择，见 index_profiles.py
+        if Config.VECTOR_BACKEND == "local":
+            logger.info(f"🔌 使用嵌入式向量库 ({Config.LOCAL_VECTOR_QUANTIZATION}): {Config.LOCAL_VECTOR_DIR}")
+        else:
+            logger.info(f"🔌 连接 Milvus (profile={Config.VECTOR_INDEX_PROFILE}): {Config.MILVUS_URI}")
+        self.vector_store = build_vector_store()
         
-        self.milvus_client = MilvusClient(uri=Config.MILVUS_URI)
+        self.milvus_client = build_vector_client()
+        self.sparse_index = get_sparse_index()
         self.storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
         
         try:
@@ -122,39 +137,118 @@ class VectorStoreService:
         except Exception:
             self.index = VectorStoreIndex.from_documents([], storage_context=self.storage_context)
 
-        self.file_extractor = {
-            ".txt": FlatReader(),
-            ".md": FlatReader(),
-            ".pdf": PDFReader(),
-            ".docx": DocxReader(),
-            ".doc": DocxReader()
-        }
+        self.file_extractor = build_file_extractor()
 
-    def insert_text(self, text: str, filename: str):
+    def insert_text(self, text: str, filename: str, progress=None):
         """直接存入文本报告"""
         try:
             logger.info(f"📝 正在存入文本报告: {filename}")
+            save_report(filename, text)
+            with INGEST_STAGE_SECONDS.time(stage="hash"):
+                text_hash = hash_text(text)
+            if ingest_manifest.get_file_hash(filename) == text_hash:
+                logger.info(f"⏭️ 内容未变化，跳过入库: {filename}")
+                return True
             doc = Document(text=text)
             doc.metadata["file_name"] = filename
-            self.index.insert(doc)
+            with INGEST_STAGE_SECONDS.time(stage="chunking"):
+                nodes = Settings.text_splitter.get_nodes_from_documents([doc])
+            if progress: progress(0.9, "向量化中")
+            self._sync_nodes(filename, text_hash, nodes)
             logger.info(f"✅ 文本报告入库成功")
             return True
         except Exception as e:
             logger.error(f"❌ 文本入库失败: {e}")
             return False
 
-    def process_file(self, filepath: str):
+    def plan_sync(self, filename: str, nodes):
+        """对比清单中的切片哈希，返回 (新切片, 切片清单, 过期向量 ID, 是否为未登记文件)"""
+        known = ingest_manifest.get_chunks(filename)
+        # 清单中没有记录的文件可能有旧版本遗留的向量，需要整体清理
+        untracked = not known and ingest_manifest.get_file_hash(filename) is None
+
+        chunks = {}
+        new_nodes = []
+        for node in nodes:
+            chunk_hash = hash_text(node.get_content())
+            if chunk_hash in chunks:
+                continue
+            if chunk_hash in known:
+                chunks[chunk_hash] = known[chunk_hash]
+            else:
+                node.id_ = chunk_node_id(filename, chunk_hash)
+                # 切片器生成的前后邻接关系指向本次解析的随机 ID，换成确定性 ID 后已失效；
+                # 复用的旧切片也无法同步改写，统一去掉 (检索不依赖邻接关系)
+                node.relationships.pop(NodeRelationship.PREVIOUS, None)
+                node.relationships.pop(NodeRelationship.NEXT, None)
+                chunks[chunk_hash] = node.node_id
+                new_nodes.append(node)
+        stale_ids = [node_id for chunk_hash, node_id in known.items() if chunk_hash not in chunks]
+        return new_nodes, chunks, stale_ids, untracked
+
+    def delete_node_ids(self, node_ids):
+        if node_ids:
+            self.milvus_client.delete(collection_name=Config.COLLECTION_ALIAS, ids=list(node_ids))
+            self.sparse_index.remove_ids(node_ids)
+            query_cache.invalidate()
+
+    def _sync_nodes(self, filename: str, file_hash: str, nodes):
+        """按切片哈希增量同步：只向量化新切片，删除已过期的旧切片"""
+        new_nodes, chunks, stale_ids, untracked = self.plan_sync(filename, nodes)
+
+        if untracked:
+            self.delete_file_index(filename)
+        if new_nodes:
+            logger.info(f"   ⚡ 正在向量化 {len(new_nodes)} 个新切片 (复用 {len(chunks) - len(new_nodes)} 个)...")
+            # 先单独向量化 (命中磁盘缓存的切片不重新计算) 再写入，分别统计 embedding 与 Milvus 写入耗时 (已带向量的节点 insert_nodes 不会重复计算)
+            # PDF 流式入库时切片已在解析过程中向量化
+            pending = [node for node in new_nodes if node.embedding is None]
+            if pending:
+                with INGEST_STAGE_SECONDS.time(stage="embedding"):
+                    embeddings = get_embedding_provider().embed_documents(
+                        [node.get_content(metadata_mode=MetadataMode.EMBED) for node in pending]
+                    )
+                for node, embedding in zip(pending, embeddings):
+                    node.embedding = embedding
+            with INGEST_STAGE_SECONDS.time(stage="milvus_insert"):
+                self.index.insert_nodes(new_nodes)
+            self.sparse_index.add_nodes(new_nodes)
+        # 先写入新切片再删除旧切片，避免替换过程中检索不到该文件
+        if stale_ids:
+            logger.info(f"   🧹 删除 {len(stale_ids)} 个过期切片")
+            with INGEST_STAGE_SECONDS.time(stage="milvus_delete"):
+                self.delete_node_ids(stale_ids)
+
+        ingest_manifest.save_file(filename, file_hash, chunks)
+        if new_nodes or stale_ids:
+            with INGEST_STAGE_SECONDS.time(stage="sparse_commit"):
+                self.sparse_index.commit()
+            query_cache.invalidate()
+            answer_cache.invalidate_file(filename)
+        return len(new_nodes), len(stale_ids)
+
+    def process_file(self, filepath: str, progress=None):
+        start = time.perf_counter()
         try:
             logger.info(f"📄 处理文件 (高性能模式): {filepath}")
             filename = os.path.basename(filepath)
             file_ext = os.path.splitext(filename)[1].lower()
-            documents = []
-            
+            documents, nodes = [], []
+
+            # 🚀 优化4: 内容哈希未变化则直接跳过
+            with INGEST_STAGE_SECONDS.time(stage="hash"):
+                file_hash = hash_file(filepath)
+            if ingest_manifest.get_file_hash(filename) == file_hash:
+                logger.info(f"⏭️ 文件未变化，跳过入库: {filename}")
+                return True
+
+            if progress: progress(0.1, "解析中")
             # 图片 OCR 处理
-            if file_ext in ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']:
+            if file_ext in Config.IMAGE_EXTS:
                 if not self.ocr_engine: return False
                 # RapidOCR 本身支持路径输入
-                result, _ = self.ocr_engine(filepath)
+                with INGEST_STAGE_SECONDS.time(stage="ocr"):
+                    result, _ = self.ocr_engine(filepath)
                 ocr_text = ""
                 if result:
                     for line in result:
@@ -163,34 +257,73 @@ class VectorStoreService:
                 doc = Document(text=ocr_text)
                 doc.metadata["file_name"] = filename
                 documents = [doc]
+            elif file_ext == ".pdf":
+                # 🚀 PDF 按页并行解析 + 扫描页 OCR，边解析边切片、向量化
+                nodes = self._stream_pdf_nodes(filepath, filename, progress)
             else:
                 # 文档处理 - 利用 Embedding Batching 加速
-                documents = SimpleDirectoryReader(
-                    input_files=[filepath],
-                    file_extractor=self.file_extractor
-                ).load_data()
+                with INGEST_STAGE_SECONDS.time(stage="parse"):
+                    documents = SimpleDirectoryReader(
+                        input_files=[filepath],
+                        file_extractor=self.file_extractor
+                    ).load_data()
                 for doc in documents:
                     doc.metadata["file_name"] = filename
 
-            # 🚀 优化4: 批量插入 (Batch Insert)
-            # 虽然这里是一次 insert 一个文件的所有 docs，但 index.insert 内部会触发 embedding batching
+            # 🚀 优化5: 增量批量插入 (只 embedding 新切片，index.insert_nodes 内部会触发 embedding batching)
             if documents:
-                logger.info(f"   ⚡ 正在向量化 {len(documents)} 个文档片段...")
-                self.index.insert_nodes(
-                    Settings.text_splitter.get_nodes_from_documents(documents)
-                )
-                
+                if progress: progress(0.5, "向量化中")
+                with INGEST_STAGE_SECONDS.time(stage="chunking"):
+                    nodes = Settings.text_splitter.get_nodes_from_documents(documents)
+            # 解析结果为空也要同步：文件改动后没有内容时删除旧切片，并记录新哈希
+            if not nodes:
+                logger.warning(f"⚠️ {filename} 未解析出任何内容，清除该文件的旧切片")
+            self._sync_nodes(filename, file_hash, nodes)
+
+            INGEST_STAGE_SECONDS.observe(time.perf_counter() - start, stage="total")
             return True
         except Exception as e:
             logger.error(f"❌ 处理失败: {e}")
             return False
 
+    def _stream_pdf_nodes(self, filepath: str, filename: str, progress=None):
+        """页面按顺序流式到达，每攒够一个窗口就切片并向量化新切片；写入与删除仍在整份文件切完后一次同步"""
+        known = ingest_manifest.get_chunks(filename)
+        splitter = Settings.text_splitter
+        windows = iter_page_windows(iter_pdf_pages(filepath), splitter)
+        nodes, pages = [], 0
+        while True:
+            with INGEST_STAGE_SECONDS.time(stage="parse"):
+                window = next(windows, None)
+            if window is None:
+                break
+            pages += len(window)
+            with INGEST_STAGE_SECONDS.time(stage="chunking"):
+                window_nodes = splitter.get_nodes_from_documents(window)
+            fresh = [n for n in window_nodes if hash_text(n.get_content()) not in known]
+            if fresh:
+                with INGEST_STAGE_SECONDS.time(stage="embedding"):
+                    embeddings = get_embedding_provider().embed_documents(
+                        [n.get_content(metadata_mode=MetadataMode.EMBED) for n in fresh]
+                    )
+                for node, embedding in zip(fresh, embeddings):
+                    node.embedding = embedding
+            nodes.extend(window_nodes)
+            if progress: progress(0.5, f"解析/向量化中 (已处理 {pages} 页)")
+        logger.info(f"   📄 {filename}: {pages} 页, {len(nodes)} 个切片")
+        return nodes
+
     def delete_file_index(self, filename: str):
         try:
             self.milvus_client.delete(
-                collection_name=Config.COLLECTION_NAME,
+                collection_name=Config.COLLECTION_ALIAS,
                 filter=f'file_name == "{filename}"'
             )
+            ingest_manifest.remove_file(filename)
+            self.sparse_index.remove_file(filename)
+            self.sparse_index.commit()
+            query_cache.invalidate()
+            answer_cache.invalidate_file(filename)
             return True
         except Exception:
             return False
@@ -1,12 +1,12 @@
 import os
-import cv2
 import logging
-import torch
 import multiprocessing
 import shutil
-from PIL import Image
+import time
 from config import Config
-from qwen_vl_utils import process_vision_info
+from metrics import VIDEO_STAGE_SECONDS
+
+# torch / cv2 / PIL / qwen_vl_utils 在用到时才导入：server 模块被 PDF 解析的 spawn 子进程重新导入时不会加载这些库
 
 # 配置简洁的日志格式
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -24,8 +24,10 @@ class VideoService:
             return
 
         logger.info("Loading models...")
+        load_start = time.perf_counter()
         
         # 动态计算线程数
+        import torch
         total_cores = multiprocessing.cpu_count()
         compute_threads = max(1, total_cores - 4) 
         torch.set_num_threads(compute_threads)
@@ -65,6 +67,7 @@ class VideoService:
                 download_root=os.path.join(model_cache_path, "whisper") 
             )
             
+            VIDEO_STAGE_SECONDS.observe(time.perf_counter() - load_start, stage="model_load")
             logger.info("All models loaded successfully.")
         except Exception as e:
             logger.error(f"Model loading failed: {e}")
@@ -78,6 +81,7 @@ class VideoService:
         temp_audio_path = video_path + ".wav"
 
         try:
+            extract_start = time.perf_counter()
             video = VideoFileClip(video_path)
             if video.audio is None:
                 video.close()
@@ -85,7 +89,9 @@ class VideoService:
             
             video.audio.write_audiofile(temp_audio_path, codec='pcm_s16le', verbose=False, logger=None)
             video.close()
+            VIDEO_STAGE_SECONDS.observe(time.perf_counter() - extract_start, stage="audio_extract")
             
+            transcribe_start = time.perf_counter()
             segments, info = self.audio_model.transcribe(
                 temp_audio_path, 
                 beam_size=5, 
@@ -101,6 +107,8 @@ class VideoService:
                 end = int(segment.end)
                 text_lines.append(f"- [{start}s-{end}s]: {segment.text.strip()}")
             
+            # segments 是惰性生成器，遍历完才算转录结束
+            VIDEO_STAGE_SECONDS.observe(time.perf_counter() - transcribe_start, stage="transcription")
             final_text = "\n".join(text_lines)
             
             if os.path.exists(temp_audio_path): 
@@ -116,6 +124,8 @@ class VideoService:
     def analyze_frames(self, video_path):
         if not self.vl_model: return ""
 
+        import cv2
+        from PIL import Image
         logger.info("Starting visual analysis...")
         cap = cv2.VideoCapture(video_path)
         fps = cap.get(cv2.CAP_PROP_FPS) or 24
@@ -176,6 +186,7 @@ class VideoService:
         return "\n".join(descriptions)
 
     def _process_batch(self, images, timestamps, descriptions):
+        from qwen_vl_utils import process_vision_info
         try:
             print(f"Processing batch of {len(images)} frames...", flush=True)
             
@@ -212,7 +223,8 @@ class VideoService:
             inputs = inputs.to("cpu")
             
             # 推理
-            generated_ids = self.vl_model.generate(**inputs, max_new_tokens=128)
+            with VIDEO_STAGE_SECONDS.time(stage="vision_batch"):
+                generated_ids = self.vl_model.generate(**inputs, max_new_tokens=128)
             
             generated_ids_trimmed = [
                 out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
@@ -233,11 +245,14 @@ class VideoService:
             logger.error(f"Batch inference failed: {e}")
 
     def process_video(self, video_path):
+        start = time.perf_counter()
         self._load_models_if_needed()
         logger.info(f"Processing video: {os.path.basename(video_path)}")
         
-        visual_desc = self.analyze_frames(video_path)
+        with VIDEO_STAGE_SECONDS.time(stage="visual_analysis"):
+            visual_desc = self.analyze_frames(video_path)
         audio_text = self.extract_audio_text(video_path)
+        VIDEO_STAGE_SECONDS.observe(time.perf_counter() - start, stage="total")
         
         final_report = f"""
 # 视频智能分析报告
@@ -8,14 +8,28 @@ export default function App() {
   const [sessions, setSessions] = useState([]);
   const [currentSessionId, setCurrentSessionId] = useState(null);
   const [messages, setMessages] = useState([]);
+  // 游标分页：下一页游标来自响应头 X-Next-Cursor，为 null 表示没有更多
+  const [sessionsCursor, setSessionsCursor] = useState(null);
+  const [messagesCursor, setMessagesCursor] = useState(null);
 
-  // 加载会话列表
+  // 加载会话列表 (第一页)
   const loadSessions = () => {
     fetch('/api/sessions')
-      .then(res => res.json())
+      .then(res => {
+        setSessionsCursor(res.headers.get('X-Next-Cursor'));
+        return res.json();
+      })
       .then(data => setSessions(data));
   };
 
+  const loadMoreSessions = async () => {
+    if (!sessionsCursor) return;
+    const res = await fetch(`/api/sessions?cursor=${encodeURIComponent(sessionsCursor)}`);
+    const data = await res.json();
+    setSessionsCursor(res.headers.get('X-Next-Cursor'));
+    setSessions(prev => [...prev, ...data]);
+  };
+
   useEffect(() => {
     loadSessions();
   }, []);
@@ -24,6 +38,7 @@ export default function App() {
   const switchSession = async (id) => {
     setCurrentSessionId(id);
     setActiveTab('chat');
+    setMessagesCursor(null);
     if (!id) {
         setMessages([]);
         return;
@@ -31,12 +46,26 @@ export default function App() {
     try {
         const res = await fetch(`/api/sessions/${id}/messages`);
         const msgs = await res.json();
+        setMessagesCursor(res.headers.get('X-Next-Cursor'));
         setMessages(msgs);
     } catch (e) {
         console.error(e);
     }
   };
 
+  // 加载更早的消息 (向上翻页)
+  const loadOlderMessages = async () => {
+    if (!currentSessionId || !messagesCursor) return;
+    try {
+        const res = await fetch(`/api/sessions/${currentSessionId}/messages?before=${messagesCursor}`);
+        const older = await res.json();
+        setMessagesCursor(res.headers.get('X-Next-Cursor'));
+        setMessages(prev => [...older, ...prev]);
+    } catch (e) {
+        console.error(e);
+    }
+  };
+
   // 删除会话
   const handleDeleteSession = async (id) => {
     if (!confirm('确定要删除这条历史记录吗？')) return;
@@ -62,10 +91,21 @@ export default function App() {
       const res = await fetch('/api/chat', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ input: text, session_id: currentSessionId }),
+        body: JSON.stringify({ input: text, session_id: currentSessionId, stream_format: 'ndjson' }),
         signal: controller.signal
       });
 
+      // 生成队列已满：提示稍后重试
+      if (res.status === 429) {
+        const retryAfter = res.headers.get('Retry-After');
+        setMessages(prev => {
+          const newArr = [...prev];
+          newArr[newArr.length - 1] = { role: 'assistant', content: `⏳ 当前提问人数较多，请约 ${retryAfter || '几'} 秒后重试。`, sources: null };
+          return newArr;
+        });
+        return;
+      }
+
       // 🚀 关键修复：从响应头中获取 Session ID 并锁定状态
       // 防止连续对话产生碎片
       const newSessionId = res.headers.get('X-Session-Id');
@@ -74,36 +114,41 @@ export default function App() {
           loadSessions(); // 刷新侧边栏
       }
 
+      // NDJSON 事件流：每行一个 {type: token | sources | stage | timing | error}
       const reader = res.body.getReader();
       const decoder = new TextDecoder();
-      let fullBuffer = ''; 
-      
+      let pending = '';
+      let content = '';
+      let sources = null;
+
       while (true) {
         const { done, value } = await reader.read();
         if (done) break;
-        
-        const chunk = decoder.decode(value, { stream: true });
-        fullBuffer += chunk;
-        
-        let displayContent = fullBuffer;
-        let parsedSources = null;
-
-        if (fullBuffer.includes('__SOURCES__')) {
-            const parts = fullBuffer.split('__SOURCES__');
-            displayContent = parts[0];
-            try {
-                parsedSources = JSON.parse(parts[1]);
-            } catch (e) {
-                // JSON 传输中
-            }
+
+        pending += decoder.decode(value, { stream: true });
+        const lines = pending.split('\n');
+        pending = lines.pop(); // 最后一行可能不完整，留到下次
+
+        for (const line of lines) {
+          if (!line) continue;
+          const event = JSON.parse(line);
+          if (event.type === 'token') {
+            content += event.text;
+          } else if (event.type === 'sources') {
+            sources = event.sources;
+          } else if (event.type === 'error') {
+            content += event.message;
+          } else if (event.type === 'timing') {
+            console.debug('⏱️ 耗时', event);
+          }
         }
 
         setMessages(prev => {
           const newArr = [...prev];
           newArr[newArr.length - 1] = { 
               role: 'assistant', 
-              content: displayContent,
-              sources: parsedSources
+              content,
+              sources
           };
           return newArr;
         });
@@ -127,6 +172,8 @@ export default function App() {
         onSessionSelect={switchSession}
         onNewSession={() => switchSession(null)}
         onDeleteSession={handleDeleteSession}
+        hasMoreSessions={!!sessionsCursor}
+        onLoadMoreSessions={loadMoreSessions}
       />
       
       {activeTab === 'chat' ? (
@@ -135,6 +182,8 @@ export default function App() {
           setMessages={setMessages}
           sessionId={currentSessionId}
           onSendMessage={handleSendMessage}
+          hasOlderMessages={!!messagesCursor}
+          onLoadOlderMessages={loadOlderMessages}
         />
       ) : (
         <UploadManager />
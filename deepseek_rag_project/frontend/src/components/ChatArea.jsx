@@ -62,7 +62,7 @@ const SourceCard = ({ sources }) => {
   );
 };
 
-export default function ChatArea({ messages, setMessages, sessionId, onSendMessage }) {
+export default function ChatArea({ messages, setMessages, sessionId, onSendMessage, hasOlderMessages, onLoadOlderMessages }) {
   const [input, setInput] = useState('');
   const [loading, setLoading] = useState(false);
   const [showScrollButton, setShowScrollButton] = useState(false);
@@ -155,6 +155,15 @@ export default function ChatArea({ messages, setMessages, sessionId, onSendMessa
           </motion.div>
         ) : (
           <div style={{ maxWidth: '800px', margin: '0 auto', display: 'flex', flexDirection: 'column', gap: '16px' }}>
+            {/* 历史消息分页：向上加载更早的消息 */}
+            {hasOlderMessages && (
+              <button
+                onClick={onLoadOlderMessages}
+                style={{ alignSelf: 'center', padding: '4px 12px', background: 'rgba(255,255,255,0.8)', border: '1px solid #e0e7ff', borderRadius: '12px', fontSize: '12px', color: '#6366f1', cursor: 'pointer' }}
+              >
+                加载更早的消息
+              </button>
+            )}
             {messages.map((msg, idx) => (
               <motion.div key={idx} initial={{ opacity: 0, y: 10 }} animate={{ opacity: 1, y: 0 }} style={{ display: 'flex', gap: '10px', flexDirection: msg.role === 'user' ? 'row-reverse' : 'row', alignItems: 'flex-start' }}>
                 <div style={{ width: '28px', height: '28px', borderRadius: '8px', flexShrink: 0, display: 'flex', alignItems: 'center', justifyContent: 'center', background: msg.role === 'user' ? 'linear-gradient(135deg, #6366f1 0%, #4f46e5 100%)' : 'white', boxShadow: '0 2px 6px rgba(0,0,0,0.05)', color: msg.role === 'user' ? 'white' : '#6366f1' }}>{msg.role === 'user' ? <User size={16} /> : <Bot size={16} />}</div>
@@ -2,7 +2,7 @@ import React from 'react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { MessageSquare, FolderUp, Plus, Trash2, Bot, History } from 'lucide-react';
 
-export default function Sidebar({ activeTab, setActiveTab, sessions, currentSessionId, onSessionSelect, onNewSession, onDeleteSession }) {
+export default function Sidebar({ activeTab, setActiveTab, sessions, currentSessionId, onSessionSelect, onNewSession, onDeleteSession, hasMoreSessions, onLoadMoreSessions }) {
   return (
     <aside 
       className="sidebar-container"
@@ -178,6 +178,15 @@ export default function Sidebar({ activeTab, setActiveTab, sessions, currentSess
               </motion.div>
             ))}
           </AnimatePresence>
+          {/* 会话列表分页 */}
+          {hasMoreSessions && (
+            <button
+              onClick={onLoadMoreSessions}
+              style={{ padding: '8px', border: 'none', background: 'transparent', color: '#94a3b8', fontSize: '12px', cursor: 'pointer', flexShrink: 0 }}
+            >
+              加载更多
+            </button>
+          )}
         </div>
       </div>
     </aside>
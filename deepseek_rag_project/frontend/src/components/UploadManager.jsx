@@ -7,11 +7,31 @@ export default function UploadManager() {
   const [uploading, setUploading] = useState(false);
   const [progress, setProgress] = useState(0);
   const [status, setStatus] = useState(null);
+  const [jobs, setJobs] = useState([]);
 
   useEffect(() => {
     loadFiles();
+    loadJobs();
   }, []);
 
+  // 🚀 有排队/处理中的任务时轮询进度
+  const hasActiveJob = jobs.some(j => j.status === 'queued' || j.status === 'running');
+  useEffect(() => {
+    if (!hasActiveJob) return;
+    const timer = setInterval(loadJobs, 2000);
+    return () => clearInterval(timer);
+  }, [hasActiveJob]);
+
+  const loadJobs = async () => {
+    try {
+      const res = await fetch('/api/jobs?limit=10');
+      const data = await res.json();
+      setJobs(data);
+    } catch (e) {
+      console.error(e);
+    }
+  };
+
   const loadFiles = async () => {
     try {
       const res = await fetch('/api/files');
@@ -48,6 +68,7 @@ export default function UploadManager() {
             
         setStatus({ type: 'success', msg: msg });
         loadFiles();
+        loadJobs();
       } else {
         setStatus({ type: 'error', msg: '上传失败' });
       }
@@ -148,6 +169,38 @@ export default function UploadManager() {
           </motion.div>
         </div>
 
+        {/* 入库任务 */}
+        {jobs.length > 0 && (
+          <>
+            <h4 style={{ fontSize: '18px', fontWeight: '700', color: '#334155', marginBottom: '20px' }}>入库任务</h4>
+            <div style={{ background: 'white', borderRadius: '20px', padding: '8px', boxShadow: '0 4px 20px rgba(0,0,0,0.02)', marginBottom: '32px' }}>
+              {jobs.map((job, i) => (
+                <div
+                  key={job.id}
+                  style={{ padding: '12px 24px', borderBottom: i === jobs.length - 1 ? 'none' : '1px solid #f1f5f9' }}
+                >
+                  <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', fontSize: '14px' }}>
+                    <span style={{ fontWeight: '600', color: '#1e293b' }}>{job.file_name}</span>
+                    <span style={{ display: 'flex', alignItems: 'center', gap: '6px', color: job.status === 'failed' ? '#ef4444' : job.status === 'done' ? '#16a34a' : '#6366f1' }}>
+                      {job.status === 'done' && <CheckCircle size={16} />}
+                      {job.status === 'failed' && <AlertCircle size={16} />}
+                      {job.message}
+                    </span>
+                  </div>
+                  {(job.status === 'queued' || job.status === 'running') && (
+                    <div style={{ marginTop: '8px', background: '#f1f5f9', borderRadius: '8px', height: '6px', overflow: 'hidden' }}>
+                      <motion.div
+                        animate={{ width: `${Math.round(job.progress * 100)}%` }}
+                        style={{ height: '100%', background: '#6366f1' }}
+                      />
+                    </div>
+                  )}
+                </div>
+              ))}
+            </div>
+          </>
+        )}
+
         {/* 文件列表 */}
         <h4 style={{ fontSize: '18px', fontWeight: '700', color: '#334155', marginBottom: '20px' }}>文件列表</h4>
         <div style={{ background: 'white', borderRadius: '20px', padding: '8px', boxShadow: '0 4px 20px rgba(0,0,0,0.02)' }}>